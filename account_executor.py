@@ -0,0 +1,61 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from threading import Lock
+
+class AccountExecutor(object):
+    """
+        Thread pool where every key (account) behaves like an actor with a serial mailbox.
+
+        Tasks submitted with different keys run concurrently, tasks submitted with the same
+        key run one at a time in submission order. A busy key gives its worker back to the
+        pool every `fairness` tasks so it cannot starve the other keys.
+    """
+
+    executor: ThreadPoolExecutor
+    # k = key, v = deque of pending (future, fn, args), present while the key is scheduled
+    mailboxes: dict
+    lock: Lock
+    fairness: int
+
+    def __init__(self, max_workers: int, fairness: int = 16) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="account")
+        self.mailboxes = {}
+        self.lock = Lock()
+        self.fairness = fairness
+
+    def submit(self, key: str, fn, *args) -> Future:
+        future = Future()
+        with self.lock:
+            mailbox = self.mailboxes.get(key)
+            if mailbox is None:
+                self.mailboxes[key] = deque([(future, fn, args)])
+                self.executor.submit(self._drain, key)
+            else:
+                mailbox.append((future, fn, args))
+        return future
+
+    def _drain(self, key: str) -> None:
+        for _ in range(self.fairness):
+            with self.lock:
+                mailbox = self.mailboxes[key]
+                if not mailbox:
+                    del self.mailboxes[key]
+                    return
+                future, fn, args = mailbox.popleft()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        # let the other accounts run, the mailbox stays registered so the order is kept
+        self.executor.submit(self._drain, key)
+
+    def pending(self) -> int:
+        with self.lock:
+            return sum(len(mailbox) for mailbox in self.mailboxes.values())
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,116 @@
+from bisect import bisect_left, insort
+from threading import Lock
+import heapq
+
+class AccountIndex(object):
+    """
+        Secondary indexes of the research accounts, rebuilt from the accounts when the database is loaded.
+
+            - end dates: (end date ordinal, project_id) kept sorted, the accounts ending in a
+              range of days or still active on a day are found with bisect in O(log n + k)
+            - lead researchers: k = researcher, v = projects led by the researcher
+            - expiry heap: min-heap of the end dates of the accounts not expired yet, the sweeper
+              pops the accounts whose end date has passed in O(k log n)
+
+        End date and lead researcher of an account never change, an account is only added or removed.
+        Queries take the lock of the index, they can be run by read workers.
+    """
+
+    end_dates: list
+    # k = lead researcher, v = set of project_id
+    leads: dict
+    # (end date ordinal, project_id) of the accounts not expired yet
+    expiry_heap: list
+    # k = project_id, v = end date ordinal of the indexed accounts
+    indexed: dict
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.end_dates = []
+        self.leads = {}
+        self.expiry_heap = []
+        self.indexed = {}
+        self.lock = Lock()
+
+    @classmethod
+    def from_accounts(cls, accounts: dict) -> "AccountIndex":
+        index = cls()
+        for account in accounts.values():
+            index.indexed[account.project_id] = account.end_date.toordinal()
+            index.leads.setdefault(account.leading_researcher, set()).add(account.project_id)
+        index.end_dates = sorted((end, project_id) for project_id, end in index.indexed.items())
+        index.expiry_heap = [
+            (account.end_date.toordinal(), account.project_id)
+            for account in accounts.values() if not account.expired
+        ]
+        heapq.heapify(index.expiry_heap)
+        return index
+
+    def add(self, account) -> None:
+        end = account.end_date.toordinal()
+        with self.lock:
+            if account.project_id in self.indexed:
+                return
+            self.indexed[account.project_id] = end
+            insort(self.end_dates, (end, account.project_id))
+            self.leads.setdefault(account.leading_researcher, set()).add(account.project_id)
+            if not account.expired:
+                heapq.heappush(self.expiry_heap, (end, account.project_id))
+
+    def remove(self, account) -> None:
+        with self.lock:
+            end = self.indexed.pop(account.project_id, None)
+            if end is None:
+                return
+            position = bisect_left(self.end_dates, (end, account.project_id))
+            del self.end_dates[position]
+            projects = self.leads.get(account.leading_researcher)
+            if projects is not None:
+                projects.discard(account.project_id)
+                if not projects:
+                    del self.leads[account.leading_researcher]
+            # the heap entry is dropped when it is popped
+
+    def ending_between(self, first_day: int, last_day: int) -> list:
+        """
+            Accounts whose end date is in [first_day, last_day] (day ordinals), by end date
+        """
+        with self.lock:
+            start = bisect_left(self.end_dates, (first_day,))
+            end = bisect_left(self.end_dates, (last_day + 1,))
+            return [project_id for _, project_id in self.end_dates[start:end]]
+
+    def active_on(self, day: int) -> list:
+        """
+            Accounts that have not ended on the day, by end date
+        """
+        with self.lock:
+            start = bisect_left(self.end_dates, (day,))
+            return [project_id for _, project_id in self.end_dates[start:]]
+
+    def led_by(self, researcher: str, first_day: int = None, last_day: int = None) -> list:
+        """
+            Accounts led by the researcher, by end date, only the ones ending in [first_day, last_day] if given
+        """
+        with self.lock:
+            projects = [
+                (self.indexed[project_id], project_id) for project_id in self.leads.get(researcher, ())
+                if (first_day is None or self.indexed[project_id] >= first_day) and (last_day is None or self.indexed[project_id] <= last_day)
+            ]
+            return [project_id for _, project_id in sorted(projects)]
+
+    def due(self, day: int) -> list:
+        """
+            Pop the accounts whose end date is before the day
+        """
+        due = []
+        with self.lock:
+            while self.expiry_heap and self.expiry_heap[0][0] < day:
+                end, project_id = heapq.heappop(self.expiry_heap)
+                # accounts removed from the index (moved to another shard) are skipped
+                if self.indexed.get(project_id) == end:
+                    due.append(project_id)
+        return due
+
+    def __len__(self) -> int:
+        return len(self.indexed)
@@ -12,3 +12,19 @@ class Actions(Enum):
     LIST_TRANSACTIONS = "list transactions"
     ADD_RESEARCH_ACCOUNT = "add research account"
     REMOVE_RESEARCH_ACCOUNT = "remove research account"
+    LIST_ACCOUNTS = "list accounts"
+    QUERY_TRANSACTIONS = "query transactions"
+    SPENDING_REPORT = "spending report"
+
+# actions that only read the database, served from a snapshot by the read lane of the university
+READ_ONLY_ACTIONS: frozenset = frozenset({Actions.GET_DETAILS.value, Actions.LIST_TRANSACTIONS.value, Actions.LIST_ACCOUNTS.value,
+                                           Actions.QUERY_TRANSACTIONS.value, Actions.SPENDING_REPORT.value})
+
+WRITE_QUEUE: str = "university_requests_queue"
+READ_QUEUE: str = "university_read_requests_queue"
+
+def university_queue(request_type: str) -> str:
+    """
+        Queue of the university that serves a request
+    """
+    return READ_QUEUE if request_type in READ_ONLY_ACTIONS else WRITE_QUEUE
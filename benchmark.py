@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+from concurrent.futures import TimeoutError
+from threading import Lock, Thread
+from datetime import datetime
+from actions import Actions
+from codec import CODEC_NAMES, JSON_CONTENT_TYPE, encode
+from connection_pool import pool
+from rpc_client import RpcClient
+import argparse
+import shlex
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+COMMANDS_EXCHANGE: str = 'send_researchers_command'
+# a researcher has an account after the setup: its proposals measure the rejection path (see LoadGenerator)
+DEFAULT_MIX: str = "proposal=1,withdraw=5,add=1,remove=1,details=2,transactions=2"
+
+class LatencyStats(object):
+    """
+        Every sample of a measure, percentiles are exact
+    """
+
+    samples: list
+
+    def __init__(self) -> None:
+        self.samples = []
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def summary(self, elapsed: float) -> dict:
+        count = len(self.samples)
+        return {
+            "count": count,
+            "throughput": count / elapsed if elapsed > 0 else 0.0,
+            "mean_ms": sum(self.samples) / count * 1000 if count else 0.0,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p95_ms": self.percentile(0.95) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.percentile(1.0) * 1000
+        }
+
+class LoadGenerator(object):
+    """
+        Closed-loop load: every virtual user sends a command to its researcher, waits until
+        the researcher reports that the command is complete, then sends the next one.
+
+        Commands carry reply_to, the researcher answers with the status of the command and the
+        time spent on every hop (command delivery, researcher→funding agency, funding
+        agency→university, researcher→university).
+
+        The setup gives every researcher an account, and a researcher can lead only one: the
+        proposals of the run are rejected by the university check, the reservation of the funds
+        and the creation of the account are not measured. The statuses of every command are
+        reported with its latencies.
+    """
+
+    researchers: list
+    # k = command name, v = weight
+    mix: dict
+    users_per_researcher: int
+    content_type: str
+    timeout: float
+    run_id: str
+    rpc_client: RpcClient
+    lock: Lock
+    # k = action, v = LatencyStats of the whole command
+    latencies: dict
+    # k = action, v = {hop: LatencyStats}
+    hops: dict
+    # k = action, v = {status: count}
+    statuses: dict
+    timeouts: int
+    # researchers that have completed the setup
+    ready: set
+
+    def __init__(self, researchers: list, mix: dict, users_per_researcher: int = 1, content_type: str = JSON_CONTENT_TYPE, timeout: float = 30.0) -> None:
+        self.researchers = researchers
+        self.mix = mix
+        self.users_per_researcher = users_per_researcher
+        self.content_type = content_type
+        self.timeout = timeout
+        self.run_id = uuid.uuid4().hex[:6]
+        self.rpc_client = RpcClient("benchmark")
+        self.lock = Lock()
+        self.latencies = {}
+        self.hops = {}
+        self.statuses = {}
+        self.timeouts = 0
+        self.ready = set()
+
+    def command(self, researcher: int, name: str, sequence: int) -> dict:
+        """
+            Build a command like the ones parsed by main.py
+        """
+        # researchers added/removed by the benchmark are never started, the notifications are dropped
+        guest = f"Researcher-{len(self.researchers) + researcher + 1}"
+        if name == "proposal":
+            return {
+                "command": Actions.RESEARCH_PROPOSAL.value,
+                "project_id": f"B{self.run_id}-{researcher}-{sequence}",
+                "title": f"Benchmark {self.run_id}",
+                "description": "Load generated by benchmark.py",
+                "amount": "200000"
+            }
+        if name == "withdraw":
+            return {"command": Actions.WITHDRAW.value, "amount": str(random.randint(1, 100))}
+        if name == "add":
+            return {"command": Actions.ADD_RESEARCHER.value, "researcher": guest}
+        if name == "remove":
+            return {"command": Actions.REMOVE_RESEARCHER.value, "researcher": guest}
+        if name == "details":
+            return {"command": Actions.GET_DETAILS.value}
+        if name == "transactions":
+            return {"command": Actions.LIST_TRANSACTIONS.value, "limit": 50}
+        raise ValueError(f"unknown command '{name}'")
+
+    def send(self, researcher: int, command: dict) -> dict:
+        """
+            Send a command and wait for its completion, returns None on timeout
+        """
+        command["routing_key"] = self.researchers[researcher]
+        command["sent_at"] = time.time()
+        correlation_id = str(uuid.uuid4())
+        future = self.rpc_client.call_async(
+            self.researchers[researcher],
+            encode(command, "command", self.content_type),
+            correlation_id,
+            exchange=COMMANDS_EXCHANGE,
+            content_type=self.content_type
+        )
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.rpc_client.cancel(correlation_id)
+            return None
+
+    def setup(self) -> None:
+        """
+            Give every researcher an account, the researchers that are not ready yet get a retry
+        """
+        for attempt in range(3):
+            pending = [researcher for researcher in range(len(self.researchers)) if researcher not in self.ready]
+            if not pending:
+                return
+            threads = [Thread(target=self._setup_researcher, args=(researcher, attempt)) for researcher in pending]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def _setup_researcher(self, researcher: int, attempt: int) -> None:
+        completion = self.send(researcher, self.command(researcher, "proposal", -1 - attempt))
+        if completion is not None:
+            with self.lock:
+                self.ready.add(researcher)
+
+    def user(self, researcher: int, deadline: float) -> None:
+        names = list(self.mix)
+        weights = list(self.mix.values())
+        sequence = 0
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            completion = self.send(researcher, self.command(researcher, name, sequence))
+            elapsed = time.perf_counter() - start
+            sequence += 1
+
+            with self.lock:
+                if completion is None:
+                    self.timeouts += 1
+                    continue
+                self.latencies.setdefault(name, LatencyStats()).add(elapsed)
+                statuses = self.statuses.setdefault(name, {})
+                statuses[completion["status"]] = statuses.get(completion["status"], 0) + 1
+                for hop, seconds in (completion.get("hops") or {}).items():
+                    self.hops.setdefault(name, {}).setdefault(hop, LatencyStats()).add(seconds)
+
+    def run(self, duration: float) -> dict:
+        pool.declare_exchange(COMMANDS_EXCHANGE, 'direct')
+        self.setup()
+
+        started = time.monotonic()
+        deadline = started + duration
+        users = [
+            Thread(target=self.user, args=(researcher, deadline), daemon=True)
+            for researcher in range(len(self.researchers))
+            for _ in range(self.users_per_researcher)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.monotonic() - started
+
+        return self.results(elapsed)
+
+    def results(self, elapsed: float) -> dict:
+        total = LatencyStats()
+        hops = {}
+        actions = {}
+        for name, stats in self.latencies.items():
+            total.samples.extend(stats.samples)
+            actions[name] = {
+                **stats.summary(elapsed),
+                "statuses": self.statuses.get(name, {}),
+                "hops": {hop: hop_stats.summary(elapsed) for hop, hop_stats in self.hops.get(name, {}).items()}
+            }
+            for hop, hop_stats in self.hops.get(name, {}).items():
+                hops.setdefault(hop, LatencyStats()).samples.extend(hop_stats.samples)
+
+        return {
+            "elapsed": elapsed,
+            "timeouts": self.timeouts,
+            "total": total.summary(elapsed),
+            "actions": actions,
+            "hops": {hop: stats.summary(elapsed) for hop, stats in hops.items()}
+        }
+
+class Deployment(object):
+    """
+        University, funding agency and researchers started as separate processes in a working
+        directory, so every run starts from empty databases
+    """
+
+    workdir: str
+    processes: list
+
+    def __init__(self, workdir: str) -> None:
+        self.workdir = workdir
+        self.processes = []
+
+    def spawn(self, name: str, script: str, *args: str) -> None:
+        log = open(os.path.join(self.workdir, f"{name}.log"), 'w')
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+        self.processes.append(subprocess.Popen([sys.executable, path, *args], cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT))
+
+    def stop(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for entry in mix.split(","):
+        name, weight = entry.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results: dict) -> None:
+    header = f"\t{'':70} | {'COUNT':8} | {'REQ/S':8} | {'P50(ms)':8} | {'P95(ms)':8} | {'P99(ms)':8}"
+    row = lambda name, stats: f"\t{name:70} | {stats['count']:8} | {stats['throughput']:8.1f} | {stats['p50_ms']:8.2f} | {stats['p95_ms']:8.2f} | {stats['p99_ms']:8.2f}"
+
+    print(f" [B] {results['total']['count']} commands in {results['elapsed']:.1f}s, {results['timeouts']} timeouts")
+    print(header)
+    print(row("all", results["total"]))
+    for name, stats in results["actions"].items():
+        print(row(name, stats))
+    for name, stats in results["actions"].items():
+        print(f"\t{name}: " + ", ".join(f"{count} {status}" for status, count in sorted(stats["statuses"].items())))
+    print()
+    print(header)
+    for hop, stats in results["hops"].items():
+        print(row(hop, stats))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--researchers", type=int, default=10, help="researchers driven by the benchmark")
+    parser.add_argument("--users", type=int, default=1, help="commands in flight per researcher")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of the commands, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--codec", choices=list(CODEC_NAMES), default="json", help="encoding of the messages")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a command to complete")
+    parser.add_argument("--spawn", action="store_true", help="start university, funding agency and researchers")
+    parser.add_argument("--transport", choices=["amqp", "memory"], default="amqp", help="memory runs every component in this process without RabbitMQ (implies --spawn)")
+    parser.add_argument("--pipeline", type=int, default=1, help="proposals evaluated at the same time by the funding agency")
+    parser.add_argument("--hosted", action="store_true", help="spawn the researchers in one researcher_host.py instead of a process each")
+    parser.add_argument("--workdir", default=None, help="working directory of the spawned processes (default: a new temporary directory)")
+    parser.add_argument("--university-args", default="", help="extra arguments of university.py, e.g. '--workers 8'")
+    parser.add_argument("--startup", type=float, default=3, help="seconds to wait for the spawned processes")
+    parser.add_argument("--output", default=None, help="JSON file of the results (default: benchmark-<time>.json)")
+    parser.add_argument("--trace", default=None, help="append the spans of every component to this file (see trace_report.py)")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of the commands traced")
+    parser.add_argument("--metrics-port", type=int, default=None, help="metrics of the university on this port, funding agency and researchers on the next ones")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    researchers = [f"Researcher-{i}" for i in range(1, args.researchers + 1)]
+    codec = args.codec
+
+    # enough funds to approve the proposal of every researcher
+    funds = 200000 * (args.researchers + 1) * 100
+
+    deployment = None
+    if args.transport == "memory":
+        from run_local import LocalDeployment
+        from university import argument_parser
+        local = LocalDeployment(
+            args.workdir or tempfile.mkdtemp(prefix="benchmark-"),
+            args.researchers,
+            argument_parser().parse_args(shlex.split(args.university_args)),
+            funds,
+            CODEC_NAMES[codec],
+            args.hosted,
+            args.pipeline,
+            args.trace,
+            args.trace_sample,
+            args.metrics_port
+        )
+        print(f" [B] Running every component in process, databases in {local.workdir}")
+        local.start()
+    elif args.spawn:
+        deployment = Deployment(args.workdir or tempfile.mkdtemp(prefix="benchmark-"))
+        print(f" [B] Starting processes in {deployment.workdir}")
+        # the researchers start the traces, the other components follow their sampling
+        trace = [] if args.trace is None else ["--trace", os.path.abspath(args.trace)]
+        # university on the port, funding agency and researchers on the next ones
+        metrics = lambda offset: [] if args.metrics_port is None else ["--metrics-port", str(args.metrics_port + offset)]
+        deployment.spawn("university", "university.py", *shlex.split(args.university_args), *trace, *metrics(0))
+        deployment.spawn("funding_agency", "funding_agency.py", "--codec", codec, "--funds", str(funds), "--pipeline", str(args.pipeline), *trace, *metrics(1))
+        trace += [] if args.trace is None else ["--trace-sample", str(args.trace_sample)]
+        if args.hosted:
+            deployment.spawn("researcher_host", "researcher_host.py", "--ids", f"1-{args.researchers}", "--codec", codec, *trace, *metrics(2))
+        else:
+            for i in range(1, args.researchers + 1):
+                deployment.spawn(f"researcher-{i}", "researcher.py", str(i), "--codec", codec, *trace, *metrics(1 + i))
+        time.sleep(args.startup)
+
+    try:
+        generator = LoadGenerator(researchers, mix, args.users, CODEC_NAMES[codec], args.timeout)
+        results = generator.run(args.duration)
+    finally:
+        if deployment is not None:
+            deployment.stop()
+
+    results["config"] = {**vars(args), "revision": git_revision(), "started": datetime.now().isoformat(timespec="seconds")}
+    print_results(results)
+
+    output = args.output or f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f" [B] Results saved to {output}")
+
+    if args.transport == "memory":
+        # the in-process components run on executor threads that never return
+        sys.stdout.flush()
+        os._exit(0)
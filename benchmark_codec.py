@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+from codec import CODECS
+from datetime import date, datetime
+from research_proposal_request import ResearchProposalRequest
+from request_response import RequestResponse
+from request_status import RequestStatus
+from actions import Actions
+import argparse
+import json
+import timeit
+
+# one representative message of every kind sent between the components
+MESSAGES: dict = {
+    "proposal": ResearchProposalRequest(
+        "DS", "Distributed systems", "CA4006 module", 200000, date(2023, 4, 12), "Researcher-1"
+    ).to_dict(),
+    "response": RequestResponse(
+        RequestStatus.SUCCEEDED.value, "Withdraw of 500 completed. Budget left: 199500", date(2023, 4, 12),
+        "DS", Actions.WITHDRAW.value
+    ).to_dict(),
+    "university_request": {
+        "correlation_id": "5f0c7c1e-3f8e-4d7a-9b2a-1d6f0e2c4b11",
+        "request_type": Actions.WITHDRAW.value,
+        "amount": 500,
+        "researcher": "Researcher-1",
+        "target_researcher": None,
+        "offset": None,
+        "limit": None,
+        "stream": False,
+        "timestamp": "12-04-2023"
+    },
+    "command": {"routing_key": "Researcher-1", "command": Actions.WITHDRAW.value, "amount": "500"},
+}
+
+def strptime_decode(body: bytes) -> date:
+    """
+        Decoding of a proposal before the codec layer
+    """
+    data = json.loads(body)
+    return datetime.strptime(data["timestamp"], '%d-%m-%Y').date()
+
+def measure(function, iterations: int) -> float:
+    """
+        Returns the operations per second of the fastest of 3 runs
+    """
+    return iterations / min(timeit.repeat(function, number=iterations, repeat=3))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000, help="operations timed per measure")
+    args = parser.parse_args()
+
+    print(f"\t{'MESSAGE':20} | {'CODEC':32} | {'BYTES':6} | {'ENCODE/S':10} | {'DECODE/S':10}")
+    for kind, message in MESSAGES.items():
+        for content_type, codec in CODECS.items():
+            body = codec.encode(message, kind)
+            assert codec.decode(body) == message, f"{content_type} does not round-trip {kind}"
+
+            encode_rate = measure(lambda: codec.encode(message, kind), args.iterations)
+            decode_rate = measure(lambda: codec.decode(body), args.iterations)
+            print(f"\t{kind:20} | {content_type:32} | {len(body):6} | {encode_rate:10.0f} | {decode_rate:10.0f}")
+
+    body = ResearchProposalRequest.from_dict(MESSAGES["proposal"]).to_json().encode()
+    print()
+    print(f"\tproposal decode with strptime:      {measure(lambda: strptime_decode(body), args.iterations):10.0f}/s")
+    for content_type in CODECS:
+        encoded = ResearchProposalRequest.from_dict(MESSAGES["proposal"]).encode(content_type)
+        rate = measure(lambda: ResearchProposalRequest.decode(encoded, content_type), args.iterations)
+        print(f"\tproposal decode ({content_type}): {rate:10.0f}/s")
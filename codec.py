@@ -0,0 +1,259 @@
+from datetime import date
+from functools import lru_cache
+from actions import Actions
+from request_status import RequestStatus
+import json
+import struct
+
+JSON_CONTENT_TYPE: str = "application/json"
+BINARY_CONTENT_TYPE: str = "application/x-university-binary"
+
+def parse_date(value: str) -> date:
+    """
+        Parse a 'dd-mm-yyyy' date, much cheaper than datetime.strptime
+    """
+    return date(int(value[6:]), int(value[3:5]), int(value[:2]))
+
+def format_date(value: date) -> str:
+    return f"{value.day:02d}-{value.month:02d}-{value.year:04d}"
+
+@lru_cache(maxsize=4096)
+def date_ordinal(value: str) -> int:
+    """
+        Day ordinal of a 'dd-mm-yyyy' date, None if the string is not written exactly that way
+    """
+    try:
+        day = parse_date(value)
+    except ValueError:
+        return None
+    return day.toordinal() if format_date(day) == value else None
+
+@lru_cache(maxsize=4096)
+def ordinal_date(ordinal: int) -> str:
+    return format_date(date.fromordinal(ordinal))
+
+class CodecError(ValueError):
+    pass
+
+class JsonCodec(object):
+    """
+        Messages as JSON objects, understood by every component
+    """
+
+    content_type: str = JSON_CONTENT_TYPE
+
+    def encode(self, message: dict, kind: str) -> bytes:
+        return json.dumps(message).encode()
+
+    def decode(self, body: bytes) -> dict:
+        return json.loads(body)
+
+class BinaryCodec(object):
+    """
+        Compact binary messages built from a fixed schema per kind of message.
+
+        layout:
+            kind code               1 byte
+            presence bitmap         4 bytes, bit i is set when field i of the schema is sent
+            null bitmap             4 bytes, bit i is set when field i of the schema is null
+            fields                  in schema order:
+                - int               8 bytes
+                - bool              1 byte
+                - date              4 bytes, day ordinal
+                - action/status     1 byte, position of the value in the enum
+                - str               2 bytes length + utf-8
+                - text              4 bytes length + utf-8
+            extra fields            JSON object, only if some values do not fit the schema
+
+        Values that do not fit their field (e.g. an amount typed as a string) and keys that
+        are not in the schema travel in the extra fields, so any message round-trips.
+    """
+
+    content_type: str = BINARY_CONTENT_TYPE
+
+    # k = value, v = code
+    ACTIONS: dict = {action.value: code for code, action in enumerate(Actions)}
+    STATUSES: dict = {status.value: code for code, status in enumerate(RequestStatus)}
+
+    # k = kind, v = ((field, type), ...) at most 32 fields, append new fields at the end
+    SCHEMAS: dict = {
+        "proposal": (
+            ("id", "str"), ("title", "str"), ("description", "text"), ("amount", "int"),
+            ("timestamp", "date"), ("researcher_id", "str")
+        ),
+        "response": (
+            ("status", "status"), ("message", "text"), ("timestamp", "date"), ("account", "str"),
+            ("action", "action"), ("cursor", "int")
+        ),
+        "university_request": (
+            ("correlation_id", "str"), ("request_type", "action"), ("researcher", "str"), ("timestamp", "date"),
+            ("amount", "int"), ("target_researcher", "str"), ("offset", "int"), ("limit", "int"),
+            ("stream", "bool"), ("project_id", "str"), ("title", "str"), ("description", "text"),
+            ("budget", "int"), ("end_date", "date"), ("status", "status"), ("expiring_from", "date"),
+            ("expiring_to", "date"), ("lead", "str"), ("from_date", "date"), ("to_date", "date"),
+            ("min_amount", "int"), ("max_amount", "int")
+        ),
+        "command": (
+            ("routing_key", "str"), ("command", "action"), ("project_id", "str"), ("title", "str"),
+            ("description", "text"), ("amount", "str"), ("researcher", "str"), ("account", "str"),
+            ("offset", "int"), ("limit", "int"), ("stream", "bool"), ("expiring_from", "date"),
+            ("expiring_to", "date"), ("lead", "str"), ("from_date", "date"), ("to_date", "date"),
+            ("min_amount", "int"), ("max_amount", "int")
+        ),
+    }
+
+    HEADER: struct.Struct = struct.Struct(">BII")
+    INT: struct.Struct = struct.Struct(">q")
+    BOOL: struct.Struct = struct.Struct(">?")
+    DATE: struct.Struct = struct.Struct(">i")
+    CODE: struct.Struct = struct.Struct(">B")
+    STR: struct.Struct = struct.Struct(">H")
+    TEXT: struct.Struct = struct.Struct(">I")
+
+    # k = kind, v = kind code
+    kinds: dict
+    # k = kind code, v = (schema fields, ((field, bit, packer, unpacker), ...))
+    schemas: list
+    # k = action/status code, v = value
+    actions: list
+    statuses: list
+
+    def __init__(self) -> None:
+        self.kinds = {kind: code for code, kind in enumerate(self.SCHEMAS)}
+        self.actions = list(self.ACTIONS)
+        self.statuses = list(self.STATUSES)
+
+        packers = {
+            "str": (self._pack_str, self._unpack_str), "text": (self._pack_text, self._unpack_text),
+            "int": (self._pack_int, self._unpack_int), "bool": (self._pack_bool, self._unpack_bool),
+            "date": (self._pack_date, self._unpack_date),
+            "action": (self._pack_action, self._unpack_action), "status": (self._pack_status, self._unpack_status)
+        }
+        self.schemas = [
+            (
+                frozenset(field for field, _ in schema),
+                tuple((field, 1 << index) + packers[field_type] for index, (field, field_type) in enumerate(schema))
+            )
+            for schema in self.SCHEMAS.values()
+        ]
+
+    # packers return the encoded value, None if it does not fit the field
+    # unpackers return the value and the offset of the next field
+
+    def _pack_str(self, value) -> bytes:
+        if not isinstance(value, str):
+            return None
+        data = value.encode()
+        return self.STR.pack(len(data)) + data if len(data) <= 0xFFFF else None
+
+    def _unpack_str(self, body: bytes, offset: int) -> tuple:
+        (size,) = self.STR.unpack_from(body, offset)
+        offset += self.STR.size
+        return bytes(body[offset:offset + size]).decode(), offset + size
+
+    def _pack_text(self, value) -> bytes:
+        if not isinstance(value, str):
+            return None
+        data = value.encode()
+        return self.TEXT.pack(len(data)) + data
+
+    def _unpack_text(self, body: bytes, offset: int) -> tuple:
+        (size,) = self.TEXT.unpack_from(body, offset)
+        offset += self.TEXT.size
+        return bytes(body[offset:offset + size]).decode(), offset + size
+
+    def _pack_int(self, value) -> bytes:
+        if type(value) is not int or not -2**63 <= value < 2**63:
+            return None
+        return self.INT.pack(value)
+
+    def _unpack_int(self, body: bytes, offset: int) -> tuple:
+        return self.INT.unpack_from(body, offset)[0], offset + self.INT.size
+
+    def _pack_bool(self, value) -> bytes:
+        return self.BOOL.pack(value) if isinstance(value, bool) else None
+
+    def _unpack_bool(self, body: bytes, offset: int) -> tuple:
+        return self.BOOL.unpack_from(body, offset)[0], offset + self.BOOL.size
+
+    def _pack_date(self, value) -> bytes:
+        ordinal = date_ordinal(value) if isinstance(value, str) else None
+        return None if ordinal is None else self.DATE.pack(ordinal)
+
+    def _unpack_date(self, body: bytes, offset: int) -> tuple:
+        return ordinal_date(self.DATE.unpack_from(body, offset)[0]), offset + self.DATE.size
+
+    def _pack_action(self, value) -> bytes:
+        code = self.ACTIONS.get(value) if isinstance(value, str) else None
+        return None if code is None else self.CODE.pack(code)
+
+    def _unpack_action(self, body: bytes, offset: int) -> tuple:
+        return self.actions[body[offset]], offset + 1
+
+    def _pack_status(self, value) -> bytes:
+        code = self.STATUSES.get(value) if isinstance(value, str) else None
+        return None if code is None else self.CODE.pack(code)
+
+    def _unpack_status(self, body: bytes, offset: int) -> tuple:
+        return self.statuses[body[offset]], offset + 1
+
+    def encode(self, message: dict, kind: str) -> bytes:
+        code = self.kinds.get(kind)
+        if code is None:
+            raise CodecError(f"no binary schema for '{kind}' messages")
+
+        fields, schema = self.schemas[code]
+        present = 0
+        null = 0
+        parts = []
+        extra = {} if fields.issuperset(message) else {key: value for key, value in message.items() if key not in fields}
+        for field, bit, pack, _ in schema:
+            value = message.get(field)
+            if value is None:
+                if field in message:
+                    null |= bit
+                continue
+            data = pack(value)
+            if data is None:
+                extra[field] = value
+                continue
+            present |= bit
+            parts.append(data)
+
+        if extra:
+            parts.append(json.dumps(extra).encode())
+        return self.HEADER.pack(code, present, null) + b"".join(parts)
+
+    def decode(self, body: bytes) -> dict:
+        try:
+            code, present, null = self.HEADER.unpack_from(body, 0)
+            _, schema = self.schemas[code]
+        except (struct.error, IndexError):
+            raise CodecError("malformed binary message")
+
+        message = {}
+        offset = self.HEADER.size
+        for field, bit, _, unpack in schema:
+            if present & bit:
+                message[field], offset = unpack(body, offset)
+            elif null & bit:
+                message[field] = None
+
+        if offset < len(body):
+            message.update(json.loads(body[offset:]))
+        return message
+
+CODECS: dict = {codec.content_type: codec for codec in (JsonCodec(), BinaryCodec())}
+CODEC_NAMES: dict = {"json": JSON_CONTENT_TYPE, "binary": BINARY_CONTENT_TYPE}
+
+def codec_for(content_type: str):
+    """
+        Returns the codec of the content type, messages without a known content type are JSON
+    """
+    return CODECS.get(content_type, CODECS[JSON_CONTENT_TYPE])
+
+def encode(message: dict, kind: str, content_type: str = JSON_CONTENT_TYPE) -> bytes:
+    return codec_for(content_type).encode(message, kind)
+
+def decode(body: bytes, content_type: str = JSON_CONTENT_TYPE) -> dict:
+    return codec_for(content_type).decode(body)
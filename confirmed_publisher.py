@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+from pika import SelectConnection, ConnectionParameters
+from pika.spec import Basic, BasicProperties
+from itertools import takewhile
+from copy import copy
+import time
+import transport
+
+class ConfirmReport(object):
+    """
+        Outcome of a confirmed batch: confirm latency of every message (seconds, None if it
+        has not been confirmed), the messages rejected by the broker, the messages returned
+        because no queue is bound to their routing key and the total time
+    """
+
+    latencies: list
+    nacked: list
+    returned: list
+    elapsed: float
+
+    def __init__(self, size: int) -> None:
+        self.latencies = [None] * size
+        self.nacked = []
+        self.returned = []
+        self.elapsed = 0.0
+
+    def confirmed(self) -> int:
+        # a returned message is confirmed by the broker, it has not been delivered
+        return sum(1 for latency in self.latencies if latency is not None) - len(self.nacked) - len(self.returned)
+
+    def quantile(self, q: float) -> float:
+        latencies = sorted(latency for latency in self.latencies if latency is not None)
+        if not latencies:
+            return 0.0
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.latencies)} messages in {self.elapsed:.3f}s ({self.throughput():.0f} msg/s), "
+            f"{self.confirmed()} confirmed, {len(self.nacked)} rejected, {len(self.returned)} unroutable\n"
+            f"\tconfirm latency (ms): p50 {self.quantile(0.5) * 1000:.2f} | p95 {self.quantile(0.95) * 1000:.2f} | "
+            f"p99 {self.quantile(0.99) * 1000:.2f} | max {self.quantile(1.0) * 1000:.2f}"
+        )
+
+class ConfirmedPublisher(object):
+    """
+        Publishes a list of messages over a single channel in confirm mode.
+
+        Uses its own SelectConnection so publishing does not wait for each confirmation:
+        up to `window` messages are unconfirmed at a time, and every ack/nack from the
+        broker (possibly covering several messages) is matched to the time each message
+        has been published.
+
+        Messages are published as mandatory: the broker returns a message that no queue is
+        bound to (e.g. a researcher that is not running) before confirming it, and the message
+        is reported as returned. Returned messages are identified by their message_id, which
+        is set to their index in the batch.
+
+        With the in-memory transport a message is confirmed as soon as it is enqueued.
+    """
+
+    host: str
+    window: int
+    connection: SelectConnection
+    channel: object
+    exchange: str
+    exchange_type: str
+    # (routing_key, body, properties)
+    messages: list
+    report: ConfirmReport
+    # index of the next message to publish
+    next_message: int
+    # k = delivery tag, v = (message index, publish time), in publish order
+    outstanding: dict
+    start_time: float
+    error: Exception
+
+    def __init__(self, host: str = 'localhost', window: int = 1000) -> None:
+        self.host = host
+        self.window = window
+
+    def publish_all(self, exchange: str, exchange_type: str, messages: list) -> ConfirmReport:
+        """
+            Publish every (routing_key, body, properties) and block until the broker has confirmed all of them
+        """
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+        self.messages = messages
+        self.report = ConfirmReport(len(messages))
+        self.next_message = 0
+        self.outstanding = {}
+        self.error = None
+
+        if transport.is_memory():
+            return self._publish_memory()
+
+        self.connection = SelectConnection(
+            ConnectionParameters(host=self.host),
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_error,
+            on_close_callback=self.on_connection_closed
+        )
+        self.start_time = time.perf_counter()
+        self.connection.ioloop.start()
+
+        if self.error is not None:
+            raise self.error
+        return self.report
+
+    def _publish_memory(self) -> ConfirmReport:
+        connection = transport.connect(self.host)
+        channel = connection.channel()
+        channel.exchange_declare(exchange=self.exchange, exchange_type=self.exchange_type)
+        channel.confirm_delivery()
+        channel.add_on_return_callback(self.on_return)
+
+        start_time = time.perf_counter()
+        for index, (routing_key, body, properties) in enumerate(self.messages):
+            sent = time.perf_counter()
+            channel.basic_publish(exchange=self.exchange, routing_key=routing_key, body=body,
+                                  properties=self.message_properties(index, properties), mandatory=True)
+            self.report.latencies[index] = time.perf_counter() - sent
+        self.report.elapsed = time.perf_counter() - start_time
+
+        connection.close()
+        return self.report
+
+    def on_connection_open(self, connection: SelectConnection) -> None:
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_error(self, connection: SelectConnection, error: Exception) -> None:
+        self.error = error
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection: SelectConnection, reason: Exception) -> None:
+        if self.outstanding or self.next_message < len(self.messages):
+            self.error = ConnectionError(f"connection closed before every message was confirmed: {reason}")
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel) -> None:
+        self.channel = channel
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.add_on_return_callback(self.on_return)
+        channel.confirm_delivery(ack_nack_callback=self.on_confirm, callback=self.on_confirm_mode)
+
+    def on_channel_closed(self, channel, reason: Exception) -> None:
+        # e.g. the exchange has been declared with another type
+        if self.connection.is_open:
+            self.connection.close()
+
+    def on_confirm_mode(self, frame) -> None:
+        self.channel.exchange_declare(
+            exchange=self.exchange,
+            exchange_type=self.exchange_type,
+            callback=lambda frame: self.publish_window()
+        )
+
+    def publish_window(self) -> None:
+        # delivery tags of a confirm channel are numbered from 1 in publish order
+        while len(self.outstanding) < self.window and self.next_message < len(self.messages):
+            routing_key, body, properties = self.messages[self.next_message]
+            self.channel.basic_publish(exchange=self.exchange, routing_key=routing_key, body=body,
+                                       properties=self.message_properties(self.next_message, properties), mandatory=True)
+            self.outstanding[self.next_message + 1] = (self.next_message, time.perf_counter())
+            self.next_message += 1
+
+        if not self.outstanding:
+            self.report.elapsed = time.perf_counter() - self.start_time
+            self.connection.close()
+
+    def message_properties(self, index: int, properties: BasicProperties) -> BasicProperties:
+        # the properties may be shared by the messages of the batch
+        properties = BasicProperties() if properties is None else copy(properties)
+        properties.message_id = str(index)
+        return properties
+
+    def on_return(self, channel, method: Basic.Return, properties: BasicProperties, body: bytes) -> None:
+        """
+            The message could not be routed, its confirm follows
+        """
+        self.report.returned.append(int(properties.message_id))
+
+    def on_confirm(self, frame) -> None:
+        now = time.perf_counter()
+        delivery_tag = frame.method.delivery_tag
+        if frame.method.multiple:
+            # outstanding is in publish order, the confirmed tags are at its beginning
+            tags = list(takewhile(lambda tag: tag <= delivery_tag, self.outstanding))
+        else:
+            tags = [delivery_tag] if delivery_tag in self.outstanding else []
+
+        nacked = isinstance(frame.method, Basic.Nack)
+        for tag in tags:
+            index, sent = self.outstanding.pop(tag)
+            self.report.latencies[index] = now - sent
+            if nacked:
+                self.report.nacked.append(index)
+
+        self.publish_window()
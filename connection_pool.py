@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+from pika import BlockingConnection
+from pika.spec import BasicProperties
+from pika.adapters.blocking_connection import BlockingChannel
+from pika.exceptions import AMQPConnectionError, AMQPChannelError
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from threading import Lock
+from transport import connect
+
+class PooledChannel(object):
+
+    connection: BlockingConnection
+    channel: BlockingChannel
+    # exchanges already declared on this connection
+    declared_exchanges: set
+
+    def __init__(self, connection: BlockingConnection) -> None:
+        self.connection = connection
+        self.channel = connection.channel()
+        self.declared_exchanges = set()
+
+    def is_open(self) -> bool:
+        return self.connection.is_open and self.channel.is_open
+
+    def close(self) -> None:
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
+class ConnectionPool(object):
+    """
+        Thread-safe pool of long-lived connections used for outbound publishes.
+
+        A BlockingConnection cannot be shared by two threads at the same time,
+        so each publisher checks out a whole connection/channel pair, uses it and
+        gives it back. Exchanges are declared once per connection and broken
+        connections are discarded and reopened transparently.
+    """
+
+    host: str
+    max_size: int
+    # k = exchange name, v = exchange type
+    exchanges: dict
+    idle: LifoQueue
+    size: int
+    lock: Lock
+
+    def __init__(self, host: str = 'localhost', max_size: int = 8) -> None:
+        self.host = host
+        self.max_size = max_size
+        self.exchanges = {}
+        self.idle = LifoQueue()
+        self.size = 0
+        self.lock = Lock()
+
+    def declare_exchange(self, exchange: str, exchange_type: str = 'direct') -> None:
+        """
+            Register an exchange, it is declared lazily the first time each connection is used.
+        """
+        if exchange in self.exchanges:
+            return
+        with self.lock:
+            self.exchanges[exchange] = exchange_type
+
+    def _open(self) -> PooledChannel:
+        return PooledChannel(connect(self.host))
+
+    def _acquire(self) -> PooledChannel:
+        pooled: PooledChannel = None
+        try:
+            pooled = self.idle.get_nowait()
+        except Empty:
+            with self.lock:
+                can_open = self.size < self.max_size
+                if can_open:
+                    self.size += 1
+            if can_open:
+                try:
+                    return self._open()
+                except Exception:
+                    with self.lock:
+                        self.size -= 1
+                    raise
+            # every connection is in use, wait for one to be released
+            pooled = self.idle.get()
+
+        if not pooled.is_open():
+            # closed by the broker while idle (e.g. missed heartbeats)
+            self._discard(pooled)
+            return self._acquire()
+        return pooled
+
+    def _release(self, pooled: PooledChannel) -> None:
+        self.idle.put(pooled)
+
+    def _discard(self, pooled: PooledChannel) -> None:
+        pooled.close()
+        with self.lock:
+            self.size -= 1
+
+    def _declare_exchanges(self, pooled: PooledChannel) -> None:
+        for exchange, exchange_type in list(self.exchanges.items()):
+            if exchange not in pooled.declared_exchanges:
+                pooled.channel.exchange_declare(exchange=exchange, exchange_type=exchange_type)
+                pooled.declared_exchanges.add(exchange)
+
+    @contextmanager
+    def channel(self) -> BlockingChannel:
+        """
+            Borrow a channel for the duration of the with block.
+            The connection is dropped from the pool if the block fails because of the broker.
+        """
+        pooled = self._acquire()
+        try:
+            self._declare_exchanges(pooled)
+            yield pooled.channel
+        except (AMQPConnectionError, AMQPChannelError):
+            self._discard(pooled)
+            raise
+        except Exception:
+            self._release(pooled)
+            raise
+        else:
+            self._release(pooled)
+
+    def publish(self, exchange: str, routing_key: str, body: str, properties: BasicProperties = None, retries: int = 1) -> None:
+        """
+            Publish a message on a pooled channel, reconnecting if the connection has been lost.
+        """
+        while True:
+            try:
+                with self.channel() as channel:
+                    channel.basic_publish(
+                        exchange=exchange,
+                        routing_key=routing_key,
+                        properties=properties,
+                        body=body
+                    )
+                return
+            except (AMQPConnectionError, AMQPChannelError):
+                if retries <= 0:
+                    raise
+                retries -= 1
+
+    def close(self) -> None:
+        while True:
+            try:
+                pooled = self.idle.get_nowait()
+            except Empty:
+                break
+            self._discard(pooled)
+
+# connection pool shared by every component of the process
+pool = ConnectionPool()
@@ -0,0 +1,51 @@
+from bisect import bisect, insort
+import hashlib
+
+class HashRing(object):
+    """
+        Consistent hashing ring with virtual nodes.
+        Adding a node to a ring of n nodes only moves about 1/(n+1) of the keys.
+    """
+
+    replicas: int
+    # sorted positions of the virtual nodes
+    positions: list
+    # k = position, v = node
+    owners: dict
+    nodes: set
+
+    def __init__(self, nodes: list = (), replicas: int = 100) -> None:
+        self.replicas = replicas
+        self.positions = []
+        self.owners = {}
+        self.nodes = set()
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add_node(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            position = self.hash(f"{node}#{replica}")
+            self.owners[position] = node
+            insort(self.positions, position)
+
+    def remove_node(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for replica in range(self.replicas):
+            position = self.hash(f"{node}#{replica}")
+            del self.owners[position]
+        self.positions = sorted(self.owners.keys())
+
+    def get_node(self, key: str) -> str:
+        if not self.positions:
+            raise LookupError("the ring has no nodes")
+        index = bisect(self.positions, self.hash(key)) % len(self.positions)
+        return self.owners[self.positions[index]]
@@ -1,187 +1,384 @@
 #!/usr/bin/env python
-from pika import BlockingConnection, ConnectionParameters
+from pika import BlockingConnection
 from pika.spec import Basic, BasicProperties, PERSISTENT_DELIVERY_MODE
 from pika.adapters.blocking_connection import BlockingChannel
 import pickle
-import json
+import argparse
+import time
 from request_status import RequestStatus
 from funding_agency_database import FundingAgencyDatabase
 from research_proposal_request import ResearchProposalRequest
 from datetime import date
 from dateutil.relativedelta import relativedelta
 from actions import Actions
-import uuid
 from timer import Timer
-from concurrent.futures import ThreadPoolExecutor
+from rpc_client import RpcClient
+from transport import connect
+from codec import CODEC_NAMES, JSON_CONTENT_TYPE, codec_for, encode
+from tracing import Tracer, Span
+from metrics import Metrics, Counter, Histogram
+
+class ProposalEvaluation(object):
+    """
+        State of a proposal being evaluated, kept by correlation id until the researcher is answered
+    """
+
+    delivery_tag: int
+    props: BasicProperties
+    request: ResearchProposalRequest
+    # seconds spent waiting for the university, reported to the researcher
+    hops: dict
+    # true if the amount of the proposal is reserved
+    reserved: bool
+    history_record: dict
+    # span of the evaluation, parent of the requests sent to the university
+    span: Span
+    # perf_counter when the evaluation started
+    started: float
+
+    def __init__(self, delivery_tag: int, props: BasicProperties, request: ResearchProposalRequest, span: Span) -> None:
+        self.delivery_tag = delivery_tag
+        self.props = props
+        self.request = request
+        self.hops = {}
+        self.reserved = False
+        self.history_record = None
+        self.span = span
+        self.started = None
+
+    def keys(self) -> set:
+        # proposals of the same researcher or for the same project are evaluated one at a time
+        return {self.request.researcher_id, self.request.id}
 
 class FundingAgency(object):
+    """
+        Evaluates up to `pipeline` proposals at the same time.
+
+        A proposal is a chain of university RPCs (notify proposal, then create account) that never
+        blocks the consumer: replies are handed back to the connection thread, which moves the
+        proposal forward, so throughput is bound by the university instead of the round-trips.
+        Funds are reserved when the evaluation starts and committed or released when the
+        university answers, so proposals in flight cannot allocate the same funds.
+    """
 
     DATA_FILE: str = "funding_agency.pickle"
     database: FundingAgencyDatabase
-    response: dict
-    correlation_id: uuid
+    rpc_client: RpcClient
     timer: Timer = Timer("funding agency")
-    history_record: dict
+    # codec of the requests sent to the university
+    content_type: str
+    # proposals evaluated at the same time
+    pipeline: int
+    connection: BlockingConnection
+    channel: BlockingChannel
+    # k = correlation_id, v = ProposalEvaluation
+    evaluations: dict
+    # researchers and project ids of the proposals being evaluated
+    in_progress: set
+    # proposals waiting for a proposal of the same researcher or project to complete
+    deferred: list
+    # spans of the evaluations, children of the span of the researcher
+    tracer: Tracer
+    # counters and histograms of the funding agency, served on metrics_port
+    metrics: Metrics
+    consumed: Counter
+    acked: Counter
+    requeued: Counter
+    handler_duration: Histogram
+    persist_duration: Histogram
+    persist_bytes: Counter
+
+    def __init__(self, dedup_capacity: int = 100000, dedup_ttl: float = None, content_type: str = JSON_CONTENT_TYPE, funds: int = 1000000, pipeline: int = 1,
+                 trace_file: str = None, trace_sample: float = 1.0, metrics_port: int = None) -> None:
+        self.content_type = content_type
+        self.pipeline = max(pipeline, 1)
+        self.evaluations = {}
+        self.in_progress = set()
+        self.deferred = []
+        self.tracer = Tracer("funding agency", trace_file, trace_sample)
 
-    def __init__(self) -> None:
         try:
             #read funds and history from file
             with open(self.DATA_FILE, 'rb') as f:
                 self.database = pickle.load(f)
         except FileNotFoundError:
             # initialize funds and history
-            self.database = FundingAgencyDatabase()
+            self.database = FundingAgencyDatabase(dedup_capacity, dedup_ttl, funds)
+
+        self.database.request_cache.configure(dedup_capacity, dedup_ttl)
+
+        self.setup_metrics()
+        # the clock is adjusted to every reply of the university
+        self.rpc_client = RpcClient("F", clock=self.timer, round_trips=self.metrics.histogram(
+            "rpc_round_trip_seconds", "Time from the publish of a request to the university to its reply.", ("queue",)
+        ))
+        self.metrics.gauge("rpc_in_flight", "Requests sent to the university and not answered yet.", function=self.rpc_client.in_flight)
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
+
+        self.start()
+
+    def setup_metrics(self) -> None:
+        metrics = self.metrics = Metrics("funding_agency")
+        self.consumed = metrics.counter("messages_consumed", "Proposals received.")
+        self.acked = metrics.counter("messages_acked", "Proposals answered and acknowledged.")
+        self.requeued = metrics.counter("messages_requeued", "Proposals requeued because the university could not be reached.")
+        unacked = lambda: self.consumed.get() - self.acked.get() - self.requeued.get()
+        metrics.gauge("messages_unacked", "Proposals received and not acknowledged yet.", function=unacked)
+        metrics.gauge("prefetch_utilisation", "Unacknowledged proposals over the pipeline (prefetch count).", function=lambda: unacked() / self.pipeline)
+        metrics.gauge("evaluations", "Proposals being evaluated.", function=lambda: len(self.evaluations))
+        metrics.gauge("deferred", "Proposals waiting for a proposal of the same researcher or project.", function=lambda: len(self.deferred))
+        metrics.gauge("funds_available", "Funds not allocated or reserved.", function=lambda: self.database.available_funds())
+
+        self.handler_duration = metrics.histogram("handler_duration_seconds", "Time from the start of an evaluation to the response, by status.", ("status",))
+        self.persist_duration = metrics.histogram("persist_duration_seconds", "Time spent saving the database.")
+        self.persist_bytes = metrics.counter("persist_bytes", "Bytes written by the saves of the database.")
+
+        # k = key of the stats of the request cache, v = metric
+        dedup = {
+            "hits": metrics.counter("dedup_hits", "Redelivered proposals answered from the history."),
+            "misses": metrics.counter("dedup_misses", "New proposals checked against the history."),
+            "hit_rate": metrics.gauge("dedup_hit_ratio", "Share of the proposals found in the history."),
+            "size": metrics.gauge("dedup_entries", "Proposals remembered in the history.")
+        }
 
-        # two threads
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            executor.submit(self.timer.start)
-            executor.submit(self.start)
+        def collect() -> None:
+            stats = self.database.request_cache.stats()
+            for key, metric in dedup.items():
+                metric.set(stats[key])
+
+        metrics.collector(collect)
     
     def start(self) -> None:
         #Connect to RabbitMQ
-        connection = BlockingConnection(ConnectionParameters(host='localhost'))
-        channel = connection.channel()
+        self.connection = connect()
+        self.channel = self.connection.channel()
 
         #Create queue for research proposal RPC
-        channel.queue_declare(queue='submit_research_proposal')
+        self.channel.queue_declare(queue='submit_research_proposal')
 
-        #Fair dispatch, no more than one message to a worker at a time
-        #To avoid race condition
-        channel.basic_qos(prefetch_count=1)
+        # proposals are acked once the researcher has been answered,
+        # the broker stops delivering when `pipeline` proposals are in flight
+        self.channel.basic_qos(prefetch_count=self.pipeline)
 
         #Defining queue where callback function should receive messages from
-        channel.basic_consume(queue='submit_research_proposal', on_message_callback=self.process_research_proposal)
+        self.channel.basic_consume(queue='submit_research_proposal', on_message_callback=self.process_research_proposal)
 
         print(" [F] Awaiting Research Proposals requests")
 
         #await research proposals
-        channel.start_consuming()
+        self.channel.start_consuming()
 
     def process_research_proposal(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:    
-        request: ResearchProposalRequest = ResearchProposalRequest.from_json_data(body)
+        request: ResearchProposalRequest = ResearchProposalRequest.decode(body, props.content_type)
 
         #adjust timer if needed
-        self.timer.adjust_timer(request.timestamp.strftime("%d-%m-%Y"))
-
-        # check if the request has already been processed
-        if self.database.is_request_new(props.correlation_id):
-            # notify university that researcher applied for funding
-            # a reasearcher part of another project (lead or not lead) cannot be approved
-            # a researcher can be part of only one account at the time
-            proposal_request = {
-                'correlation_id': props.correlation_id,     #request id
-                'project_id': request.id,
-                'researcher': request.researcher_id,
-                'timestamp': self.timer.get_time_str()
-            }
-            self.notify_university(Actions.NOTIFY_RESEARCHER_PROPOSAL, proposal_request)
-            
-            if self.response['status'] == RequestStatus.REJECTED.value:
-                researcher_response = RequestStatus.REJECTED.value
-                print(f" [F] Research Proposals rejected: {self.response['message']}")
-            elif request.amount > self.database.funds:
-                researcher_response = RequestStatus.REJECTED.value
-                print(f" [F] Research Proposals rejected: not enough funds (Request: {request.amount}, Funds: {self.database.funds})")
-            elif request.amount >= 200000 and request.amount <= 500000:
-                researcher_response = RequestStatus.APPROVED.value
-                self.database.allocate_funds(request.amount)
-                print(" [F] Research Proposals accepted")
-            else:
-                researcher_response = RequestStatus.REJECTED.value
-                print(" [F] Research Proposals rejected")
-
-            self.history_record = {
-                'status': researcher_response, 
-                'budget': request.amount,
-                'project_id': request.id,
-                'title': request.title,
-                'description': request.description,
-                'researcher': request.researcher_id,
-                'end_date': (date.today() + relativedelta(months=6)).strftime('%d-%m-%Y'), # end date 6 month after allocating budget
-                'timestamp': self.timer.get_time_str(),
-                'correlation_id': props.correlation_id
-            }
-            
-            if(researcher_response == RequestStatus.APPROVED.value):
-                # notify university to create an account
-                self.notify_university(Actions.CREATE_ACCOUNT, self.history_record)
+        self.timer.sync(props.headers, request.timestamp)
+
+        self.consumed.inc()
+        span = self.tracer.start_span("submit_research_proposal", "SERVER", props.headers).annotate("receive")
+        evaluation = ProposalEvaluation(method.delivery_tag, props, request, span)
+        if evaluation.keys() & self.in_progress:
+            span.annotate("deferred")
+            self.deferred.append(evaluation)
         else:
-            self.history_record = self.database.get_request_metadata(props.correlation_id)
+            self.evaluate(evaluation)
+
+    def evaluate(self, evaluation: ProposalEvaluation) -> None:
+        props, request = evaluation.props, evaluation.request
+        evaluation.span.annotate("handler start")
+        evaluation.started = time.perf_counter()
 
-        # send response to researcher
-        ch.basic_publish(exchange='',
+        # check if the request has already been processed, in one lookup: the entry cannot expire in between
+        previous = self.database.previous_result(props.correlation_id)
+        if previous is not None:
+            evaluation.history_record = previous
+            evaluation.span.tag("duplicate", True).annotate("handler end")
+            self.send_response(evaluation)
+            return
+
+        self.evaluations[props.correlation_id] = evaluation
+        self.in_progress |= evaluation.keys()
+
+        if request.amount >= 200000 and request.amount <= 500000:
+            evaluation.reserved = self.database.reserve_funds(props.correlation_id, request.amount)
+
+        # notify university that researcher applied for funding
+        # a reasearcher part of another project (lead or not lead) cannot be approved
+        # a researcher can be part of only one account at the time
+        proposal_request = {
+            'correlation_id': props.correlation_id,     #request id
+            'project_id': request.id,
+            'researcher': request.researcher_id,
+            'timestamp': self.timer.get_time_str()
+        }
+        self.notify_university(Actions.NOTIFY_RESEARCHER_PROPOSAL, proposal_request, evaluation, self.on_proposal_checked)
+
+    def on_proposal_checked(self, evaluation: ProposalEvaluation, response: dict) -> None:
+        request = evaluation.request
+
+        if response['status'] != RequestStatus.APPROVED.value:
+            # rejected by the university, or the check failed (e.g. a handler error): no account
+            researcher_response = RequestStatus.REJECTED.value
+            print(f" [F] Research Proposals rejected: {response['status']}: {response.get('message')}")
+        elif evaluation.reserved:
+            researcher_response = RequestStatus.APPROVED.value
+            print(" [F] Research Proposals accepted")
+        elif request.amount >= 200000 and request.amount <= 500000:
+            researcher_response = RequestStatus.REJECTED.value
+            print(f" [F] Research Proposals rejected: not enough funds (Request: {request.amount}, Funds: {self.database.available_funds()})")
+        else:
+            researcher_response = RequestStatus.REJECTED.value
+            print(" [F] Research Proposals rejected")
+
+        evaluation.history_record = {
+            'status': researcher_response, 
+            'budget': request.amount,
+            'project_id': request.id,
+            'title': request.title,
+            'description': request.description,
+            'researcher': request.researcher_id,
+            'end_date': (date.today() + relativedelta(months=6)).strftime('%d-%m-%Y'), # end date 6 month after allocating budget
+            'timestamp': self.timer.get_time_str(),
+            'correlation_id': evaluation.props.correlation_id
+        }
+
+        if researcher_response == RequestStatus.APPROVED.value:
+            # notify university to create an account
+            self.notify_university(Actions.CREATE_ACCOUNT, dict(evaluation.history_record), evaluation, self.on_account_created)
+        else:
+            self.database.release_reservation(evaluation.props.correlation_id)
+            self.complete(evaluation)
+
+    def on_account_created(self, evaluation: ProposalEvaluation, response: dict) -> None:
+        if response['status'] != RequestStatus.SUCCEEDED.value:
+            # no account, the funds are not allocated
+            print(f" [F] Research Proposals rejected: account not created ({response.get('message')})")
+            self.database.release_reservation(evaluation.props.correlation_id)
+            evaluation.history_record['status'] = RequestStatus.REJECTED.value
+            self.complete(evaluation)
+            return
+
+        self.database.commit_reservation(evaluation.props.correlation_id)
+
+        # save that request has been processed
+        self.database.record_history(evaluation.history_record)
+        # save database to file
+        start = time.perf_counter()
+        with open(self.DATA_FILE, 'wb') as f:
+            pickle.dump(self.database, f)
+            self.persist_bytes.inc(f.tell())
+        self.persist_duration.observe(time.perf_counter() - start)
+        evaluation.span.annotate("persist")
+
+        self.complete(evaluation)
+
+    def complete(self, evaluation: ProposalEvaluation) -> None:
+        del self.evaluations[evaluation.props.correlation_id]
+        self.in_progress -= evaluation.keys()
+        evaluation.span.annotate("handler end")
+        self.send_response(evaluation)
+        self.start_deferred()
+
+    def start_deferred(self) -> None:
+        """
+            Start the proposals that were waiting for a proposal that has completed or aborted, in arrival order
+        """
+        deferred, self.deferred = self.deferred, []
+        for waiting in deferred:
+            if waiting.keys() & self.in_progress:
+                self.deferred.append(waiting)
+            else:
+                self.evaluate(waiting)
+
+    def abort(self, evaluation: ProposalEvaluation, error: Exception) -> None:
+        """
+            The university could not be reached, the proposal is requeued and evaluated again
+        """
+        print(f" [F] Evaluation of the proposal failed: {error}")
+        self.database.release_reservation(evaluation.props.correlation_id)
+        del self.evaluations[evaluation.props.correlation_id]
+        self.in_progress -= evaluation.keys()
+        self.channel.basic_nack(delivery_tag=evaluation.delivery_tag, requeue=True)
+        self.requeued.inc()
+        evaluation.span.tag("error", error).finish()
+        self.start_deferred()
+
+    def send_response(self, evaluation: ProposalEvaluation) -> None:
+        props = evaluation.props
+        evaluation.span.annotate("reply").tag("status", evaluation.history_record["status"])
+
+        # send response to researcher, encoded like the request
+        self.channel.basic_publish(exchange='',
             routing_key=props.reply_to,
             properties=BasicProperties(
                 correlation_id = props.correlation_id,
-                content_type="application/json",
-                delivery_mode = PERSISTENT_DELIVERY_MODE
+                content_type=codec_for(props.content_type).content_type,
+                delivery_mode = PERSISTENT_DELIVERY_MODE,
+                headers=self.timer.headers()
                 ),
-            body=json.dumps({
-                "status": self.history_record["status"], 
-                "account": self.history_record["title"],
-                "timestamp": self.timer.get_time_str()
-            })
+            body=encode({
+                "status": evaluation.history_record["status"], 
+                "account": evaluation.history_record["title"],
+                "timestamp": self.timer.get_time_str(),
+                "hops": evaluation.hops
+            }, "response", props.content_type)
         )
 
         print(" [F] Response sent")
         
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.channel.basic_ack(delivery_tag=evaluation.delivery_tag)
+        self.acked.inc()
+        self.handler_duration.observe(time.perf_counter() - evaluation.started, status=evaluation.history_record["status"])
+        evaluation.span.finish()
 
-    def notify_university(self, action:  Actions, message: dict):
+    def notify_university(self, action: Actions, message: dict, evaluation: ProposalEvaluation, callback) -> None:
+        """
+            Send a request to the university without waiting for the reply,
+            callback(evaluation, response) runs on the connection thread when the reply is received
+        """
         #add action type to the message
         message['request_type'] = action.value
 
-        #Connect to RabbitMQ
-        self.connection = BlockingConnection(ConnectionParameters(host='localhost'))
-        self.channel = self.connection.channel()
-
-        #Create an anonymous exclusive callback queue
-        result = self.channel.queue_declare(queue='', exclusive=True)
-        self.callback_queue = result.method.queue
-
-        self.channel.basic_consume(
-            queue=self.callback_queue,
-            on_message_callback=self.on_university_response,
-            auto_ack=True)
-        
-        #Initialize the response to NULL and create a new request ID
-        self.response = None
-        self.correlation_id = str(uuid.uuid4())
-
         print(f" [F] Sending {action.value} Request")
         # Send Request To University
-        self.channel.basic_publish(
-            exchange='',
-            routing_key='university_requests_queue',
-            properties=BasicProperties(
-                reply_to=self.callback_queue,   # Anonymous exclusive researcher callback queue
-                correlation_id=self.correlation_id,    # Request ID
-                content_type="application/json",
-                delivery_mode = PERSISTENT_DELIVERY_MODE
-            ),
-            body=json.dumps(message)
-        )
-        
-        self.connection.process_data_events(time_limit=None)
-
-    def on_university_response(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
-        if self.correlation_id == props.correlation_id:
-            self.response = json.loads(body)
-
-            #adjust timer if needed
-            self.timer.adjust_timer(self.response["timestamp"])
+        start = time.perf_counter()
+        try:
+            future = self.rpc_client.call_async(
+                'university_requests_queue',
+                encode(message, "university_request", self.content_type),
+                content_type=self.content_type,
+                parent_span=evaluation.span
+            )
+        except Exception as e:
+            # e.g. the reply queue is not ready or the publish failed, like a reply that never arrives
+            self.abort(evaluation, e)
+            return
 
-            if self.response['action'] == Actions.CREATE_ACCOUNT.value:
-                # save that request has been processed
-                self.database.record_history(self.history_record)
-                # save database to file
-                with open(self.DATA_FILE, 'wb') as f:
-                    pickle.dump(self.database, f)
+        def on_response() -> None:
+            evaluation.hops[f"funding agency→university ({action.value})"] = time.perf_counter() - start
+            try:
+                response = future.result()
+            except Exception as e:
+                self.abort(evaluation, e)
+                return
+            print(f" [F] Received {action.value} Response")
+            callback(evaluation, response)
 
-                print(f" [F] Received {Actions.CREATE_ACCOUNT.value} Response")
-            elif self.response['action'] == Actions.NOTIFY_RESEARCHER_PROPOSAL.value:
-                print(f" [F] Received {Actions.NOTIFY_RESEARCHER_PROPOSAL.value} Response")
+        # the reply is received by the thread of the rpc client
+        future.add_done_callback(lambda future: self.connection.add_callback_threadsafe(on_response))
             
 
 if __name__ == '__main__':
-    funding_agency = FundingAgency()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dedup-capacity", type=int, default=100000, help="processed requests remembered to detect redeliveries")
+    parser.add_argument("--dedup-ttl", type=float, default=None, help="seconds a processed request is remembered")
+    parser.add_argument("--codec", choices=list(CODEC_NAMES), default="json", help="encoding of the requests sent to the university")
+    parser.add_argument("--funds", type=int, default=1000000, help="funds of a new funding agency database")
+    parser.add_argument("--pipeline", type=int, default=1, help="proposals evaluated at the same time")
+    parser.add_argument("--trace", default=None, help="append the spans of the proposals to this file (see trace_report.py)")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of the proposals traced when they start a trace")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the metrics on this local port (OpenMetrics text format)")
+    args = parser.parse_args()
+
+    funding_agency = FundingAgency(args.dedup_capacity, args.dedup_ttl, CODEC_NAMES[args.codec], args.funds, args.pipeline, args.trace, args.trace_sample, args.metrics_port)
\ No newline at end of file
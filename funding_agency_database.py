@@ -1,42 +1,83 @@
+from idempotency_cache import IdempotencyCache
+
 class FundingAgencyDatabase(object):
 
     funds: int
+    # funds set aside for the proposals being evaluated, k = correlation_id, v = amount
+    reservations: dict
+    reserved: int
     # k = correlation_id, v = request metadata
     transaction_history: dict
-    # k = int, v = correlation_id
-    requests_history: dict
+    # requests already processed, k = correlation_id, v = request metadata
+    request_cache: IdempotencyCache
     transaction_number: int
 
-    def __init__(self) -> None:
-        self.funds = 1000000
+    def __init__(self, dedup_capacity: int = 100000, dedup_ttl: float = None, funds: int = 1000000) -> None:
+        self.funds = funds
+        self.reservations = {}
+        self.reserved = 0
         self.transaction_number = 1
         self.transaction_history = {}
-        self.requests_history = {}
+        self.request_cache = IdempotencyCache(dedup_capacity, dedup_ttl)
+
+    def __setstate__(self, state: dict) -> None:
+        # databases saved before the idempotency cache kept the last 10 requests in a ring
+        if "request_cache" not in state:
+            state["request_cache"] = IdempotencyCache()
+            for correlation_id in state.pop("requests_history", {}).values():
+                state["request_cache"].put(correlation_id, state["transaction_history"][correlation_id])
+        self.__dict__.update(state)
+        # reservations are not saved, the proposals being evaluated are redelivered after a restart
+        self.reservations = {}
+        self.reserved = 0
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop("reservations", None)
+        state.pop("reserved", None)
+        return state
 
     def allocate_funds(self, amount: int) -> None:
         self.funds -= amount
 
+    def available_funds(self) -> int:
+        return self.funds - self.reserved
+
+    def reserve_funds(self, correlation_id: str, amount: int) -> bool:
+        """
+            Set aside the amount of a proposal until it is committed or released.
+            Returns false if the funds not reserved by other proposals are not enough.
+        """
+        if correlation_id in self.reservations:
+            return True
+        if amount > self.available_funds():
+            return False
+        self.reservations[correlation_id] = amount
+        self.reserved += amount
+        return True
+
+    def commit_reservation(self, correlation_id: str) -> None:
+        amount = self.reservations.pop(correlation_id)
+        self.reserved -= amount
+        self.allocate_funds(amount)
+
+    def release_reservation(self, correlation_id: str) -> None:
+        amount = self.reservations.pop(correlation_id, 0)
+        self.reserved -= amount
+
     def record_history(self, history_record: dict) -> None:
         history_record['transaction'] = self.transaction_number
 
-        #keep track of the last 10 requests
-        self.requests_history[self.transaction_number % 10] = history_record["correlation_id"]
+        #keep track of the processed requests
+        self.request_cache.put(history_record["correlation_id"], history_record)
         self.transaction_number += 1
 
         #save request transaction - logs
         self.transaction_history[history_record["correlation_id"]] = history_record
 
-    def is_request_new(self, correlation_id: str) -> bool:
+    def previous_result(self, correlation_id: str) -> dict:
         """
-            Return false if the transaction has been already processed.
-            Return false if this is a new request.
+            Return the history record of the request if it has been already processed.
+            Return None if this is a new request.
         """
-        for k, v in self.requests_history.items():
-            if v == correlation_id:
-                return False
-            
-        return True
-    
-    def get_request_metadata(self, correlation_id: str) -> dict:
-        return self.transaction_history[correlation_id]
-    
\ No newline at end of file
+        return self.request_cache.lookup(correlation_id)
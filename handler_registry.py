@@ -0,0 +1,131 @@
+from university_request_handler import UniversityRequestHandler
+from university_database import UniversityDatabase
+from request_response import RequestResponse
+from request_status import RequestStatus
+from actions import Actions
+from timer import Timer
+from threading import Lock
+from bisect import bisect_left
+import time
+
+class ActionStats(object):
+    """
+        Latency histogram, error counters and throughput of one action
+            - errors: the handler raised an exception
+            - failures: the handler answered with a failed response
+    """
+
+    # upper bounds of the latency buckets in seconds, the last one catches everything
+    BUCKETS: tuple = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float("inf"))
+
+    count: int
+    errors: int
+    failures: int
+    total_time: float
+    buckets: list
+    started: float
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.buckets = [0] * len(self.BUCKETS)
+        self.started = time.monotonic()
+
+    def observe(self, seconds: float, error: bool, failed: bool) -> None:
+        self.count += 1
+        self.total_time += seconds
+        self.buckets[bisect_left(self.BUCKETS, seconds)] += 1
+        if error:
+            self.errors += 1
+        if failed:
+            self.failures += 1
+
+    def quantile(self, q: float) -> float:
+        """
+            Upper bound of the bucket that contains the q-quantile
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS, self.buckets):
+            cumulative += count
+            if cumulative >= rank and cumulative > 0:
+                return bound
+        return 0.0
+
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+class HandlerRegistry(object):
+    """
+        Dispatches each request to the handler registered for its action in O(1).
+
+        The request schema of a handler (its action and required fields) is validated once
+        when the handler is registered, dispatch only checks that the fields are present.
+        Latency, errors and throughput are recorded per action.
+    """
+
+    # k = action value, v = (handler, required fields)
+    handlers: dict
+    # k = action value, v = ActionStats
+    stats: dict
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.handlers = {}
+        self.stats = {}
+        self.lock = Lock()
+
+    def register(self, handler: UniversityRequestHandler) -> "HandlerRegistry":
+        if not isinstance(handler.action, Actions):
+            raise ValueError(f"{type(handler).__name__} does not declare the action it handles")
+        if handler.action.value in self.handlers:
+            raise ValueError(f"a handler for '{handler.action.value}' is already registered")
+        if not all(isinstance(field, str) for field in handler.required_fields):
+            raise ValueError(f"{type(handler).__name__} required fields must be strings")
+
+        required_fields = tuple(dict.fromkeys(("request_type",) + tuple(handler.required_fields)))
+        self.handlers[handler.action.value] = (handler, required_fields)
+        self.stats[handler.action.value] = ActionStats()
+        return self
+
+    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        entry = self.handlers.get(request.get("request_type"))
+        if entry is None:
+            return RequestResponse(
+                RequestStatus.FAILED.value,
+                f"Request '{request.get('request_type')}' is not supported",
+                timer.get_time()
+            )
+
+        handler, required_fields = entry
+        missing = [field for field in required_fields if field not in request]
+        if missing:
+            return RequestResponse(
+                RequestStatus.FAILED.value,
+                f"Request '{request['request_type']}' is missing {missing}",
+                timer.get_time()
+            )
+
+        start = time.perf_counter()
+        error, failed = True, False
+        try:
+            result = handler.handle(request, database, timer)
+            error, failed = False, result.status == RequestStatus.FAILED.value
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stats[request["request_type"]].observe(elapsed, error, failed)
+
+    def report(self) -> str:
+        lines = [f"\t{'ACTION':42} | {'COUNT':8} | {'ERRORS':6} | {'FAILED':6} | {'REQ/S':8} | {'P50(ms)':8} | {'P99(ms)':8}"]
+        with self.lock:
+            for action, stats in self.stats.items():
+                lines.append(
+                    f"\t{action:42} | {stats.count:8} | {stats.errors:6} | {stats.failures:6} | {stats.throughput():8.1f} | "
+                    f"{stats.quantile(0.5) * 1000:8.1f} | {stats.quantile(0.99) * 1000:8.1f}"
+                )
+        return "\n".join(lines)
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import time
+
+class IdempotencyCache(object):
+    """
+        Bounded map of the requests already processed, used to detect redeliveries.
+
+        Lookups are O(1). When the capacity is reached the least recently used entry
+        is evicted, and entries older than ttl seconds (if set) are treated as missing.
+        The cache is pickled together with the database that owns it.
+    """
+
+    capacity: int
+    ttl: float
+    # k = request key, v = (recorded_at, value), ordered from least to most recently used
+    entries: OrderedDict
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, capacity: int = 100000, ttl: float = None) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, capacity: int, ttl: float = None) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self._evict()
+
+    def _expired(self, recorded_at: float, now: float) -> bool:
+        return self.ttl is not None and now - recorded_at > self.ttl
+
+    def _evict(self) -> None:
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: tuple, value: object, recorded_at: float = None) -> None:
+        if recorded_at is None:
+            recorded_at = time.time()
+
+        self.entries[key] = (recorded_at, value)
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _lookup(self, key: tuple) -> tuple:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0], time.time()):
+            del self.entries[key]
+            self.evictions += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def __contains__(self, key: tuple) -> bool:
+        if self._lookup(key) is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def get(self, key: tuple, default: object = None) -> object:
+        entry = self._lookup(key)
+        return default if entry is None else entry[1]
+
+    def lookup(self, key: tuple) -> object:
+        """
+            Value of a request already processed, None for a new request.
+            Checks and reads the entry in one step: it cannot expire in between.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate()
+        }
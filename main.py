@@ -1,12 +1,18 @@
 #!/usr/bin/env python
-from pika import BlockingConnection, ConnectionParameters
-from pika.spec import Basic, BasicProperties
-from pika.adapters.blocking_connection import BlockingChannel
 from concurrent.futures import ThreadPoolExecutor
-import json
 from actions import Actions
+from connection_pool import pool
+from codec import CODEC_NAMES, JSON_CONTENT_TYPE, encode
+from confirmed_publisher import ConfirmedPublisher
+from pika.spec import BasicProperties
+import argparse
+import sys
 
 def get_commands() -> list:
+    input_line = input(" [Main] Type command:\n")
+    return parse_commands(input_line)
+
+def parse_commands(input_line: str) -> list:
     """
         Parse commands given in input with the following format:
 
@@ -24,17 +30,33 @@ def get_commands() -> list:
             - remove
             - transactions
             - details
+            - accounts
+            - query
+            - report
             - time
 
         the third parameter can be amount (only for withdraw/proposal) or researcher (only for add/remove)
 
+        the transactions command can be paginated or streamed:
+
+            - routing_key:transactions:offset:limit     (the page after transaction 'offset', at most 'limit' transactions)
+            - routing_key:transactions:stream           (the whole listing sent in chunks)
+
+        the accounts command lists the active accounts, or filters them by end date or lead researcher:
+
+            - routing_key:accounts:expiring:from:to     (the accounts ending between the dates 'dd-mm-yyyy')
+            - routing_key:accounts:lead:researcher      (the accounts led by the researcher)
+
+        the query command filters the transactions of the account, every filter is optional:
+
+            - routing_key:query:researcher=3:from=01-03-2026:to=31-03-2026:min=10:max=500:after=0:limit=50
+
         the proposal command has the following structure, all parameters are mandatory:
 
             - routing_key:command:project_id:title:description:amount
 
     """
     
-    input_line = input(" [Main] Type command:\n")
     list_commands = []
 
     requests = input_line.split("|")
@@ -59,11 +81,46 @@ def get_commands() -> list:
             routing_key, command, researcher =  request.split(":")
             list_commands.append({"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.REMOVE_RESEARCHER.value, "researcher": f"Researcher-{researcher.strip()}"})
         elif command == "transactions":
-            routing_key, command =  request.split(":")
-            list_commands.append({"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.LIST_TRANSACTIONS.value})
+            routing_key, command, *page =  request.split(":")
+            page = [parameter.strip() for parameter in page]
+            transactions_command = {"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.LIST_TRANSACTIONS.value}
+            if page == ["stream"]:
+                transactions_command["stream"] = True
+            elif page:
+                transactions_command["offset"] = int(page[0])
+                if len(page) > 1:
+                    transactions_command["limit"] = int(page[1])
+            list_commands.append(transactions_command)
+        elif command == "accounts":
+            routing_key, command, *query =  request.split(":")
+            query = [parameter.strip() for parameter in query]
+            accounts_command = {"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.LIST_ACCOUNTS.value}
+            if query[:1] == ["expiring"]:
+                accounts_command["expiring_from"] = query[1]
+                if len(query) > 2:
+                    accounts_command["expiring_to"] = query[2]
+            elif query[:1] == ["lead"]:
+                accounts_command["lead"] = f"Researcher-{query[1]}"
+            list_commands.append(accounts_command)
+        elif command == "query":
+            routing_key, command, *filters =  request.split(":")
+            filters = dict(parameter.strip().split("=", 1) for parameter in filters if parameter.strip())
+            query_command = {"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.QUERY_TRANSACTIONS.value}
+            if "researcher" in filters:
+                query_command["researcher"] = f"Researcher-{filters['researcher']}"
+            for name, field in [("from", "from_date"), ("to", "to_date")]:
+                if name in filters:
+                    query_command[field] = filters[name]
+            for name, field in [("min", "min_amount"), ("max", "max_amount"), ("after", "offset"), ("limit", "limit")]:
+                if name in filters:
+                    query_command[field] = int(filters[name])
+            list_commands.append(query_command)
         elif command == "details":
             routing_key, command =  request.split(":")
             list_commands.append({"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.GET_DETAILS.value})
+        elif command == "report":
+            routing_key, command =  request.split(":")
+            list_commands.append({"routing_key": f"Researcher-{routing_key.strip()}", "command": Actions.SPENDING_REPORT.value})
         else:
             routing_key, command =  request.split(":")
             list_commands.append({"routing_key": f"Researcher-{routing_key.strip()}", "command": command.strip()})
@@ -71,27 +128,61 @@ def get_commands() -> list:
 
     return list_commands
 
-def send_command(routing_key: str, request: dict) -> None:
-    connection = BlockingConnection(ConnectionParameters(host='localhost'))
-    channel = connection.channel()
-    
-    channel.exchange_declare(exchange='send_researchers_command', exchange_type='direct')
-
-    channel.basic_publish(
+def send_command(routing_key: str, request: dict, content_type: str = JSON_CONTENT_TYPE) -> None:
+    pool.publish(
         exchange='send_researchers_command', 
         routing_key=routing_key,
-        body=json.dumps(request)
+        body=encode(request, "command", content_type),
+        properties=BasicProperties(content_type=content_type)
     )
                     
     print(" [Main] Sent %r:%r" % (routing_key, request))
-
-    connection.close()
     
+def send_batch(lines, content_type: str = JSON_CONTENT_TYPE, window: int = 1000, latency_file: str = None) -> None:
+    """
+        Publish the commands of every line over one channel with publisher confirms,
+        then report when the broker has accepted them
+    """
+    commands = [command for line in lines if line.strip() for command in parse_commands(line)]
+    properties = BasicProperties(content_type=content_type)
+    messages = [(command['routing_key'], encode(command, "command", content_type), properties) for command in commands]
+
+    report = ConfirmedPublisher(window=window).publish_all('send_researchers_command', 'direct', messages)
+    print(f" [Main] {report.summary()}")
+
+    if latency_file is not None:
+        # confirm latency of every command, in publish order
+        with open(latency_file, 'w') as f:
+            f.write("routing_key,command,status,latency_ms\n")
+            nacked, returned = set(report.nacked), set(report.returned)
+            for index, (command, latency) in enumerate(zip(commands, report.latencies)):
+                status = "unconfirmed" if latency is None else "rejected" if index in nacked else "unroutable" if index in returned else "confirmed"
+                latency_ms = "" if latency is None else f"{latency * 1000:.3f}"
+                f.write(f"{command['routing_key']},{command['command']},{status},{latency_ms}\n")
+        print(f" [Main] Confirm latencies written to {latency_file}")
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codec", choices=list(CODEC_NAMES), default="json", help="encoding of the commands")
+    parser.add_argument("--batch", default=None, help="send the command lines of this file ('-' for stdin) with publisher confirms and exit")
+    parser.add_argument("--window", type=int, default=1000, help="commands waiting for a confirm at the same time (batch mode)")
+    parser.add_argument("--latency-file", default=None, help="write the confirm latency of every command to this CSV file (batch mode)")
+    args = parser.parse_args()
+    content_type = CODEC_NAMES[args.codec]
+
+    if args.batch is not None:
+        if args.batch == '-':
+            send_batch(sys.stdin, content_type, args.window, args.latency_file)
+        else:
+            with open(args.batch) as f:
+                send_batch(f, content_type, args.window, args.latency_file)
+        sys.exit(0)
+
+    pool.declare_exchange('send_researchers_command', 'direct')
 
     requests: list = get_commands()
     with ThreadPoolExecutor(max_workers=len(requests)) as executor:
         while True:
-            futures = executor.map(lambda request: send_command(request['routing_key'], request), requests)
+            futures = executor.map(lambda request: send_command(request['routing_key'], request, content_type), requests)
             
             requests: list = get_commands()
\ No newline at end of file
@@ -0,0 +1,274 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from bisect import bisect_left
+import math
+
+OPENMETRICS_CONTENT_TYPE: str = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds of the latency buckets in seconds, the last one catches everything
+LATENCY_BUCKETS: tuple = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+class Metric(object):
+    """
+        A metric family: one value per combination of its labels.
+        Label values are passed as keyword arguments, e.g. counter.inc(queue="university_requests_queue").
+    """
+
+    TYPE: str = "unknown"
+
+    name: str
+    help: str
+    label_names: tuple
+    # k = tuple of the label values, v = value
+    values: dict
+    lock: Lock
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = Lock()
+
+    def key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} has the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def get(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self) -> list:
+        """
+            (suffix, labels as (name, value) pairs, value) of every sample of the family
+        """
+        with self.lock:
+            return [("", tuple(zip(self.label_names, key)), value) for key, value in sorted(self.values.items())]
+
+    def family_name(self, openmetrics: bool) -> str:
+        return self.name
+
+class Counter(Metric):
+    """
+        Monotonic total. set() mirrors a total counted elsewhere (e.g. the hits of a cache).
+    """
+
+    TYPE: str = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()) -> None:
+        super().__init__(name, help, label_names)
+        if not self.label_names:
+            self.values[()] = 0
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self) -> list:
+        return [("_total", labels, value) for _, labels, value in super().samples()]
+
+    def family_name(self, openmetrics: bool) -> str:
+        # the text format of Prometheus names the family like its samples
+        return self.name if openmetrics else f"{self.name}_total"
+
+class Gauge(Metric):
+    """
+        Value that goes up and down. With a function, the value is read when the metrics are
+        scraped: function() returns a number, or a dict k = tuple of the label values, v = value.
+    """
+
+    TYPE: str = "gauge"
+
+    function: object
+
+    def __init__(self, name: str, help: str, label_names: tuple = (), function=None) -> None:
+        super().__init__(name, help, label_names)
+        self.function = function
+
+    def set(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> list:
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self.lock:
+                self.values = {tuple(str(value) for value in key): value for key, value in values.items()}
+        return super().samples()
+
+class Histogram(Metric):
+    """
+        Distribution of observed values in cumulative buckets, with their sum and count.
+        set() mirrors a histogram recorded elsewhere with the same buckets (e.g. ActionStats).
+    """
+
+    TYPE: str = "histogram"
+
+    buckets: tuple
+
+    def __init__(self, name: str, help: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets) if buckets[-1] == float("inf") else tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            # k = labels, v = [counts per bucket, sum]
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def set(self, counts: list, total: float, **labels) -> None:
+        """
+            counts: observations of each bucket (not cumulative)
+        """
+        if len(counts) != len(self.buckets):
+            raise ValueError(f"{self.name} has {len(self.buckets)} buckets, got {len(counts)}")
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = [list(counts), total]
+
+    def samples(self) -> list:
+        samples = []
+        with self.lock:
+            entries = [(key, list(counts), total) for key, (counts, total) in sorted(self.values.items())]
+        for key, counts, total in entries:
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", labels + (("le", format_value(bound)),), cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+class Metrics(object):
+    """
+        Metrics of a component, exposed in the OpenMetrics (or Prometheus) text format by an
+        HTTP endpoint on a local port, e.g. http://127.0.0.1:9100/metrics
+
+        Names are prefixed with the component, e.g. university_messages_consumed_total.
+        Collectors run before every scrape, they copy into the metrics the statistics kept by
+        other objects (handler registry, caches, storage) so the hot paths are not changed.
+    """
+
+    prefix: str
+    # k = name, v = Metric, in registration order
+    metrics: dict
+    collectors: list
+    server: ThreadingHTTPServer
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self.metrics = {}
+        self.collectors = []
+        self.server = None
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(f"{self.prefix}_{name}", help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = (), function=None) -> Gauge:
+        return self.register(Gauge(f"{self.prefix}_{name}", help, labels, function))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(f"{self.prefix}_{name}", help, labels, buckets))
+
+    def collector(self, function) -> "Metrics":
+        self.collectors.append(function)
+        return self
+
+    def render(self, openmetrics: bool = True) -> str:
+        for collect in self.collectors:
+            collect()
+
+        lines = []
+        for metric in self.metrics.values():
+            family = metric.family_name(openmetrics)
+            lines.append(f"# HELP {family} {escape(metric.help, False)}")
+            lines.append(f"# TYPE {family} {metric.TYPE}")
+            for suffix, labels, value in metric.samples():
+                label_text = ",".join(f'{name}="{escape(str(label))}"' for name, label in labels)
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {format_value(value)}" if labels else f"{metric.name}{suffix} {format_value(value)}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+            Serve the metrics on a daemon thread, port 0 picks a free port
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                # Prometheus asks for OpenMetrics in its Accept header, a browser gets the plain text format
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = metrics.render(openmetrics).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # scrapes are not logged
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, name=f"{self.prefix}-metrics", daemon=True).start()
+        print(f" [M] {self.prefix} metrics on http://{host}:{self.server.server_address[1]}/metrics")
+        return self.server
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def escape(text: str, quotes: bool = True) -> str:
+    text = text.replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quotes else text
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if isinstance(value, float) and math.isnan(value):
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
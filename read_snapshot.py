@@ -0,0 +1,147 @@
+from university_database import UniversityDatabase, ResearchAccount, AccountReader
+from transaction_ledger import TransactionLedger
+from render_cache import RenderCache
+from spend_aggregates import SpendAggregates
+from account_index import AccountIndex
+from request_response import RequestResponse
+from contextlib import nullcontext
+from datetime import date
+from threading import Lock
+
+class LedgerView(object):
+    """
+        The first `count` transactions of a ledger. The ledger is append-only, so these rows
+        never change and can be read without the lock of the account.
+        The aggregates are copied, they are updated in place by the next withdrawals.
+    """
+
+    ledger: TransactionLedger
+    count: int
+    aggregates: SpendAggregates
+
+    def __init__(self, ledger: TransactionLedger, count: int) -> None:
+        self.ledger = ledger
+        self.count = count
+        self.aggregates = ledger.aggregates.copy()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def row(self, index: int) -> dict:
+        if not 0 <= index < self.count:
+            raise IndexError("transaction index out of range")
+        return self.ledger.row(index)
+
+    def find(self, count: int = None, **filters):
+        count = self.count if count is None else min(count, self.count)
+        return self.ledger.find(count=count, **filters)
+
+class AccountView(object):
+    """
+        Frozen copy of an account, with the fields read by AccountReader
+    """
+
+    # nothing to serialize, the view never changes
+    lock = nullcontext()
+
+    project_id: str
+    title: str
+    description: str
+    leading_researcher: str
+    budget: int
+    users: list
+    end_date: date
+    version: int
+    expired: bool
+    transactions: LedgerView
+
+    def __init__(self, account: ResearchAccount) -> None:
+        self.project_id = account.project_id
+        self.title = account.title
+        self.description = account.description
+        self.leading_researcher = account.leading_researcher
+        self.budget = account.budget
+        # printed like the list of the account
+        self.users = list(account.users)
+        self.end_date = account.end_date
+        self.version = account.version
+        self.expired = account.expired
+        self.transactions = LedgerView(account.transactions, len(account.transactions))
+
+class ReadSnapshot(AccountReader):
+    """
+        Immutable state of the accounts at a commit, read by any number of threads without locks.
+        Read-only requests served from a snapshot are not recorded in the request history.
+
+        The index is the live index of the database: the accounts it finds that are not in
+        the snapshot yet are skipped.
+    """
+
+    # k = project_id, v = AccountView
+    accounts: dict
+    # k = researcher, v = project_id
+    researchers: dict
+    version: int
+
+    def __init__(self, accounts: dict, researchers: dict, version: int, render_cache: RenderCache, index: AccountIndex) -> None:
+        self.accounts = accounts
+        self.researchers = researchers
+        self.version = version
+        # shared with the database, renders are keyed by account version
+        self.render_cache = render_cache
+        self.index = index
+
+    def get_account(self, researcher: str) -> AccountView:
+        account_name = self.researchers.get(researcher)
+        return None if account_name is None else self.accounts.get(account_name)
+
+    def record_request_result(self, correlation_id: str, result: RequestResponse, request_type: str) -> None:
+        # reads change nothing, a redelivered read is served again
+        pass
+
+class ReadReplica(object):
+    """
+        Publishes a new ReadSnapshot of the database after each commit.
+
+        Only the accounts changed since the previous snapshot are copied, the researchers
+        mapping is copied only when it has changed: the views of the other accounts are
+        shared between consecutive snapshots.
+    """
+
+    database: UniversityDatabase
+    current: ReadSnapshot
+    # serializes the refreshes, each snapshot is built from the previous one
+    lock: Lock
+
+    def __init__(self, database: UniversityDatabase) -> None:
+        self.database = database
+        self.lock = Lock()
+        with database.lock:
+            database.take_changes()
+            accounts = {}
+            for project_id, account in database.accounts.items():
+                with account.lock:
+                    accounts[project_id] = AccountView(account)
+            self.current = ReadSnapshot(accounts, dict(database.researchers), 0, database.render_cache, database.index)
+
+    def refresh(self) -> ReadSnapshot:
+        with self.lock:
+            changed_accounts, researchers_changed = self.database.take_changes()
+            if not changed_accounts and not researchers_changed:
+                return self.current
+
+            previous = self.current
+            accounts = dict(previous.accounts)
+            with self.database.lock:
+                researchers = dict(self.database.researchers) if researchers_changed else previous.researchers
+                for project_id in changed_accounts:
+                    account: ResearchAccount = self.database.accounts.get(project_id)
+                    if account is None:
+                        # moved to another shard
+                        accounts.pop(project_id, None)
+                        continue
+                    with account.lock:
+                        accounts[project_id] = AccountView(account)
+
+            self.current = ReadSnapshot(accounts, researchers, previous.version + 1, self.database.render_cache, self.database.index)
+            return self.current
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from threading import Lock
+import sys
+
+class RenderCache(object):
+    """
+        Bounded map of the rendered account details and transaction listings.
+
+        Keys carry the version of the account, a new version never matches a stale render:
+        the renders of old versions are not used anymore and are evicted as least recently used
+        once the memory taken by the cached strings exceeds max_bytes.
+        Shared by the read workers, every operation takes the lock.
+    """
+
+    max_bytes: int
+    # k = (kind, project_id, version, *page), v = rendered message (or tuple of message and cursor),
+    # ordered from least to most recently used
+    entries: OrderedDict
+    # memory taken by the cached strings
+    size_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    lock: Lock
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key: tuple) -> str:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def sizeof(self, value) -> int:
+        if isinstance(value, tuple):
+            return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        return sys.getsizeof(value)
+
+    def put(self, key: tuple, value: str) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= self.sizeof(previous)
+            self.entries[key] = value
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size_bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def render(self, key: tuple, render) -> str:
+        """
+            Returns the cached message of key, rendered with render() if it is missing
+        """
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate()
+            }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"\trender cache: {stats['size']} entries, {stats['bytes'] / 1024:.1f} KB of {stats['max_bytes'] / 1024:.0f} KB, "
+            f"hit rate {stats['hit_rate'] * 100:.1f}% ({stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions)"
+        )
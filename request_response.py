@@ -1,5 +1,6 @@
 import json
-from datetime import date, datetime
+from datetime import date
+from codec import JSON_CONTENT_TYPE, encode, decode, parse_date, format_date
 
 class RequestResponse(object):
     
@@ -8,33 +9,73 @@ class RequestResponse(object):
     account: str
     timestamp: date
     action: str
+    # where the next page starts (paginated responses), None if this is the last page
+    cursor: int
 
-    def __init__(self, status: str, message: str, timestamp: date, account: str = None, action: str = None) -> None:
+    def __init__(self, status: str, message: str, timestamp: date, account: str = None, action: str = None, cursor: int = None) -> None:
         self.status = status
         self.message = message
         self.timestamp = timestamp
         self.account = account
         self.action = action
+        self.cursor = cursor
 
     @classmethod
-    def from_json_data(self, json_data: str) -> None:
-        data = json.loads(json_data)
+    def from_dict(cls, data: dict) -> "RequestResponse":
+        return cls(
+            data["status"],
+            data["message"],
+            parse_date(data["timestamp"]),
+            data.get("account"),
+            data.get("action"),
+            data.get("cursor")
+        )
 
-        self.status = data["status"]
-        self.message = data["message"]
-        self.account = data["account"]
-        self.timestamp = datetime.strptime(data["timestamp"], '%d-%m-%Y').date()
-        self.action = data["action"]
+    @classmethod
+    def from_json_data(cls, json_data: str) -> "RequestResponse":
+        return cls.from_dict(json.loads(json_data))
 
-        return self
+    @classmethod
+    def decode(cls, body: bytes, content_type: str = JSON_CONTENT_TYPE) -> "RequestResponse":
+        return cls.from_dict(decode(body, content_type))
 
-    def to_json(self) -> str:
-        data = {
+    def to_dict(self) -> dict:
+        return {
             "status": self.status,
             "message": self.message,
             "account": self.account,
-            "timestamp": self.timestamp.strftime("%d-%m-%Y"),
-            "action": self.action
+            "timestamp": format_date(self.timestamp),
+            "action": self.action,
+            "cursor": self.cursor
         }
 
-        return json.dumps(data)
\ No newline at end of file
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def encode(self, content_type: str = JSON_CONTENT_TYPE) -> bytes:
+        return encode(self.to_dict(), "response", content_type)
+
+class StreamedResponse(RequestResponse):
+    """
+        Response sent as a sequence of messages, each one carries a chunk of the message.
+        Chunks are produced lazily while they are sent.
+    """
+
+    chunks: object
+
+    def __init__(self, status: str, chunks, timestamp: date, account: str = None, action: str = None) -> None:
+        super().__init__(status, "", timestamp, account, action)
+        self.chunks = chunks
+
+    def encode_chunks(self, content_type: str = JSON_CONTENT_TYPE):
+        """
+            Yields (body, last) for every chunk
+        """
+        previous = None
+        for chunk in self.chunks:
+            if previous is not None:
+                yield previous, False
+            self.message = chunk
+            previous = self.encode(content_type)
+        self.message = ""
+        yield (previous if previous is not None else self.encode(content_type)), True
@@ -1,5 +1,6 @@
 import json
-from datetime import date, datetime
+from datetime import date
+from codec import JSON_CONTENT_TYPE, encode, decode, parse_date, format_date
 
 class ResearchProposalRequest(object):
     
@@ -19,26 +20,36 @@ class ResearchProposalRequest(object):
         self.researcher_id = researcher_id
 
     @classmethod
-    def from_json_data(self, json_data: str) -> None:
-        data = json.loads(json_data)
+    def from_dict(cls, data: dict) -> "ResearchProposalRequest":
+        return cls(
+            data["id"],
+            data["title"],
+            data["description"],
+            data["amount"],
+            parse_date(data["timestamp"]),
+            data["researcher_id"]
+        )
 
-        self.id = data["id"]
-        self.title = data["title"]
-        self.description = data["description"]
-        self.amount = data["amount"]
-        self.timestamp = datetime.strptime(data["timestamp"], '%d-%m-%Y').date()
-        self.researcher_id = data["researcher_id"]
+    @classmethod
+    def from_json_data(cls, json_data: str) -> "ResearchProposalRequest":
+        return cls.from_dict(json.loads(json_data))
 
-        return self
+    @classmethod
+    def decode(cls, body: bytes, content_type: str = JSON_CONTENT_TYPE) -> "ResearchProposalRequest":
+        return cls.from_dict(decode(body, content_type))
 
-    def to_json(self) -> str:
-        data = {
+    def to_dict(self) -> dict:
+        return {
             "id": self.id,
             "title": self.title,
             "description": self.description,
             "amount": self.amount,
-            "timestamp": self.timestamp.strftime("%d-%m-%Y"),
+            "timestamp": format_date(self.timestamp),
             "researcher_id": self.researcher_id
         }
 
-        return json.dumps(data)
\ No newline at end of file
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def encode(self, content_type: str = JSON_CONTENT_TYPE) -> bytes:
+        return encode(self.to_dict(), "proposal", content_type)
@@ -1,66 +1,139 @@
 #!/usr/bin/env python
-from pika import BlockingConnection, ConnectionParameters
-from pika.spec import Basic, BasicProperties, PERSISTENT_DELIVERY_MODE
+from pika import BlockingConnection
+from pika.spec import Basic, BasicProperties
 from pika.adapters.blocking_connection import BlockingChannel
 import uuid
 from research_proposal_request import ResearchProposalRequest
-import json
 import random
-from actions import Actions
+from actions import Actions, university_queue
 from datetime import date, datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import namedtuple
 from timer import Timer
 from request_status import RequestStatus
-from threading import Condition
+from queue import Queue
+from rpc_client import RpcClient
+from codec import CODEC_NAMES, JSON_CONTENT_TYPE, codec_for, encode, decode
+from connection_pool import pool
+from transport import connect
+from tracing import Tracer, Span
+from metrics import Metrics, Counter, Histogram
+import argparse
 import sys
+import time
+
+# commands performed by a researcher
+COMMANDS: set = {action.value for action in Actions} | {"time"}
+
+# RPC of a command, performed with the transport of the researcher (see Researcher.command_steps)
+# stream: answered with a stream of chunks, its reply is the status of the response
+Rpc = namedtuple("Rpc", ["command", "routing_key", "body", "correlation_id", "span", "stream"], defaults=[False])
+
+class ResearcherMetrics(object):
+    """
+        Metrics of the researchers of a process: a Researcher, or every researcher of a ResearcherHost
+    """
+
+    metrics: Metrics
+    consumed: Counter
+    acked: Counter
+    handler_duration: Histogram
+    round_trips: Histogram
+
+    def __init__(self, prefetch: int, in_flight) -> None:
+        """
+            prefetch: commands delivered and not acked at most
+            in_flight: function returning the RPCs waiting for their reply
+        """
+        metrics = self.metrics = Metrics("researcher")
+        self.consumed = metrics.counter("messages_consumed", "Commands received.")
+        self.acked = metrics.counter("messages_acked", "Commands completed and acknowledged.")
+        unacked = lambda: self.consumed.get() - self.acked.get()
+        metrics.gauge("messages_unacked", "Commands received and not acknowledged yet.", function=unacked)
+        metrics.gauge("prefetch_utilisation", "Unacknowledged commands over the prefetch count.", function=lambda: unacked() / prefetch)
+        self.handler_duration = metrics.histogram("handler_duration_seconds", "Time spent performing a command, by command and status.", ("command", "status"))
+        self.round_trips = metrics.histogram("rpc_round_trip_seconds", "Time from the publish of a request to its reply, by queue.", ("queue",))
+        metrics.gauge("rpc_in_flight", "Requests sent and not answered yet.", function=in_flight)
+
+    def observe_command(self, command: dict, status: str, seconds: float) -> None:
+        # unknown commands share a label
+        name = command["command"] if command["command"] in COMMANDS else "unknown"
+        self.handler_duration.observe(seconds, command=name, status=status)
+
+    def serve(self, port: int) -> None:
+        self.metrics.serve(port)
 
 class Researcher(object):
 
-    fa_correlation_id: uuid
-    uni_correlation_id: uuid
     id: str
     current_date: date
     timer: Timer
-    command: dict = None
-    command_lock: Condition = Condition()
+    rpc_client: RpcClient
+    # commands received and not completed yet: (command, props, delivery tag)
+    commands: Queue
+    # threads performing the commands
+    workers: int
+    # commands delivered by the broker and not acked yet
+    prefetch: int
     command_channel: BlockingChannel
-    command_connection: BlockingConnection
+    command_connection: BlockingConnection = None
     run: bool
-
-    def __init__(self, id: int) -> None:
+    # codec of the requests sent by the researcher
+    content_type: str
+    tracer: Tracer
+    metrics: ResearcherMetrics
+
+    def __init__(self, id: int, content_type: str = JSON_CONTENT_TYPE, workers: int = 3, prefetch: int = None,
+                 trace_file: str = None, trace_sample: float = 1.0, metrics_port: int = None) -> None:
+        """
+            workers/prefetch:
+                commands are performed by a pool of workers and acked once completed. The broker
+                delivers at most prefetch unacked commands, so the work queue never grows beyond
+                prefetch and consumption pauses while it is full (defaults to 4 commands per worker)
+
+            trace_file/trace_sample:
+                every command starts a trace (a fraction trace_sample of them), the spans are appended to trace_file
+
+            metrics_port:
+                serve the metrics (commands, command latency, RPC round trips) on this local port, None to disable
+        """
         self.current_date = date.today()
         self.id = f"Researcher-{id}"
         self.timer = Timer(self.id)
+        self.content_type = content_type
+        self.workers = max(workers, 1)
+        self.prefetch = prefetch if prefetch is not None else self.workers * 4
+        self.commands = Queue(maxsize=self.prefetch)
         self.run = True
-        self.delivery_tag = None
+        self.tracer = Tracer("researcher", trace_file, trace_sample)
+        self.metrics = ResearcherMetrics(self.prefetch, lambda: self.rpc_client.in_flight())
+        self.rpc_client = RpcClient(self.id, clock=self.timer, round_trips=self.metrics.round_trips)
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
 
 
     def start(self) -> None:
-        # two threads
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            executor.submit(self.timer.start)
-            executor.submit(self.command_listener)
-
-            while self.run:
-                # listen to commands     
-                with self.command_lock:
-                    if self.command == None:
-                        self.command_lock.wait()
-                    if self.command['command'] == "exit":
-                        print("exit")
-                        self.run = False
-                        break
-                    executor.submit(self.perform_command, self.command)
-                    self.command_channel.basic_ack(delivery_tag = self.delivery_tag)
-                    self.command = None
-
-            self.timer.stop()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in range(self.workers):
+                executor.submit(self.command_worker)
+
+            # consume on this thread until the exit command
+            self.command_listener()
+
+            # every command already received is completed before exiting
+            for _ in range(self.workers):
+                self.commands.put(None)
+
+        self.timer.stop()
+        if self.command_connection is not None and self.command_connection.is_open:
+            # run the acks scheduled by the workers
+            self.command_connection.process_data_events(time_limit=0)
             self.command_connection.close()
-            sys.exit(0)
+        sys.exit(0)
 
     def command_listener(self) -> str:
         try:
-            self.command_connection = BlockingConnection(ConnectionParameters(host='localhost'))
+            self.command_connection = connect()
             self.command_channel = self.command_connection.channel()
 
             self.command_channel.exchange_declare(exchange='send_researchers_command', exchange_type='direct')
@@ -71,9 +144,9 @@ class Researcher(object):
             self.command_channel.queue_bind(exchange='send_researchers_command', queue=queue_name, routing_key=self.id)
 
             print(f" [{self.id}] Waiting commands")
-            #Fair dispatch, no more than one message to a worker at a time
-            #To avoid race condition
-            self.command_channel.basic_qos(prefetch_count=1)
+            # commands are acked when completed, the broker stops delivering
+            # when prefetch commands are queued or running
+            self.command_channel.basic_qos(prefetch_count=self.prefetch)
 
             self.command_channel.basic_consume(queue=queue_name, on_message_callback=self.command_callback, auto_ack=False)
 
@@ -82,14 +155,67 @@ class Researcher(object):
             print(e)
 
     def command_callback(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
-        message = json.loads(body)
-
-        with self.command_lock:
-            self.command = message
-            self.command_lock.notify()
-            self.delivery_tag = method.delivery_tag
-
-    def perform_command(self, command: dict) -> None:
+        self.metrics.consumed.inc()
+        message = decode(body, props.content_type)
+
+        if message['command'] == "exit":
+            print("exit")
+            self.run = False
+            self.ack(method.delivery_tag)
+            ch.stop_consuming()
+            return
+
+        # never blocks: the queue holds as many commands as the broker can deliver unacked
+        self.commands.put((message, props, method.delivery_tag))
+
+    def command_worker(self) -> None:
+        """
+            Runs on the worker pool, the channel can only be used from the connection thread
+        """
+        while True:
+            item = self.commands.get()
+            if item is None:
+                return
+            command, props, delivery_tag = item
+            try:
+                self.perform_command(command, props)
+            except Exception as e:
+                # a sender waiting for completion gets the FAILED status, the command is not redelivered
+                print(f" [{self.id}] Command {command['command']} failed: {e!r}")
+            finally:
+                self.command_connection.add_callback_threadsafe(lambda delivery_tag=delivery_tag: self.ack(delivery_tag))
+
+    def ack(self, delivery_tag: int) -> None:
+        self.command_channel.basic_ack(delivery_tag=delivery_tag)
+        self.metrics.acked.inc()
+
+    def perform_command(self, command: dict, props: BasicProperties = None) -> None:
+        """
+            Perform the steps of the command, its RPCs are blocking calls of the rpc client
+        """
+        steps = self.command_steps(command, props)
+        result, error = None, None
+        while True:
+            try:
+                rpc = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration:
+                return
+            try:
+                result, error = self.rpc(rpc), None
+            except Exception as e:
+                result, error = None, e
+
+    def command_steps(self, command: dict, props: BasicProperties = None):
+        """
+            Steps of a command, shared by every transport: yields the Rpc to perform and receives
+            its reply (the status of the response if streamed), an RPC that fails is thrown back
+        """
+        # outcome of the command and seconds spent on every hop, sent to the sender if it waits for completion
+        status, hops = None, {}
+        if "sent_at" in command:
+            hops["command delivery"] = max(time.time() - command["sent_at"], 0.0)
+        span = self.start_span(command, props)
+        started = time.perf_counter()
         try:
             if command["command"] == Actions.RESEARCH_PROPOSAL.value:
                 request_proposal = ResearchProposalRequest(
@@ -102,8 +228,19 @@ class Researcher(object):
                 )
 
                 print(f" [{self.id}] Submitting research proposal")
-                self.submit_research_proposal(request_proposal)
-                print(f" [{self.id}] Research proposal has been {self.funding_agency_response['status']}. Amount: {request_proposal.amount}")
+                start = time.perf_counter()
+                # Send Request To Funding Agency
+                funding_agency_response = yield Rpc(
+                    command['command'],
+                    'submit_research_proposal',
+                    request_proposal.encode(self.content_type),
+                    None,
+                    span
+                )
+                hops["researcher→funding agency"] = time.perf_counter() - start
+                hops.update(funding_agency_response.get("hops") or {})
+                status = funding_agency_response['status']
+                print(f" [{self.id}] Research proposal has been {funding_agency_response['status']}. Amount: {request_proposal.amount}")
             elif command["command"] == "time":
                 # print time of researcher
                 print(f" [{self.id}] {self.timer.get_time_str()}")
@@ -114,111 +251,128 @@ class Researcher(object):
                 # notify researcher that has been removed from the research account
                 print(f" [{self.id}] removed from account '{command['account']}'")
             elif command["command"] not in [comm.value for comm in Actions]:
+                status = RequestStatus.FAILED.value
                 print(f" [{self.id}] command {command['command']} does not exist")
             else:
-                execute_command_connection = BlockingConnection(ConnectionParameters(host='localhost'))
-
-                execute_command_channel = execute_command_connection.channel()
-
-                result = execute_command_channel.queue_declare(queue='', exclusive=True)
-                self.uni_callback_queue = result.method.queue
-
-                execute_command_channel.basic_consume(
-                    queue=self.uni_callback_queue,
-                    on_message_callback=self.command_response,
-                    auto_ack=True
-                )
-                
-                #Initialize the response to NULL and create a new request ID
-                self.university_response = None
-                self.uni_correlation_id = str(uuid.uuid4())
+                #create a new request ID
+                correlation_id = str(uuid.uuid4())
 
                 # Execute University RPC
-                execute_command_channel.basic_publish(
-                    exchange='',
-                    routing_key='university_requests_queue',
-                    properties=BasicProperties(
-                        reply_to=self.uni_callback_queue,           # Anonymous exclusive researcher callback queue
-                        correlation_id=self.uni_correlation_id,    # Request ID
-                        content_type="application/json",
-                        delivery_mode = PERSISTENT_DELIVERY_MODE
-                    ),
-                    body=json.dumps({
-                        "correlation_id": self.uni_correlation_id,
-                        "request_type": command['command'],
-                        "amount": command['amount'] if "amount" in command.keys() else None,
-                        "researcher": self.id,
-                        "target_researcher": command['researcher'] if "researcher" in command.keys() else None,
-                        "timestamp": self.timer.get_time_str()
-                    })
+                start = time.perf_counter()
+                university_response = yield Rpc(
+                    command['command'],
+                    university_queue(command['command']),
+                    self.university_request(command, correlation_id),
+                    correlation_id,
+                    span,
+                    command.get("stream", False)
                 )
+                hops["researcher→university"] = time.perf_counter() - start
 
-        
-                execute_command_connection.process_data_events(time_limit=None)
-            
-                print(f" {self.university_response['status']}:[{self.id}] Command {command['command']}:\n{self.university_response['message']}\n")
-
-        except Exception as e:
-            print(e)
-            raise e
-
-    # response of the university rpc
-    def command_response(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
-        if self.uni_correlation_id == props.correlation_id:
-            self.university_response = json.loads(body)
+                if command.get("stream"):
+                    # the chunks have been printed as they were received
+                    status = university_response
+                else:
+                    status = university_response['status']
 
-            #adjust timer if needed
-            self.timer.adjust_timer(self.university_response["timestamp"])
+                    # the clock is adjusted by the rpc client
+                
+                    print(f" {university_response['status']}:[{self.id}] Command {command['command']}:\n{university_response['message']}\n")
+                    if university_response.get("cursor") is not None:
+                        print(f" [{self.id}] More transactions available, next page: {command['command']} from {university_response['cursor']}")
 
-    def submit_research_proposal(self, request: ResearchProposalRequest) -> None:
-        try:
-            #Connect to RabbitMQ
-            connection = BlockingConnection(ConnectionParameters(host='localhost'))
-            channel = connection.channel()
-
-            #Create an anonymous exclusive callback queue
-            result = channel.queue_declare(queue='', exclusive=True)
-            callback_queue = result.method.queue
-
-            channel.basic_consume(
-                queue=callback_queue,
-                on_message_callback=self.on_response,
-                auto_ack=True)
-
-            self.funding_agency_response = None
-            self.fa_correlation_id = None
-
-            #Initialize the response to NULL and create a new request ID
-            self.funding_agency_response = None
-            self.fa_correlation_id = str(uuid.uuid4())
-
-            # Send Request To Funding Agency
-            channel.basic_publish(
-                exchange='',
-                routing_key='submit_research_proposal',
-                properties=BasicProperties(
-                    reply_to=callback_queue,   # Anonymous exclusive researcher callback queue
-                    correlation_id=self.fa_correlation_id,    # Request ID
-                    content_type="application/json",
-                    delivery_mode = PERSISTENT_DELIVERY_MODE
-                ),
-                body=request.to_json()
-            )
-
-            connection.process_data_events(time_limit=None)
         except Exception as e:
-            print(e)
+            status = RequestStatus.FAILED.value
+            span.tag("error", e)
             raise e
-        
-    # response to the research proposal by the funding agency
-    def on_response(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
-        if self.fa_correlation_id == props.correlation_id:
-            self.funding_agency_response = json.loads(body)
-
-            #adjust timer if needed
-            self.timer.adjust_timer(self.funding_agency_response["timestamp"])
+        finally:
+            span.annotate("handler end").tag("status", status or RequestStatus.SUCCEEDED.value)
+            self.metrics.observe_command(command, status or RequestStatus.SUCCEEDED.value, time.perf_counter() - started)
+            if props is not None and props.reply_to:
+                span.annotate("reply")
+                self.send_completion(props, command, status or RequestStatus.SUCCEEDED.value, hops)
+            span.finish()
+
+    def rpc(self, rpc: Rpc):
+        if rpc.stream:
+            return self.stream_command(rpc)
+        return self.rpc_client.call(rpc.routing_key, rpc.body, rpc.correlation_id, content_type=self.content_type, parent_span=rpc.span)
+
+    def start_span(self, command: dict, props: BasicProperties = None) -> Span:
+        """
+            Span of a command, child of the span of the sender if the command carries one
+        """
+        span = self.tracer.start_span(command["command"], "SERVER", None if props is None else props.headers)
+        return span.tag("researcher", self.id).annotate("handler start")
+
+    def send_completion(self, props: BasicProperties, command: dict, status: str, hops: dict) -> None:
+        """
+            Tell the sender of a command that it has been completed
+        """
+        pool.publish(
+            exchange='',
+            routing_key=props.reply_to,
+            properties=BasicProperties(
+                correlation_id=props.correlation_id,
+                content_type=codec_for(props.content_type).content_type,
+                headers=self.timer.headers()
+            ),
+            body=encode({
+                "status": status,
+                "message": command["command"],
+                "timestamp": self.timer.get_time_str(),
+                "hops": hops
+            }, "response", props.content_type)
+        )
+
+    def university_request(self, command: dict, correlation_id: str) -> bytes:
+        return encode({
+            "correlation_id": correlation_id,
+            "request_type": command['command'],
+            "amount": command['amount'] if "amount" in command.keys() else None,
+            "researcher": self.id,
+            "target_researcher": command['researcher'] if "researcher" in command.keys() else None,
+            "offset": command.get("offset"),
+            "limit": command.get("limit"),
+            "stream": command.get("stream", False),
+            "expiring_from": command.get("expiring_from"),
+            "expiring_to": command.get("expiring_to"),
+            "lead": command.get("lead"),
+            "from_date": command.get("from_date"),
+            "to_date": command.get("to_date"),
+            "min_amount": command.get("min_amount"),
+            "max_amount": command.get("max_amount"),
+            "timestamp": self.timer.get_time_str()
+        }, "university_request", self.content_type)
+
+    def stream_command(self, rpc: Rpc) -> str:
+        """
+            Execute a University RPC answered with a stream, every chunk is printed as soon as it is received.
+            Returns the status of the response.
+        """
+        chunks = 0
+        for chunk in self.rpc_client.call_stream(rpc.routing_key, rpc.body, rpc.correlation_id, content_type=self.content_type, parent_span=rpc.span):
+            self.print_chunk(rpc, chunk, chunks)
+            chunks += 1
+
+        print(f"\n [{self.id}] Received {chunks} chunks\n")
+        return chunk['status']
+
+    def print_chunk(self, rpc: Rpc, chunk: dict, index: int) -> None:
+        if index == 0:
+            print(f" {chunk['status']}:[{self.id}] Command {rpc.command}:")
+        print(chunk['message'], end="", flush=True)
     
 if __name__ == '__main__':
-    id = sys.argv[1]
-    researcher = Researcher(id)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("id", help="id of the researcher")
+    parser.add_argument("--codec", choices=list(CODEC_NAMES), default="json", help="encoding of the requests sent by the researcher")
+    parser.add_argument("--workers", type=int, default=3, help="commands performed at the same time")
+    parser.add_argument("--prefetch", type=int, default=None, help="commands received and not completed yet (default: 4 per worker)")
+    parser.add_argument("--trace", default=None, help="append the spans of the commands to this file (see trace_report.py)")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of the commands traced")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the metrics on this local port (OpenMetrics text format)")
+    args = parser.parse_args()
+
+    researcher = Researcher(args.id, CODEC_NAMES[args.codec], args.workers, args.prefetch, args.trace, args.trace_sample, args.metrics_port)
     researcher.start()
\ No newline at end of file
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+from pika import ConnectionParameters
+from pika.spec import Basic, BasicProperties, PERSISTENT_DELIVERY_MODE
+from pika.adapters.asyncio_connection import AsyncioConnection
+from threading import Thread
+from researcher import Researcher, ResearcherMetrics, Rpc
+from timer import Timer
+from codec import CODEC_NAMES, JSON_CONTENT_TYPE, codec_for, encode, decode
+from tracing import Tracer, Span
+import transport
+import argparse
+import asyncio
+import time
+import uuid
+
+COMMANDS_EXCHANGE = 'send_researchers_command'
+
+class HostedResearcher(Researcher):
+    """
+        Researcher identity served by a ResearcherHost: it only owns its id and its clock,
+        connections, channels and reply queue belong to the host.
+    """
+
+    host: "ResearcherHost"
+
+    def __init__(self, id: int, host: "ResearcherHost", content_type: str = JSON_CONTENT_TYPE) -> None:
+        self.id = f"Researcher-{id}"
+        self.timer = Timer(self.id)
+        self.host = host
+        self.content_type = content_type
+        self.tracer = host.tracer
+        self.metrics = host.metrics
+
+    async def perform(self, command: dict, props: BasicProperties = None) -> None:
+        """
+            Same steps as Researcher.perform_command, the RPCs are awaited on the event loop of the host
+        """
+        steps = self.command_steps(command, props)
+        result, error = None, None
+        while True:
+            try:
+                rpc = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration:
+                return
+            try:
+                result, error = await self.rpc(rpc), None
+            except Exception as e:
+                result, error = None, e
+
+    async def rpc(self, rpc: Rpc):
+        if rpc.stream:
+            return await self.stream(rpc)
+        return await self.host.call(self, rpc.routing_key, rpc.body, rpc.correlation_id, content_type=self.content_type, parent_span=rpc.span)
+
+    async def stream(self, rpc: Rpc) -> str:
+        chunks = 0
+        async for chunk in self.host.call_stream(self, rpc.routing_key, rpc.body, rpc.correlation_id, content_type=self.content_type, parent_span=rpc.span):
+            self.print_chunk(rpc, chunk, chunks)
+            chunks += 1
+
+        print(f"\n [{self.id}] Received {chunks} chunks\n")
+        return chunk['status']
+
+    def send_completion(self, props: BasicProperties, command: dict, status: str, hops: dict) -> None:
+        self.host.publish(
+            '',
+            props.reply_to,
+            encode({
+                "status": status,
+                "message": command["command"],
+                "timestamp": self.timer.get_time_str(),
+                "hops": hops
+            }, "response", props.content_type),
+            BasicProperties(
+                correlation_id=props.correlation_id,
+                content_type=codec_for(props.content_type).content_type,
+                headers=self.timer.headers()
+            )
+        )
+
+class ResearcherHost(object):
+    """
+        Many researchers served by one asyncio event loop over a single connection and channel.
+
+        One exclusive queue is bound to the commands exchange with the id of every hosted
+        researcher and the routing key of each delivery selects the researcher. Commands run
+        as tasks of the event loop and are acked once completed, at most `prefetch` at a time.
+        RPC replies of every researcher arrive on one reply queue and are matched to the
+        waiting coroutine by correlation id.
+
+        A researcher costs an object and a clock instead of a process, three threads and
+        its connections. With the in-memory transport the deliveries are consumed by a
+        thread and handed over to the event loop.
+    """
+
+    host: str
+    prefetch: int
+    content_type: str
+    # k = routing key, v = HostedResearcher
+    researchers: dict
+    loop: asyncio.AbstractEventLoop
+    connection: AsyncioConnection
+    channel: object
+    reply_queue: str
+    # k = correlation_id, v = (Future, clock of the researcher)
+    pending: dict
+    # k = correlation_id, v = (asyncio.Queue of the chunks, clock of the researcher)
+    streams: dict
+    # commands being performed
+    tasks: set
+    # resolved when every researcher has exited or the connection is lost
+    stopped: asyncio.Future
+    # shared by the researchers, every command starts a trace
+    tracer: Tracer
+    # shared by the researchers, served on metrics_port
+    metrics: ResearcherMetrics
+
+    def __init__(self, ids: list, content_type: str = JSON_CONTENT_TYPE, prefetch: int = 1000, host: str = 'localhost',
+                 trace_file: str = None, trace_sample: float = 1.0, metrics_port: int = None) -> None:
+        self.host = host
+        self.prefetch = prefetch
+        self.content_type = content_type
+        self.tracer = Tracer("researcher", trace_file, trace_sample)
+        self.metrics = ResearcherMetrics(prefetch, lambda: len(self.pending) + len(self.streams))
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
+        self.researchers = {}
+        for id in ids:
+            researcher = HostedResearcher(id, self, content_type)
+            self.researchers[researcher.id] = researcher
+        self.connection = None
+        self.channel = None
+        self.reply_queue = None
+        self.pending = {}
+        self.streams = {}
+        self.tasks = set()
+
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stopped = self.loop.create_future()
+
+        await self.open()
+        await self.wait(self.channel.exchange_declare, exchange=COMMANDS_EXCHANGE, exchange_type='direct')
+
+        result = await self.wait(self.channel.queue_declare, queue='', exclusive=True)
+        self.reply_queue = result.method.queue
+        self.channel.basic_consume(queue=self.reply_queue, on_message_callback=self.on_loop(self.on_reply), auto_ack=True)
+
+        result = await self.wait(self.channel.queue_declare, queue='', exclusive=True)
+        command_queue = result.method.queue
+        await asyncio.gather(*(
+            self.wait(self.channel.queue_bind, queue=command_queue, exchange=COMMANDS_EXCHANGE, routing_key=routing_key)
+            for routing_key in self.researchers
+        ))
+        await self.wait(self.channel.basic_qos, prefetch_count=self.prefetch)
+        self.channel.basic_consume(queue=command_queue, on_message_callback=self.on_loop(self.on_command), auto_ack=False)
+
+        print(f" [Host] {len(self.researchers)} researchers waiting commands")
+        try:
+            await self.stopped
+        finally:
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            if self.connection.is_open:
+                self.connection.close()
+
+    async def open(self) -> None:
+        if transport.is_memory():
+            self.connection = transport.connect(self.host)
+            self.channel = self.connection.channel()
+            Thread(target=self.connection.run, name="researcher-host", daemon=True).start()
+            return
+
+        opened = self.loop.create_future()
+        self.connection = AsyncioConnection(
+            ConnectionParameters(host=self.host),
+            on_open_callback=lambda connection: opened.set_result(connection),
+            on_open_error_callback=lambda connection, error: opened.set_exception(error),
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=self.loop
+        )
+        await opened
+
+        channel_opened = self.loop.create_future()
+        self.connection.channel(on_open_callback=channel_opened.set_result)
+        self.channel = await channel_opened
+
+    def on_connection_closed(self, connection: AsyncioConnection, reason: Exception) -> None:
+        if not self.stopped.done():
+            self.stopped.set_exception(ConnectionError(f"connection closed: {reason}"))
+
+    async def wait(self, method, **kwargs):
+        """
+            Call a synchronous AMQP method and wait for the broker to answer it
+        """
+        if transport.is_memory():
+            return method(**kwargs)
+        answered = self.loop.create_future()
+        method(callback=answered.set_result, **kwargs)
+        return await answered
+
+    def on_loop(self, callback):
+        """
+            Consumer callback running `callback` on the event loop
+        """
+        if not transport.is_memory():
+            return callback
+        return lambda *args: self.loop.call_soon_threadsafe(callback, *args)
+
+    def on_command(self, ch, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        self.metrics.consumed.inc()
+        researcher: HostedResearcher = self.researchers.get(method.routing_key)
+        command = decode(body, props.content_type)
+
+        if researcher is None:
+            print(f" [Host] {method.routing_key} has exited, command {command['command']} dropped")
+            self.ack(method.delivery_tag)
+            return
+
+        if command['command'] == "exit":
+            print(f" [{researcher.id}] exit")
+            del self.researchers[researcher.id]
+            self.ack(method.delivery_tag)
+            if not self.researchers and not self.stopped.done():
+                self.stopped.set_result(None)
+            return
+
+        task = self.loop.create_task(self.perform(researcher, command, props, method.delivery_tag))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def perform(self, researcher: HostedResearcher, command: dict, props: BasicProperties, delivery_tag: int) -> None:
+        try:
+            await researcher.perform(command, props)
+        except Exception as e:
+            # a sender waiting for completion gets the FAILED status, the command is not redelivered
+            print(f" [{researcher.id}] Command {command['command']} failed: {e!r}")
+        finally:
+            if self.channel.is_open:
+                self.ack(delivery_tag)
+
+    def ack(self, delivery_tag: int) -> None:
+        self.channel.basic_ack(delivery_tag=delivery_tag)
+        self.metrics.acked.inc()
+
+    def on_reply(self, ch, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        headers = props.headers or {}
+        reply = decode(body, props.content_type)
+
+        chunks, clock = self.streams.get(props.correlation_id, (None, None))
+        if chunks is not None:
+            clock.sync(headers, reply.get("timestamp"))
+            chunks.put_nowait((reply, headers.get("last", True)))
+            return
+
+        # late replies of requests that have been abandoned are dropped
+        future, clock = self.pending.pop(props.correlation_id, (None, None))
+        if future is not None and not future.done():
+            clock.sync(headers, reply.get("timestamp"))
+            future.set_result(reply)
+
+    def publish(self, exchange: str, routing_key: str, body: bytes, properties: BasicProperties) -> None:
+        self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+    def request_properties(self, researcher: HostedResearcher, correlation_id: str, content_type: str, span: Span = None) -> BasicProperties:
+        headers = researcher.timer.headers()
+        if span is not None:
+            span.annotate("publish")
+            headers = span.headers(headers)
+        return BasicProperties(
+            reply_to=self.reply_queue,
+            correlation_id=correlation_id,
+            content_type=content_type,
+            delivery_mode=PERSISTENT_DELIVERY_MODE,
+            headers=headers
+        )
+
+    async def call(self, researcher: HostedResearcher, routing_key: str, body: bytes, correlation_id: str = None, exchange: str = '',
+                   content_type: str = JSON_CONTENT_TYPE, parent_span: Span = None) -> dict:
+        """
+            Send a request on behalf of a researcher and wait for the decoded reply,
+            traced by a client span child of parent_span
+        """
+        if correlation_id is None:
+            correlation_id = str(uuid.uuid4())
+
+        span = None if parent_span is None else parent_span.child(routing_key, "CLIENT")
+        future = self.loop.create_future()
+        self.pending[correlation_id] = (future, researcher.timer)
+        start = time.perf_counter()
+        try:
+            self.publish(exchange, routing_key, body, self.request_properties(researcher, correlation_id, content_type, span))
+            reply = await future
+            self.metrics.round_trips.observe(time.perf_counter() - start, queue=routing_key)
+            if span is not None:
+                span.annotate("reply")
+            return reply
+        except Exception as e:
+            if span is not None:
+                span.tag("error", e)
+            raise
+        finally:
+            self.pending.pop(correlation_id, None)
+            if span is not None:
+                span.finish()
+
+    async def call_stream(self, researcher: HostedResearcher, routing_key: str, body: bytes, correlation_id: str = None, exchange: str = '',
+                          content_type: str = JSON_CONTENT_TYPE, parent_span: Span = None):
+        """
+            Send a request answered with a stream and yield every chunk as soon as it is received
+        """
+        if correlation_id is None:
+            correlation_id = str(uuid.uuid4())
+
+        span = None if parent_span is None else parent_span.child(routing_key, "CLIENT")
+        chunks = asyncio.Queue()
+        self.streams[correlation_id] = (chunks, researcher.timer)
+        start = time.perf_counter()
+        try:
+            self.publish(exchange, routing_key, body, self.request_properties(researcher, correlation_id, content_type, span))
+            received = 0
+            while True:
+                chunk, last = await chunks.get()
+                if span is not None and received == 0:
+                    span.annotate("first chunk")
+                received += 1
+                if last:
+                    # received, before the caller consumes the last chunk
+                    self.metrics.round_trips.observe(time.perf_counter() - start, queue=routing_key)
+                    if span is not None:
+                        span.annotate("reply").tag("chunks", received)
+                yield chunk
+                if last:
+                    return
+        finally:
+            self.streams.pop(correlation_id, None)
+            if span is not None:
+                span.finish()
+
+def parse_ids(ids: str) -> list:
+    """
+        Researcher ids from a list of ids and ranges, e.g. "1-5000" or "1,4,10-20"
+    """
+    parsed = []
+    for part in ids.split(","):
+        first, _, last = part.strip().partition("-")
+        parsed.extend(range(int(first), int(last or first) + 1))
+    return parsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", required=True, help="ids of the hosted researchers, e.g. 1-5000 or 1,4,10-20")
+    parser.add_argument("--codec", choices=list(CODEC_NAMES), default="json", help="encoding of the requests sent by the researchers")
+    parser.add_argument("--prefetch", type=int, default=1000, help="commands received and not completed yet, for all the researchers")
+    parser.add_argument("--trace", default=None, help="append the spans of the commands to this file (see trace_report.py)")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of the commands traced")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the metrics on this local port (OpenMetrics text format)")
+    args = parser.parse_args()
+
+    host = ResearcherHost(parse_ids(args.ids), CODEC_NAMES[args.codec], args.prefetch, trace_file=args.trace, trace_sample=args.trace_sample, metrics_port=args.metrics_port)
+    asyncio.run(host.run())
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+from pika import BlockingConnection
+from pika.spec import Basic, BasicProperties, PERSISTENT_DELIVERY_MODE
+from pika.adapters.blocking_connection import BlockingChannel
+from concurrent.futures import Future, TimeoutError
+from threading import Event, Lock, Thread
+from queue import Queue
+from connection_pool import pool, ConnectionPool
+from codec import JSON_CONTENT_TYPE, decode
+from timer import Timer
+from tracing import Span
+from metrics import Histogram
+from transport import connect
+import asyncio
+import time
+import uuid
+
+class RpcClient(object):
+    """
+        RPC client that owns one long-lived exclusive reply queue per process.
+
+        Every request is published through the connection pool with reply_to set to
+        the shared reply queue, and the pending future is looked up by correlation id
+        when the reply arrives. Replies are decoded with the codec of their content type. Any number of requests can be in flight at the same time.
+
+        With a clock, every request carries the clock in its headers and the clock is adjusted
+        to every reply received.
+
+        A streamed reply is a sequence of messages with the same correlation id, numbered by
+        the "chunk" header and terminated by the "last" one; call_stream yields them as they arrive.
+
+        With a parent span, every request is traced by a client span child of it, from the
+        publish to the reply.
+
+        With a round_trips histogram, the time from the publish to the reply (the last chunk
+        of a stream) of every answered request is observed, labelled with its queue.
+
+        The reply queue is declared again when its connection is lost, after a delay that doubles
+        with every failed attempt. Requests wait at most ready_timeout seconds for the reply queue.
+    """
+
+    # seconds before declaring the reply queue again, doubled after every failure up to the maximum
+    RECONNECT_DELAY: float = 0.5
+    MAX_RECONNECT_DELAY: float = 30.0
+
+    host: str
+    name: str
+    publisher: ConnectionPool
+    clock: Timer
+    reply_queue: str
+    # k = correlation_id, v = Future
+    pending: dict
+    # k = correlation_id, v = Queue of the chunks received
+    streams: dict
+    lock: Lock
+    ready: Event
+    consumer: Thread
+    connection: BlockingConnection
+    round_trips: Histogram
+    ready_timeout: float
+
+    def __init__(self, name: str = "rpc", host: str = 'localhost', publisher: ConnectionPool = pool, clock: Timer = None,
+                 round_trips: Histogram = None, ready_timeout: float = 30.0) -> None:
+        self.name = name
+        self.host = host
+        self.publisher = publisher
+        self.clock = clock
+        self.round_trips = round_trips
+        self.ready_timeout = ready_timeout
+        self.reply_queue = None
+        self.pending = {}
+        self.streams = {}
+        self.lock = Lock()
+        self.ready = Event()
+        self.consumer = None
+        self.connection = None
+
+    def start(self) -> None:
+        with self.lock:
+            if self.consumer is not None:
+                return
+            self.consumer = Thread(target=self._consume, name=f"{self.name}-replies", daemon=True)
+            self.consumer.start()
+        self._wait_ready()
+
+    def _wait_ready(self) -> None:
+        if not self.ready.wait(self.ready_timeout):
+            raise ConnectionError(f"reply queue of {self.name} not ready after {self.ready_timeout}s")
+
+    def _consume(self) -> None:
+        delay = self.RECONNECT_DELAY
+        while True:
+            try:
+                self.connection = connect(self.host)
+                channel = self.connection.channel()
+
+                #Create the anonymous exclusive callback queue shared by every request
+                result = channel.queue_declare(queue='', exclusive=True)
+                self.reply_queue = result.method.queue
+
+                channel.basic_consume(
+                    queue=self.reply_queue,
+                    on_message_callback=self.on_response,
+                    auto_ack=True
+                )
+                self.ready.set()
+                delay = self.RECONNECT_DELAY
+
+                channel.start_consuming()
+            except Exception as e:
+                print(f" [{self.name}] Reply queue lost: {e}")
+
+            # the exclusive queue is gone with the connection, replies of pending requests cannot arrive anymore
+            self.ready.clear()
+            self._fail_pending(ConnectionError("reply queue has been closed"))
+
+            print(f" [{self.name}] Declaring the reply queue again in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            streams = self.streams
+            self.streams = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+        for chunks in streams.values():
+            chunks.put((error, True))
+
+    def on_response(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        headers = props.headers or {}
+        reply = decode(body, props.content_type)
+        if self.clock is not None:
+            self.clock.sync(headers, reply.get("timestamp"))
+
+        with self.lock:
+            chunks: Queue = self.streams.get(props.correlation_id)
+            if chunks is not None:
+                # a reply without chunk headers (e.g. an error) is a stream of one message
+                last = headers.get("last", True)
+                if last:
+                    del self.streams[props.correlation_id]
+                chunks.put((reply, last))
+                return
+            future: Future = self.pending.pop(props.correlation_id, None)
+
+        # late replies of requests that have been abandoned are dropped
+        if future is not None and not future.done():
+            future.set_result(reply)
+
+    def call_async(self, routing_key: str, body: bytes, correlation_id: str = None, exchange: str = '', content_type: str = JSON_CONTENT_TYPE, parent_span: Span = None) -> Future:
+        """
+            Send a request and return a future that is resolved with the decoded reply.
+        """
+        self.start()
+        self._wait_ready()
+
+        if correlation_id is None:
+            correlation_id = str(uuid.uuid4())
+
+        future = Future()
+        with self.lock:
+            self.pending[correlation_id] = future
+
+        span = None
+        if parent_span is not None:
+            span = parent_span.child(routing_key, "CLIENT")
+            future.add_done_callback(lambda future: self._finish_span(span, future))
+        if self.round_trips is not None:
+            start = time.perf_counter()
+            future.add_done_callback(lambda future: self._observe(routing_key, start, future))
+
+        try:
+            self._publish(routing_key, body, correlation_id, exchange, content_type, span)
+        except Exception:
+            self.cancel(correlation_id)
+            raise
+
+        return future
+
+    def _finish_span(self, span: Span, future: Future) -> None:
+        if future.cancelled():
+            span.tag("error", "cancelled")
+        elif future.exception() is not None:
+            span.tag("error", future.exception())
+        else:
+            span.annotate("reply")
+        span.finish()
+
+    def _observe(self, routing_key: str, start: float, future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            self.round_trips.observe(time.perf_counter() - start, queue=routing_key)
+
+    def _publish(self, routing_key: str, body: bytes, correlation_id: str, exchange: str, content_type: str, span: Span = None) -> None:
+        headers = None if self.clock is None else self.clock.headers()
+        if span is not None:
+            span.annotate("publish")
+            headers = span.headers(headers) or None
+        self.publisher.publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            properties=BasicProperties(
+                reply_to=self.reply_queue,          # Shared exclusive callback queue
+                correlation_id=correlation_id,      # Request ID
+                content_type=content_type,
+                delivery_mode = PERSISTENT_DELIVERY_MODE,
+                headers=headers
+            ),
+            body=body
+        )
+
+    def call_stream(self, routing_key: str, body: bytes, correlation_id: str = None, exchange: str = '', timeout: float = None, content_type: str = JSON_CONTENT_TYPE, parent_span: Span = None):
+        """
+            Send a request answered with a stream and yield every chunk of the reply as soon as
+            it is received. timeout is the maximum wait for the next chunk.
+        """
+        self.start()
+        self._wait_ready()
+
+        if correlation_id is None:
+            correlation_id = str(uuid.uuid4())
+
+        chunks = Queue()
+        with self.lock:
+            self.streams[correlation_id] = chunks
+
+        span = None if parent_span is None else parent_span.child(routing_key, "CLIENT")
+        start = time.perf_counter()
+        try:
+            self._publish(routing_key, body, correlation_id, exchange, content_type, span)
+
+            received = 0
+            while True:
+                chunk, last = chunks.get(timeout=timeout)
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if span is not None and received == 0:
+                    span.annotate("first chunk")
+                received += 1
+                if last:
+                    # received, before the caller consumes the last chunk
+                    if span is not None:
+                        span.annotate("reply").tag("chunks", received)
+                    if self.round_trips is not None:
+                        self.round_trips.observe(time.perf_counter() - start, queue=routing_key)
+                yield chunk
+                if last:
+                    return
+        finally:
+            # the caller may stop reading before the end, the remaining chunks are dropped
+            with self.lock:
+                self.streams.pop(correlation_id, None)
+            if span is not None:
+                span.finish()
+
+    def call(self, routing_key: str, body: bytes, correlation_id: str = None, exchange: str = '', timeout: float = None, content_type: str = JSON_CONTENT_TYPE, parent_span: Span = None) -> dict:
+        """
+            Send a request and block until the reply is received.
+            A request that times out is cancelled, its late reply is dropped.
+        """
+        if correlation_id is None:
+            correlation_id = str(uuid.uuid4())
+
+        future = self.call_async(routing_key, body, correlation_id, exchange, content_type, parent_span)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            self.cancel(correlation_id)
+            raise
+
+    async def acall(self, routing_key: str, body: bytes, correlation_id: str = None, exchange: str = '', content_type: str = JSON_CONTENT_TYPE, parent_span: Span = None) -> dict:
+        """
+            Awaitable version of call()
+        """
+        return await asyncio.wrap_future(self.call_async(routing_key, body, correlation_id, exchange, content_type, parent_span))
+
+    def cancel(self, correlation_id: str) -> None:
+        with self.lock:
+            future: Future = self.pending.pop(correlation_id, None)
+        if future is not None:
+            future.cancel()
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.pending) + len(self.streams)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+from threading import Thread
+from university import University, argument_parser
+from funding_agency import FundingAgency
+from researcher import Researcher
+from researcher_host import ResearcherHost
+from codec import CODEC_NAMES, JSON_CONTENT_TYPE
+from actions import WRITE_QUEUE, READ_QUEUE
+from connection_pool import pool
+import main
+import argparse
+import asyncio
+import os
+import shlex
+import sys
+import tempfile
+import time
+import transport
+
+class LocalDeployment(object):
+    """
+        University, funding agency and researchers running as threads of this process and
+        talking through the in-memory broker: no RabbitMQ is needed and the broker adds no
+        latency, so profiles and benchmarks only measure the application code.
+
+        The databases are stored in `workdir`, which becomes the working directory of the process.
+        With `hosted` the researchers share the event loop of a ResearcherHost instead of running a thread each.
+    """
+
+    workdir: str
+    researchers: int
+    university_args: argparse.Namespace
+    funds: int
+    content_type: str
+    hosted: bool
+    # proposals evaluated at the same time by the funding agency
+    pipeline: int
+    # file of the spans of every component, None to disable tracing
+    trace_file: str
+    # fraction of the commands traced, the traces are started by the researchers
+    trace_sample: float
+    # metrics of the university on this port, then the funding agency and the researchers
+    # (or the researcher host) on the next ones, None to disable
+    metrics_port: int
+
+    def __init__(self, workdir: str, researchers: int, university_args: argparse.Namespace, funds: int = 1000000, content_type: str = JSON_CONTENT_TYPE,
+                 hosted: bool = False, pipeline: int = 1, trace_file: str = None, trace_sample: float = 1.0, metrics_port: int = None) -> None:
+        self.workdir = workdir
+        self.researchers = researchers
+        self.university_args = university_args
+        self.funds = funds
+        self.content_type = content_type
+        self.hosted = hosted
+        self.pipeline = pipeline
+        self.trace_file = None if trace_file is None else os.path.abspath(trace_file)
+        self.trace_sample = trace_sample
+        self.metrics_port = metrics_port
+
+    def port(self, offset: int) -> int:
+        return None if self.metrics_port is None else self.metrics_port + offset
+
+    def start(self, timeout: float = 10) -> None:
+        transport.configure("memory")
+        os.chdir(self.workdir)
+
+        university_args = vars(self.university_args)
+        if self.trace_file is not None and university_args.get("trace_file") is None:
+            university_args = {**university_args, "trace_file": self.trace_file}
+        if self.metrics_port is not None and university_args.get("metrics_port") is None:
+            university_args = {**university_args, "metrics_port": self.port(0)}
+        Thread(target=University, kwargs=university_args, name="university", daemon=True).start()
+        Thread(target=FundingAgency, kwargs={
+            "content_type": self.content_type, "funds": self.funds, "pipeline": self.pipeline, "trace_file": self.trace_file, "metrics_port": self.port(1)
+        }, name="funding-agency", daemon=True).start()
+        if self.hosted:
+            host = ResearcherHost(range(1, self.researchers + 1), self.content_type, trace_file=self.trace_file, trace_sample=self.trace_sample, metrics_port=self.port(2))
+            Thread(target=asyncio.run, args=(host.run(),), name="researcher-host", daemon=True).start()
+        else:
+            for i in range(1, self.researchers + 1):
+                researcher = Researcher(i, self.content_type, trace_file=self.trace_file, trace_sample=self.trace_sample, metrics_port=self.port(1 + i))
+                Thread(target=researcher.start, name=f"researcher-{i}", daemon=True).start()
+
+        # wait until every component consumes its queue
+        routes = [('', WRITE_QUEUE), ('', READ_QUEUE), ('', 'submit_research_proposal')]
+        routes += [('send_researchers_command', f"Researcher-{i}") for i in range(1, self.researchers + 1)]
+        deadline = time.monotonic() + timeout
+        while not all(transport.broker.is_consumed(exchange, routing_key) for exchange, routing_key in routes):
+            if time.monotonic() > deadline:
+                raise TimeoutError("the components did not start")
+            time.sleep(0.05)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--researchers", type=int, default=5, help="researchers started in the process")
+    parser.add_argument("--workdir", default=None, help="directory of the databases (default: a new temporary directory)")
+    parser.add_argument("--university-args", default="", help="arguments of university.py, e.g. '--workers 8'")
+    parser.add_argument("--funds", type=int, default=1000000, help="funds of the funding agency")
+    parser.add_argument("--codec", choices=list(CODEC_NAMES), default="json", help="encoding of the messages")
+    parser.add_argument("--pipeline", type=int, default=1, help="proposals evaluated at the same time by the funding agency")
+    parser.add_argument("--hosted", action="store_true", help="run the researchers on one event loop (researcher_host.py)")
+    parser.add_argument("--trace", default=None, help="append the spans of every component to this file (see trace_report.py)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="metrics of the university on this port, funding agency and researchers on the next ones")
+    parser.add_argument("--batch", default=None, help="send the command lines of this file ('-' for stdin) and exit")
+    args = parser.parse_args()
+    content_type = CODEC_NAMES[args.codec]
+    if args.batch is not None and args.batch != '-':
+        # the deployment changes the working directory
+        args.batch = os.path.abspath(args.batch)
+
+    deployment = LocalDeployment(
+        args.workdir or tempfile.mkdtemp(prefix="university-"),
+        args.researchers,
+        argument_parser().parse_args(shlex.split(args.university_args)),
+        args.funds,
+        content_type,
+        args.hosted,
+        args.pipeline,
+        args.trace,
+        metrics_port=args.metrics_port
+    )
+    deployment.start()
+    print(f" [Main] {args.researchers} researchers running in {deployment.workdir}")
+
+    pool.declare_exchange('send_researchers_command', 'direct')
+    if args.batch is not None:
+        if args.batch == '-':
+            main.send_batch(sys.stdin, content_type)
+        else:
+            with open(args.batch) as f:
+                main.send_batch(f, content_type)
+        # let the researchers complete the commands
+        time.sleep(1)
+        # the components run on executor threads that never return
+        sys.stdout.flush()
+        os._exit(0)
+
+    while True:
+        for request in main.get_commands():
+            main.send_command(request['routing_key'], request, content_type)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+from consistent_hash import HashRing
+from storage import PickleStorage, WriteAheadLogStorage
+from university_database import UniversityDatabase
+import argparse
+import pickle
+
+# exchange used by the router to forward requests to the shard queues
+SHARDS_EXCHANGE: str = "university_shards"
+# fanout exchange where shards publish the changes of the researcher->account mapping
+DIRECTORY_EXCHANGE: str = "university_directory"
+# durable queue of the router bound to DIRECTORY_EXCHANGE, keeps the changes published while the router is down
+DIRECTORY_QUEUE: str = "university_directory_updates"
+# researcher->account mapping kept by the router
+DIRECTORY_FILE: str = "university_directory.pickle"
+
+def shard_name(index: int) -> str:
+    return f"shard-{index}"
+
+def shard_queue(index: int) -> str:
+    return f"university_requests_queue.{shard_name(index)}"
+
+def declare_directory(channel) -> None:
+    """
+        Declared by the shards and the router, whichever starts first
+    """
+    channel.exchange_declare(exchange=DIRECTORY_EXCHANGE, exchange_type='fanout')
+    channel.queue_declare(queue=DIRECTORY_QUEUE, durable=True)
+    channel.queue_bind(exchange=DIRECTORY_EXCHANGE, queue=DIRECTORY_QUEUE)
+
+def shard_ring(shards: int) -> HashRing:
+    return HashRing([shard_name(index) for index in range(shards)])
+
+def shard_storage(index: int, storage: str) -> PickleStorage:
+    if storage == "wal":
+        return WriteAheadLogStorage(f"university-{shard_name(index)}", UniversityDatabase)
+    return PickleStorage(f"university-{shard_name(index)}.pickle", UniversityDatabase)
+
+def rebalance(old_shards: int, new_shards: int, storage: str = "pickle") -> None:
+    """
+        Move the accounts whose owner changes when the number of shards goes from
+        old_shards to new_shards, and rebuild the directory of the router.
+        Shard workers and router must be stopped.
+    """
+    ring = shard_ring(new_shards)
+    storages = [shard_storage(index, storage) for index in range(max(old_shards, new_shards))]
+    databases = [s.load() for s in storages]
+
+    moved = 0
+    for index in range(old_shards):
+        database: UniversityDatabase = databases[index]
+        for project_id in list(database.accounts.keys()):
+            owner = int(ring.get_node(project_id).split("-")[1])
+            if owner != index:
+                databases[owner].import_account(database.export_account(project_id))
+                moved += 1
+
+    for s in storages:
+        s.commit()
+        s.close()
+
+    rebuild_directory(databases[:new_shards])
+    print(f" [Shards] {moved} accounts moved from {old_shards} to {new_shards} shards")
+
+def rebuild_directory(databases: list) -> None:
+    directory = {}
+    for database in databases:
+        for researcher, project_id in database.researchers.items():
+            if project_id is not None:
+                directory[researcher] = project_id
+
+    with open(DIRECTORY_FILE, 'wb') as f:
+        pickle.dump(directory, f)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebalance the university shards")
+    parser.add_argument("--from-shards", type=int, required=True, help="current number of shards")
+    parser.add_argument("--to-shards", type=int, required=True, help="new number of shards")
+    parser.add_argument("--storage", choices=["pickle", "wal"], default="pickle", help="persistence mode of the shards")
+    args = parser.parse_args()
+
+    rebalance(args.from_shards, args.to_shards, args.storage)
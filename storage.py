@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+from threading import Event, Lock, Thread, local
+from contextlib import nullcontext
+import glob
+import os
+import pickle
+import struct
+
+class PickleStorage(object):
+    """
+        Stores the whole database in a single pickle file, rewritten on every commit.
+    """
+
+    data_file: str
+    database: object
+    # bytes written by the commits
+    bytes_written: int
+
+    def __init__(self, data_file: str, factory: type) -> None:
+        self.data_file = data_file
+        self.factory = factory
+        self.database = None
+        self.bytes_written = 0
+
+    def load(self) -> object:
+        try:
+            #read data from file
+            with open(self.data_file, 'rb') as f:
+                self.database = pickle.load(f)
+        except FileNotFoundError:
+            # initialize database
+            self.database = self.factory()
+
+        return self.database
+
+    def commit(self) -> None:
+        # the database may be used by other threads, block them while it is pickled
+        with getattr(self.database, "exclusive", nullcontext)():
+            # save database to file
+            with open(self.data_file, 'wb') as f:
+                pickle.dump(self.database, f)
+                self.bytes_written += f.tell()
+
+    def close(self) -> None:
+        pass
+
+class WriteAheadLogStorage(object):
+    """
+        Stores the database as a snapshot plus an append-only log of mutations.
+
+        The database reports every mutation through its `journal` hook. Records are
+        buffered per thread and written + fsynced once per commit, so a commit costs the size
+        of the change instead of the size of the database, and the records of a request
+        reach the log together even when several threads commit concurrently. The log is split in segments: every
+        `snapshot_interval` records the current segment is closed and a background thread
+        folds the closed segments into a new snapshot, without touching the live database.
+
+        On startup the snapshot is loaded and the remaining segments are replayed. A torn frame
+        at the end of the last segment (a commit interrupted by a crash) is truncated, so the
+        records committed after the restart are never written behind it.
+
+        file layout:
+            <name>.snapshot             pickled (last_lsn, database)
+            <name>.wal.<first_lsn>      frames of 4 bytes length + pickled (lsn, record)
+    """
+
+    HEADER: struct.Struct = struct.Struct(">I")
+
+    name: str
+    snapshot_interval: int
+    database: object
+    # log sequence number of the last record written
+    lsn: int
+    # records appended by each thread but not yet committed
+    pending: local
+    segment: object
+    records_in_segment: int
+    # bytes appended to the log by the commits
+    bytes_written: int
+    lock: Lock
+    compaction_lock: Lock
+    compaction_requested: Event
+    compactor: Thread
+    run: bool
+
+    def __init__(self, name: str, factory: type, snapshot_interval: int = 10000) -> None:
+        self.name = name
+        self.factory = factory
+        self.snapshot_interval = snapshot_interval
+        self.database = None
+        self.lsn = 0
+        self.pending = local()
+        self.segment = None
+        self.records_in_segment = 0
+        self.bytes_written = 0
+        self.lock = Lock()
+        self.compaction_lock = Lock()
+        self.compaction_requested = Event()
+        self.compactor = None
+        self.run = True
+
+    @property
+    def snapshot_file(self) -> str:
+        return f"{self.name}.snapshot"
+
+    def segment_file(self, first_lsn: int) -> str:
+        return f"{self.name}.wal.{first_lsn:012d}"
+
+    def segments(self) -> list:
+        return sorted(glob.glob(f"{glob.escape(self.name)}.wal.*"))
+
+    def load(self) -> object:
+        last_lsn, self.database = self._load_snapshot()
+
+        segments = self.segments()
+        if segments:
+            # the new segment may reuse the name of the last one if its first frame is torn
+            self._truncate_torn_tail(segments[-1])
+
+        # replay the mutations recorded after the snapshot
+        self.lsn = self._replay(self.database, last_lsn, segments)
+        print(f" [S] Restored state up to record {self.lsn}")
+
+        # start a new segment after the last record
+        self._open_segment()
+        self.database.journal = self.append
+
+        self.compactor = Thread(target=self._compact_loop, name=f"{self.name}-compactor", daemon=True)
+        self.compactor.start()
+
+        return self.database
+
+    def _load_snapshot(self) -> tuple:
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return 0, self.factory()
+
+    def _read_frames(self, path: str):
+        """
+            (end offset, frame) of every complete frame of a segment
+        """
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    return
+                (size,) = self.HEADER.unpack(header)
+                frame = f.read(size)
+                if len(frame) < size:
+                    # torn write at the end of the log: the commit never completed
+                    return
+                yield f.tell(), frame
+
+    def _read_segment(self, path: str):
+        for _, frame in self._read_frames(path):
+            yield pickle.loads(frame)
+
+    def _truncate_torn_tail(self, path: str) -> None:
+        valid = 0
+        for valid, _ in self._read_frames(path):
+            pass
+        if os.path.getsize(path) > valid:
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+                f.flush()
+                os.fsync(f.fileno())
+            print(f" [S] Truncated the torn tail of {path}")
+
+    def _replay(self, database: object, last_lsn: int, segments: list) -> int:
+        for path in segments:
+            for lsn, record in self._read_segment(path):
+                if lsn > last_lsn:
+                    database.apply(record)
+                    last_lsn = lsn
+        return last_lsn
+
+    def _open_segment(self) -> None:
+        self.segment = open(self.segment_file(self.lsn + 1), 'ab')
+        self.records_in_segment = 0
+
+    def append(self, record: tuple) -> None:
+        if not hasattr(self.pending, "records"):
+            self.pending.records = []
+        self.pending.records.append(record)
+
+    def commit(self) -> None:
+        """
+            Make every record appended so far by the calling thread durable
+        """
+        records = getattr(self.pending, "records", None)
+        if not records:
+            return
+        self.pending.records = []
+
+        with self.lock:
+            frames = []
+            for record in records:
+                self.lsn += 1
+                frame = pickle.dumps((self.lsn, record), protocol=pickle.HIGHEST_PROTOCOL)
+                frames.append(self.HEADER.pack(len(frame)))
+                frames.append(frame)
+
+            data = b"".join(frames)
+            self.segment.write(data)
+            self.bytes_written += len(data)
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.records_in_segment += len(records)
+
+            if self.records_in_segment >= self.snapshot_interval:
+                # close the segment, it is folded into the snapshot in background
+                self.segment.close()
+                self._open_segment()
+                self.compaction_requested.set()
+
+    def _compact_loop(self) -> None:
+        while self.run:
+            self.compaction_requested.wait()
+            self.compaction_requested.clear()
+            if self.run:
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f" [S] Snapshot failed: {e}")
+
+    def compact(self) -> None:
+        """
+            Fold the closed log segments into a new snapshot and delete them
+        """
+        with self.compaction_lock:
+            with self.lock:
+                current = self.segment.name
+            closed = [path for path in self.segments() if path < current]
+            if not closed:
+                return
+
+            last_lsn, database = self._load_snapshot()
+            last_lsn = self._replay(database, last_lsn, closed)
+
+            tmp_file = f"{self.snapshot_file}.tmp"
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((last_lsn, database), f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+
+            for path in closed:
+                os.remove(path)
+
+            print(f" [S] Snapshot taken at record {last_lsn}")
+
+    def close(self) -> None:
+        self.commit()
+        self.run = False
+        self.compaction_requested.set()
+        with self.lock:
+            self.segment.close()
@@ -0,0 +1,84 @@
+import unittest
+from datetime import date
+from account_index import AccountIndex
+from timer import Timer
+from university_database import ResearchAccount, UniversityDatabase
+
+DAY = date(2026, 1, 1).toordinal()
+
+def account(project_id: str, lead: str, end_day: int) -> ResearchAccount:
+    return ResearchAccount("title", "description", project_id, 1000, lead, date.fromordinal(end_day))
+
+class AccountIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.accounts = {
+            "p1": account("p1", "Lead-1", DAY + 10),
+            "p2": account("p2", "Lead-2", DAY),
+            "p3": account("p3", "Lead-1", DAY + 5),
+        }
+        self.index = AccountIndex()
+        for research_account in self.accounts.values():
+            self.index.add(research_account)
+
+    def test_end_date_ranges(self) -> None:
+        self.assertEqual(self.index.ending_between(DAY, DAY + 5), ["p2", "p3"])
+        self.assertEqual(self.index.ending_between(DAY + 6, DAY + 9), [])
+        self.assertEqual(self.index.active_on(DAY + 1), ["p3", "p1"])
+
+    def test_accounts_by_lead_researcher(self) -> None:
+        self.assertEqual(self.index.led_by("Lead-1"), ["p3", "p1"])
+        self.assertEqual(self.index.led_by("Lead-3"), [])
+        self.assertEqual(self.index.led_by("Lead-1", DAY + 6, DAY + 10), ["p1"])
+        self.assertEqual(self.index.led_by("Lead-1", last_day=DAY + 5), ["p3"])
+
+    def test_due_pops_each_ended_account_once(self) -> None:
+        self.assertEqual(self.index.due(DAY + 6), ["p2", "p3"])
+        self.assertEqual(self.index.due(DAY + 6), [])
+        self.assertEqual(self.index.due(DAY + 11), ["p1"])
+
+    def test_removed_accounts_are_not_found_or_due(self) -> None:
+        self.index.remove(self.accounts["p3"])
+
+        self.assertEqual(self.index.ending_between(DAY, DAY + 10), ["p2", "p1"])
+        self.assertEqual(self.index.led_by("Lead-1"), ["p1"])
+        self.assertEqual(self.index.due(DAY + 6), ["p2"])
+        self.assertEqual(len(self.index), 2)
+
+    def test_rebuilt_from_the_accounts(self) -> None:
+        self.accounts["p2"].expired = True
+        index = AccountIndex.from_accounts(self.accounts)
+
+        self.assertEqual(index.ending_between(DAY, DAY + 10), ["p2", "p3", "p1"])
+        # an account already expired is not swept again
+        self.assertEqual(index.due(DAY + 11), ["p3", "p1"])
+
+class ListAccountsTest(unittest.TestCase):
+
+    def test_accounts_of_a_lead_in_a_range_of_end_dates(self) -> None:
+        timer = Timer("test", day_length=3600)
+        today = timer.get_ordinal()
+        database = UniversityDatabase()
+        for project_id, end_day in (("p1", today + 10), ("p2", today + 40), ("p3", today + 20)):
+            database.apply(("create_account", "title", "description", project_id, 1000, f"Lead-{project_id}", date.fromordinal(end_day)))
+        database.apply(("create_account", "title", "description", "p4", 1000, "Lead-p1", date.fromordinal(today + 30)))
+
+        response = database.list_accounts("Lead-p1", timer, expiring_to=date.fromordinal(today + 30), lead="Lead-p1")
+
+        self.assertIn("2 accounts", response.message)
+        self.assertLess(response.message.index("p1 "), response.message.index("p4 "))
+        self.assertNotIn("p3 ", response.message)
+
+class ExpireAccountsTest(unittest.TestCase):
+
+    def test_sweeper_expires_the_ended_accounts(self) -> None:
+        journal = []
+        database = UniversityDatabase()
+        database.journal = journal.append
+        database.apply(("create_account", "title", "description", "p1", 1000, "Lead-1", date.fromordinal(DAY)))
+        database.apply(("create_account", "title", "description", "p2", 1000, "Lead-2", date.fromordinal(DAY + 10)))
+
+        self.assertEqual(database.expire_accounts(DAY + 1), ["p1"])
+        self.assertTrue(database.accounts["p1"].expired)
+        self.assertFalse(database.accounts["p2"].expired)
+        self.assertEqual(journal, [("expire_account", "p1")])
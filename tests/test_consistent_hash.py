@@ -0,0 +1,35 @@
+import unittest
+from consistent_hash import HashRing
+
+KEYS = [f"project-{index}" for index in range(2000)]
+
+class HashRingTest(unittest.TestCase):
+
+    def test_keys_are_spread_over_the_nodes(self) -> None:
+        ring = HashRing(["shard-0", "shard-1", "shard-2"])
+        owners = [ring.get_node(key) for key in KEYS]
+
+        for node in ring.nodes:
+            self.assertGreater(owners.count(node), len(KEYS) / 6)
+
+    def test_adding_a_node_only_moves_keys_to_it(self) -> None:
+        ring = HashRing(["shard-0", "shard-1", "shard-2"])
+        before = {key: ring.get_node(key) for key in KEYS}
+        ring.add_node("shard-3")
+
+        moved = [key for key in KEYS if ring.get_node(key) != before[key]]
+        self.assertTrue(all(ring.get_node(key) == "shard-3" for key in moved))
+        self.assertLess(len(moved), len(KEYS) / 2)
+
+    def test_removing_a_node_restores_the_previous_owners(self) -> None:
+        ring = HashRing(["shard-0", "shard-1"])
+        before = {key: ring.get_node(key) for key in KEYS}
+        ring.add_node("shard-2")
+        ring.remove_node("shard-2")
+
+        self.assertEqual({key: ring.get_node(key) for key in KEYS}, before)
+        self.assertEqual(len(ring.positions), 2 * ring.replicas)
+
+    def test_empty_ring_has_no_owner(self) -> None:
+        with self.assertRaises(LookupError):
+            HashRing().get_node("project-1")
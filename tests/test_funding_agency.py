@@ -0,0 +1,96 @@
+import unittest
+from datetime import date
+from unittest import mock
+from pika.spec import BasicProperties
+from actions import Actions
+from codec import JSON_CONTENT_TYPE
+from funding_agency import FundingAgency, ProposalEvaluation
+from funding_agency_database import FundingAgencyDatabase
+from request_status import RequestStatus
+from research_proposal_request import ResearchProposalRequest
+from tracing import Tracer
+
+def funding_agency(funds: int = 1000000) -> FundingAgency:
+    """
+        Funding agency that is not connected: the channel and the rpc client are mocks
+    """
+    agency = FundingAgency.__new__(FundingAgency)
+    agency.content_type = JSON_CONTENT_TYPE
+    agency.pipeline = 1
+    agency.evaluations = {}
+    agency.in_progress = set()
+    agency.deferred = []
+    agency.tracer = Tracer("funding agency")
+    agency.database = FundingAgencyDatabase(funds=funds)
+    agency.setup_metrics()
+    agency.channel = mock.Mock()
+    agency.connection = mock.Mock()
+    agency.rpc_client = mock.Mock()
+    return agency
+
+def proposal(correlation_id: str = "c1", amount: int = 300000) -> ProposalEvaluation:
+    request = ResearchProposalRequest("p1", "title", "description", amount, date.today(), "Researcher-1")
+    props = BasicProperties(reply_to="replies", correlation_id=correlation_id, content_type=JSON_CONTENT_TYPE)
+    return ProposalEvaluation(1, props, request, Tracer("funding agency").start_span("submit_research_proposal"))
+
+class FundingAgencyTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.agency = funding_agency()
+        self.responses = []
+        self.agency.send_response = lambda evaluation: self.responses.append(evaluation.history_record["status"])
+
+    def test_proposal_is_rejected_when_the_university_check_fails(self) -> None:
+        evaluation = proposal()
+        with mock.patch.object(self.agency, "notify_university") as notify_university:
+            self.agency.evaluate(evaluation)
+            self.assertEqual(self.agency.database.reserved, 300000)
+
+            self.agency.on_proposal_checked(evaluation, {"status": RequestStatus.FAILED.value, "message": "handler error"})
+
+        # the proposal is only checked, no account is created
+        self.assertEqual([call.args[0] for call in notify_university.call_args_list], [Actions.NOTIFY_RESEARCHER_PROPOSAL])
+        self.assertEqual(self.responses, [RequestStatus.REJECTED.value])
+        self.assertEqual((self.agency.database.reserved, self.agency.database.funds), (0, 1000000))
+        self.assertEqual((self.agency.evaluations, self.agency.in_progress), ({}, set()))
+
+    def test_approved_check_creates_the_account(self) -> None:
+        evaluation = proposal()
+        with mock.patch.object(self.agency, "notify_university") as notify_university:
+            self.agency.evaluate(evaluation)
+            self.agency.on_proposal_checked(evaluation, {"status": RequestStatus.APPROVED.value, "message": ""})
+
+        self.assertEqual(notify_university.call_args.args[0], Actions.CREATE_ACCOUNT)
+        self.assertEqual(self.agency.database.reserved, 300000)
+
+    def test_unreachable_university_requeues_the_proposal(self) -> None:
+        self.agency.rpc_client.call_async.side_effect = ConnectionError("reply queue not ready")
+        evaluation = proposal()
+
+        self.agency.evaluate(evaluation)
+
+        self.agency.channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+        self.assertEqual(self.agency.database.reserved, 0)
+        self.assertEqual((self.agency.evaluations, self.agency.in_progress), ({}, set()))
+        self.assertEqual(self.responses, [])
+
+    def test_unreachable_university_aborts_the_account_creation(self) -> None:
+        evaluation = proposal()
+        with mock.patch.object(self.agency, "notify_university"):
+            self.agency.evaluate(evaluation)
+        self.agency.rpc_client.call_async.side_effect = ConnectionError("reply queue not ready")
+
+        self.agency.on_proposal_checked(evaluation, {"status": RequestStatus.APPROVED.value, "message": ""})
+
+        self.agency.channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+        self.assertEqual((self.agency.database.reserved, self.agency.database.funds), (0, 1000000))
+        self.assertEqual((self.agency.evaluations, self.agency.in_progress), ({}, set()))
+
+    def test_redelivered_proposal_is_answered_from_the_history(self) -> None:
+        self.agency.database.record_history({"correlation_id": "c1", "status": RequestStatus.APPROVED.value, "title": "title"})
+
+        self.agency.evaluate(proposal("c1"))
+
+        self.assertEqual(self.responses, [RequestStatus.APPROVED.value])
+        self.agency.rpc_client.call_async.assert_not_called()
+        self.assertEqual((self.agency.database.request_cache.hits, self.agency.database.request_cache.misses), (1, 0))
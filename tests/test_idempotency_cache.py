@@ -0,0 +1,37 @@
+import time
+import unittest
+from unittest import mock
+from idempotency_cache import IdempotencyCache
+
+class IdempotencyCacheTest(unittest.TestCase):
+
+    def test_lookup_returns_the_recorded_value(self) -> None:
+        cache = IdempotencyCache()
+        cache.put(("1", "withdraw"), "result")
+
+        self.assertEqual(cache.lookup(("1", "withdraw")), "result")
+        self.assertIsNone(cache.lookup(("2", "withdraw")))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expired_entries_are_new_requests(self) -> None:
+        cache = IdempotencyCache(ttl=10)
+        cache.put(("1", "withdraw"), "result", recorded_at=time.time() - 5)
+        self.assertEqual(cache.lookup(("1", "withdraw")), "result")
+
+        with mock.patch("idempotency_cache.time.time", return_value=time.time() + 10):
+            self.assertIsNone(cache.lookup(("1", "withdraw")))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self) -> None:
+        cache = IdempotencyCache(capacity=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.lookup("a")
+        cache.put("c", 3)
+
+        self.assertEqual(cache.lookup("a"), 1)
+        self.assertIsNone(cache.lookup("b"))
+        self.assertEqual(cache.evictions, 1)
+
+if __name__ == '__main__':
+    unittest.main()
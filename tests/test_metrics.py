@@ -0,0 +1,82 @@
+import unittest
+from urllib.request import Request, urlopen
+from metrics import Metrics, OPENMETRICS_CONTENT_TYPE, format_value
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter_and_gauge_samples(self) -> None:
+        metrics = Metrics("university")
+        consumed = metrics.counter("messages_consumed", "Messages received.", ("queue",))
+        consumed.inc(queue="requests")
+        consumed.inc(2, queue="requests")
+        metrics.gauge("accounts", "Accounts.", function=lambda: 3)
+
+        text = metrics.render()
+        self.assertIn("# TYPE university_messages_consumed counter", text)
+        self.assertIn('university_messages_consumed_total{queue="requests"} 3', text)
+        self.assertIn("university_accounts 3", text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_prometheus_format_names_the_counter_family_like_its_samples(self) -> None:
+        metrics = Metrics("university")
+        metrics.counter("messages_consumed", "Messages received.")
+
+        text = metrics.render(openmetrics=False)
+        self.assertIn("# TYPE university_messages_consumed_total counter", text)
+        self.assertNotIn("# EOF", text)
+
+    def test_histogram_buckets_are_cumulative(self) -> None:
+        metrics = Metrics("researcher")
+        histogram = metrics.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+
+        text = metrics.render()
+        self.assertIn('researcher_latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('researcher_latency_seconds_bucket{le="1.0"} 3', text)
+        self.assertIn('researcher_latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn("researcher_latency_seconds_count 4", text)
+        self.assertIn("researcher_latency_seconds_sum 6.05", text)
+
+    def test_labels_and_names_are_checked(self) -> None:
+        metrics = Metrics("university")
+        counter = metrics.counter("errors", "Errors.", ("queue",))
+
+        with self.assertRaises(ValueError):
+            counter.inc(action="withdraw")
+        with self.assertRaises(ValueError):
+            metrics.counter("errors", "Errors.")
+
+    def test_label_values_are_escaped(self) -> None:
+        metrics = Metrics("university")
+        metrics.counter("errors", "Errors.", ("reason",)).inc(reason='a "b"\n')
+
+        self.assertIn('university_errors_total{reason="a \\"b\\"\\n"} 1', metrics.render())
+
+    def test_collectors_run_before_every_render(self) -> None:
+        metrics = Metrics("university")
+        hits = metrics.counter("cache_hits", "Cache hits.")
+        totals = iter([5, 8])
+        metrics.collector(lambda: hits.set(next(totals)))
+
+        self.assertIn("university_cache_hits_total 5", metrics.render())
+        self.assertIn("university_cache_hits_total 8", metrics.render())
+
+    def test_format_value(self) -> None:
+        self.assertEqual(format_value(float("inf")), "+Inf")
+        self.assertEqual(format_value(float("nan")), "NaN")
+        self.assertEqual(format_value(True), "1")
+        self.assertEqual(format_value(3), "3")
+        self.assertEqual(format_value(0.5), "0.5")
+
+    def test_served_over_http(self) -> None:
+        metrics = Metrics("university")
+        metrics.counter("messages_consumed", "Messages received.").inc()
+        server = metrics.serve(0)
+        try:
+            request = Request(f"http://127.0.0.1:{server.server_address[1]}/metrics", headers={"Accept": "application/openmetrics-text"})
+            with urlopen(request, timeout=5) as response:
+                self.assertEqual(response.headers["Content-Type"], OPENMETRICS_CONTENT_TYPE)
+                self.assertIn(b"university_messages_consumed_total 1", response.read())
+        finally:
+            metrics.close()
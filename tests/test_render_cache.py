@@ -0,0 +1,47 @@
+import unittest
+from render_cache import RenderCache
+
+class RenderCacheTest(unittest.TestCase):
+
+    def test_render_is_called_once_per_key(self) -> None:
+        cache = RenderCache()
+        renders = []
+        render = lambda: renders.append(1) or "details"
+
+        self.assertEqual(cache.render(("details", "p1", 1), render), "details")
+        self.assertEqual(cache.render(("details", "p1", 1), render), "details")
+        # a new version of the account is rendered again
+        cache.render(("details", "p1", 2), render)
+
+        self.assertEqual(len(renders), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_renders_are_evicted_over_max_bytes(self) -> None:
+        message = "x" * 1000
+        cache = RenderCache(max_bytes=3 * cache_size(message))
+        for version in range(3):
+            cache.put(("details", "p1", version), message)
+        cache.get(("details", "p1", 0))
+        cache.put(("details", "p1", 3), message)
+
+        self.assertIsNotNone(cache.get(("details", "p1", 0)))
+        self.assertIsNone(cache.get(("details", "p1", 1)))
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.size_bytes, cache.max_bytes)
+
+    def test_render_larger_than_the_cache_is_not_kept(self) -> None:
+        cache = RenderCache(max_bytes=100)
+        cache.put(("details", "p1", 1), "x" * 1000)
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size_bytes, 0)
+
+    def test_replacing_a_key_counts_its_size_once(self) -> None:
+        cache = RenderCache()
+        cache.put(("query", "p1", 1), ("page", 3))
+        cache.put(("query", "p1", 1), ("page", 3))
+
+        self.assertEqual(cache.size_bytes, cache.sizeof(("page", 3)))
+
+def cache_size(message: str) -> int:
+    return RenderCache().sizeof(message)
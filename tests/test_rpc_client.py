@@ -0,0 +1,29 @@
+import unittest
+from concurrent.futures import TimeoutError
+from unittest import mock
+from connection_pool import ConnectionPool
+from rpc_client import RpcClient
+
+class RpcClientTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # the in-memory broker, nothing consumes the requests
+        patcher = mock.patch("transport.TRANSPORT", "memory")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = RpcClient("test", publisher=ConnectionPool())
+
+    def test_timed_out_call_is_not_in_flight(self) -> None:
+        for _ in range(3):
+            with self.assertRaises(TimeoutError):
+                self.client.call("nobody", b"{}", timeout=0.01)
+
+        self.assertEqual(self.client.in_flight(), 0)
+
+    def test_reply_queue_not_ready_raises(self) -> None:
+        client = RpcClient("test", publisher=ConnectionPool(), ready_timeout=0.01)
+        # the consumer does not try again during the tests
+        client.RECONNECT_DELAY = 60
+        with mock.patch("rpc_client.connect", side_effect=ConnectionError("refused")):
+            with self.assertRaises(ConnectionError):
+                client.call("nobody", b"{}", timeout=0.01)
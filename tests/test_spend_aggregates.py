@@ -0,0 +1,86 @@
+import unittest
+from datetime import date
+from unittest import mock
+from request_status import RequestStatus
+from spend_aggregates import SpendAggregates, numpy
+from timer import Timer
+from transaction_ledger import TransactionLedger
+from university_database import UniversityDatabase
+
+DAY = date(2026, 1, 1).toordinal()
+
+def as_tuple(aggregates: SpendAggregates) -> tuple:
+    return aggregates.total, aggregates.count, aggregates.by_researcher, aggregates.by_day, aggregates.first_day
+
+class SpendAggregatesTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.ledger = TransactionLedger()
+        self.ledger.append("Researcher-1", DAY + 1, 100, 900)
+        self.ledger.append("Researcher-2", DAY, 200, 700)
+        self.ledger.append("Researcher-1", DAY + 1, 2 ** 40, 400)
+        self.ledger.append("Researcher-2", DAY + 2, 50, 350, RequestStatus.FAILED.value)
+
+    def test_running_totals_count_the_succeeded_withdrawals(self) -> None:
+        self.assertEqual(
+            as_tuple(self.ledger.aggregates),
+            (300 + 2 ** 40, 3, {"Researcher-1": 100 + 2 ** 40, "Researcher-2": 200}, {DAY: 200, DAY + 1: 100 + 2 ** 40}, DAY)
+        )
+
+    def test_rebuilt_row_by_row_like_the_running_totals(self) -> None:
+        with mock.patch("spend_aggregates.numpy", None):
+            rebuilt = SpendAggregates.from_ledger(self.ledger)
+
+        self.assertEqual(as_tuple(rebuilt), as_tuple(self.ledger.aggregates))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_rebuilt_from_the_columns_like_the_running_totals(self) -> None:
+        rebuilt = SpendAggregates.from_ledger(self.ledger)
+
+        self.assertEqual(as_tuple(rebuilt), as_tuple(self.ledger.aggregates))
+        self.assertIsInstance(rebuilt.total, int)
+
+    def test_empty_ledger(self) -> None:
+        aggregates = SpendAggregates.from_ledger(TransactionLedger())
+
+        self.assertEqual(as_tuple(aggregates), (0, 0, {}, {}, None))
+        self.assertEqual(aggregates.daily_rate(DAY), 0.0)
+        self.assertIsNone(aggregates.exhaustion_day(1000, DAY))
+
+    def test_daily_rate_and_exhaustion_day(self) -> None:
+        aggregates = SpendAggregates()
+        aggregates.add("Researcher-1", DAY, 300)
+
+        # 300 spent over 3 days
+        self.assertEqual(aggregates.daily_rate(DAY + 2), 100.0)
+        self.assertEqual(aggregates.exhaustion_day(1000, DAY + 2), DAY + 12)
+
+    def test_copy_is_independent(self) -> None:
+        aggregates = SpendAggregates()
+        aggregates.add("Researcher-1", DAY, 100)
+        copy = aggregates.copy()
+        copy.add("Researcher-1", DAY, 50)
+
+        self.assertEqual(aggregates.by_researcher, {"Researcher-1": 100})
+        self.assertEqual(copy.by_researcher, {"Researcher-1": 150})
+
+class SpendingReportTest(unittest.TestCase):
+
+    def test_report_reads_the_aggregates_of_the_account(self) -> None:
+        # a day of the simulated calendar does not pass during the test
+        timer = Timer("test", day_length=3600)
+        today = timer.get_ordinal()
+        database = UniversityDatabase()
+        database.apply(("create_account", "title", "description", "p1", 1000, "Lead", date.fromordinal(today + 30)))
+        database.apply(("withdraw", "p1", "Lead", today, 100, 900))
+        database.apply(("withdraw", "p1", "Lead", today, 200, 700))
+
+        response = database.spending_report("Lead", timer)
+
+        self.assertEqual(response.status, RequestStatus.SUCCEEDED.value)
+        self.assertIn("SPENT:                300 £ in 2 withdrawals", response.message)
+        self.assertIn("SPENT TODAY:          300 £", response.message)
+
+        # a withdrawal changes the version of the account, the cached report is not served
+        database.apply(("withdraw", "p1", "Lead", today, 50, 650))
+        self.assertIn("350 £ in 3 withdrawals", database.spending_report("Lead", timer).message)
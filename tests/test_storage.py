@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+from storage import WriteAheadLogStorage
+
+class RecordingDatabase(object):
+    """
+        Database that records the mutations replayed from the log
+    """
+
+    journal = None
+
+    def __init__(self) -> None:
+        self.records = []
+
+    def apply(self, record: tuple) -> None:
+        self.records.append(record)
+
+    def change(self, record: tuple) -> None:
+        self.apply(record)
+        self.journal(record)
+
+class WriteAheadLogStorageTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.name = os.path.join(self.directory.name, "db")
+        self.storages = []
+
+    def tearDown(self) -> None:
+        for storage in self.storages:
+            storage.run = False
+            storage.compaction_requested.set()
+        self.directory.cleanup()
+
+    def open(self, snapshot_interval: int = 10000) -> WriteAheadLogStorage:
+        storage = WriteAheadLogStorage(self.name, RecordingDatabase, snapshot_interval)
+        self.storages.append(storage)
+        storage.load()
+        return storage
+
+    def commit(self, storage: WriteAheadLogStorage, *records) -> None:
+        for record in records:
+            storage.database.change(record)
+        storage.commit()
+
+    def test_replays_committed_records(self) -> None:
+        storage = self.open()
+        self.commit(storage, (1,), (2,))
+        self.commit(storage, (3,))
+        storage.close()
+
+        self.assertEqual(self.open().database.records, [(1,), (2,), (3,)])
+
+    def test_uncommitted_records_are_lost(self) -> None:
+        storage = self.open()
+        self.commit(storage, (1,))
+        storage.database.change((2,))
+
+        self.assertEqual(self.open().database.records, [(1,)])
+
+    def test_records_committed_after_a_torn_first_frame_survive(self) -> None:
+        storage = self.open()
+        self.commit(storage, (1,))
+        storage.close()
+
+        # crash while writing the first frame of the new segment
+        crashed = self.open()
+        crashed.segment.write(WriteAheadLogStorage.HEADER.pack(100) + b"torn")
+        crashed.segment.flush()
+
+        restarted = self.open()
+        self.assertEqual(restarted.database.records, [(1,)])
+        self.commit(restarted, (2,))
+        self.commit(restarted, (3,))
+        restarted.close()
+
+        self.assertEqual(self.open().database.records, [(1,), (2,), (3,)])
+
+    def test_torn_frame_after_complete_frames_is_truncated(self) -> None:
+        storage = self.open()
+        self.commit(storage, (1,), (2,))
+        storage.segment.write(WriteAheadLogStorage.HEADER.pack(100))
+        storage.segment.flush()
+
+        restarted = self.open()
+        self.commit(restarted, (3,))
+        restarted.close()
+
+        self.assertEqual(self.open().database.records, [(1,), (2,), (3,)])
+
+    def test_compaction_keeps_every_record(self) -> None:
+        storage = self.open(snapshot_interval=2)
+        self.commit(storage, (1,), (2,))
+        storage.compact()
+        self.commit(storage, (3,))
+        storage.close()
+
+        self.assertEqual(self.open().database.records, [(1,), (2,), (3,)])
+
+if __name__ == '__main__':
+    unittest.main()
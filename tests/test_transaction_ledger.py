@@ -0,0 +1,109 @@
+import pickle
+import unittest
+from datetime import date
+from request_status import RequestStatus
+from timer import Timer
+from transaction_ledger import TransactionLedger
+from university_database import UniversityDatabase
+
+DAY = date(2026, 1, 1).toordinal()
+
+def sample_ledger() -> TransactionLedger:
+    ledger = TransactionLedger()
+    ledger.append("Researcher-1", DAY, 100, 900)
+    ledger.append("Researcher-2", DAY, 200, 700)
+    ledger.append("Researcher-1", DAY + 1, 300, 400)
+    ledger.append("Researcher-2", DAY + 2, 50, 350, RequestStatus.FAILED.value)
+    ledger.append("Researcher-1", DAY + 3, 150, 200)
+    return ledger
+
+class TransactionLedgerTest(unittest.TestCase):
+
+    def test_find_without_filters_yields_every_index(self) -> None:
+        self.assertEqual(list(sample_ledger().find()), [0, 1, 2, 3, 4])
+
+    def test_find_filters_researcher_days_and_amounts(self) -> None:
+        ledger = sample_ledger()
+
+        self.assertEqual(list(ledger.find(researcher="Researcher-1")), [0, 2, 4])
+        self.assertEqual(list(ledger.find(researcher="Researcher-3")), [])
+        self.assertEqual(list(ledger.find(first_day=DAY + 1, last_day=DAY + 2)), [2, 3])
+        self.assertEqual(list(ledger.find(researcher="Researcher-1", first_day=DAY + 1)), [2, 4])
+        self.assertEqual(list(ledger.find(min_amount=150, max_amount=250)), [1, 4])
+
+    def test_find_searches_from_after_to_count(self) -> None:
+        ledger = sample_ledger()
+
+        self.assertEqual(list(ledger.find(after=2)), [2, 3, 4])
+        self.assertEqual(list(ledger.find(researcher="Researcher-1", after=1, count=4)), [2])
+
+    def test_find_checks_the_days_of_an_unsorted_ledger_row_by_row(self) -> None:
+        ledger = sample_ledger()
+        ledger.append("Researcher-2", DAY, 10, 190)
+
+        self.assertFalse(ledger.days_sorted)
+        self.assertEqual(list(ledger.find(last_day=DAY)), [0, 1, 5])
+
+    def test_indexes_and_aggregates_are_rebuilt_when_loaded(self) -> None:
+        ledger = pickle.loads(pickle.dumps(sample_ledger()))
+
+        self.assertEqual(list(ledger.find(researcher="Researcher-2")), [1, 3])
+        self.assertEqual(ledger[3]["status"], RequestStatus.FAILED.value)
+        # the failed withdrawal is not spent
+        self.assertEqual(ledger.aggregates.total, 750)
+        self.assertEqual(ledger.aggregates.by_researcher, {"Researcher-1": 550, "Researcher-2": 200})
+
+class AccountTestCase(unittest.TestCase):
+    """
+        Account p1 led by Lead, with the withdrawals 10, 20, 30, 40 and 50
+    """
+
+    def setUp(self) -> None:
+        self.timer = Timer("test")
+        self.database = UniversityDatabase()
+        self.database.apply(("create_account", "title", "description", "p1", 1000, "Lead", date(2030, 1, 1)))
+        budget = 1000
+        for amount in range(10, 60, 10):
+            budget -= amount
+            self.database.apply(("withdraw", "p1", "Lead", DAY, amount, budget))
+
+class QueryTransactionsTest(AccountTestCase):
+
+    def query(self, **kwargs):
+        return self.database.query_transactions("Lead", self.timer, **kwargs)
+
+    def test_pages_follow_the_cursor_until_the_query_is_complete(self) -> None:
+        first = self.query(min_amount=20, limit=2)
+        self.assertEqual(first.status, RequestStatus.SUCCEEDED.value)
+        self.assertIn("2 matching transactions", first.message)
+        self.assertEqual(first.cursor, 3)
+
+        last = self.query(min_amount=20, offset=first.cursor, limit=2)
+        self.assertIn("2 matching transactions", last.message)
+        self.assertIsNone(last.cursor)
+
+    def test_limit_zero_is_an_empty_final_page(self) -> None:
+        response = self.query(limit=0)
+
+        self.assertIn("0 matching transactions", response.message)
+        self.assertIsNone(response.cursor)
+
+    def test_unknown_lead_researcher_fails(self) -> None:
+        response = self.database.query_transactions("Nobody", self.timer)
+
+        self.assertEqual(response.status, RequestStatus.FAILED.value)
+
+class ListTransactionsTest(AccountTestCase):
+
+    def test_pages_follow_the_cursor_until_the_listing_is_complete(self) -> None:
+        first = self.database.list_transactions("Lead", self.timer, limit=3)
+        self.assertEqual(first.cursor, 3)
+
+        last = self.database.list_transactions("Lead", self.timer, offset=first.cursor, limit=3)
+        self.assertEqual(last.message.count(" | Lead "), 2)
+        self.assertIsNone(last.cursor)
+
+    def test_limit_zero_lists_an_empty_final_page(self) -> None:
+        response = self.database.list_transactions("Lead", self.timer, offset=1, limit=0)
+
+        self.assertIsNone(response.cursor)
@@ -1,46 +1,87 @@
 #!/usr/bin/env python
 import time
-from datetime import date, datetime
-from dateutil.relativedelta import relativedelta
+from datetime import date
 from threading import Lock
-import random
+from codec import parse_date, ordinal_date
 
 class Timer(object):
+    """
+        Simulated calendar of a component, a day passes every `day_length` seconds.
+
+        The current day is computed from a monotonic base instead of being advanced by a
+        thread: day = base day + elapsed days + offset. Reads are lock-free, only moving
+        the clock forward after receiving a message takes the lock of this timer.
+
+        Clocks are synchronized with the day ordinal sent in the "clock" header of the messages.
+    """
+
+    HEADER: str = "clock"
 
-    current_date: date
     researcher_id: str
-    lock: Lock = Lock()
+    day_length: float
+    # day ordinal and monotonic time when the timer has been created
+    base_day: int
+    base_time: float
+    # days the clock has been moved forward
+    offset: int
+    lock: Lock
     run: bool
 
-    def __init__(self, researcher_id: str) -> None:
+    def __init__(self, researcher_id: str, day_length: float = 5.0) -> None:
         # initialize date
-        self.current_date = date.today()
         self.researcher_id = researcher_id
+        self.day_length = day_length
+        self.base_day = date.today().toordinal()
+        self.base_time = time.monotonic()
+        self.offset = 0
+        self.lock = Lock()
         self.run = True
 
     def start(self) -> None:
-        while self.run:
-            #print(f" [T-{self.researcher_id}] Current date: {self.current_date.strftime('%d-%m-%Y')}")
-            with self.lock:
-                self.current_date = self.current_date + relativedelta(days=1)
-            #increase date between 4 and 6 seconds
-            time_to_sleep = random.randint(4, 6)
-            time.sleep(time_to_sleep)
-    
+        # the date is computed when read, there is nothing to run
+        pass
+
     def stop(self) -> None:
         self.run = False
 
+    def get_ordinal(self) -> int:
+        return self.base_day + int((time.monotonic() - self.base_time) // self.day_length) + self.offset
+
     def get_time(self) -> date:
-        with self.lock:
-            return self.current_date
-        
+        return date.fromordinal(self.get_ordinal())
+
     def get_time_str(self) -> str:
-        with self.lock:
-            return self.current_date.strftime("%d-%m-%Y")
-        
+        return ordinal_date(self.get_ordinal())
+
+    def headers(self) -> dict:
+        """
+            Headers that carry the clock in a message
+        """
+        return {self.HEADER: self.get_ordinal()}
+
     #adjust timer after receiving request
-    def adjust_timer(self, timestamp: str) -> None:
-        timestamp_to_date = datetime.strptime(timestamp, '%d-%m-%Y').date()
-        with self.lock:
-            if self.current_date < timestamp_to_date:
-                self.current_date = timestamp_to_date + relativedelta(days=1)
\ No newline at end of file
+    def adjust_timer(self, timestamp) -> None:
+        """
+            Move the clock to the day after timestamp if it is behind.
+            timestamp is a day ordinal, a date or a 'dd-mm-yyyy' string.
+        """
+        if isinstance(timestamp, str):
+            timestamp = parse_date(timestamp)
+        if isinstance(timestamp, date):
+            timestamp = timestamp.toordinal()
+
+        if self.get_ordinal() < timestamp:
+            with self.lock:
+                behind = timestamp + 1 - self.get_ordinal()
+                if behind > 1:
+                    self.offset += behind
+
+    def sync(self, headers: dict, timestamp=None) -> None:
+        """
+            Adjust the clock to a received message, from its header or else from its timestamp
+        """
+        clock = (headers or {}).get(self.HEADER)
+        if clock is not None:
+            self.adjust_timer(clock)
+        elif timestamp is not None:
+            self.adjust_timer(timestamp)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+
+class Trace(object):
+    """
+        Spans of one trace, linked to their parent. Times are in microseconds.
+    """
+
+    trace_id: str
+    # k = span id, v = span
+    spans: dict
+    # k = span id, v = children sorted by start
+    children: dict
+    roots: list
+
+    def __init__(self, trace_id: str, spans: list) -> None:
+        self.trace_id = trace_id
+        self.spans = {span["id"]: span for span in spans}
+        self.children = {}
+        self.roots = []
+        for span in sorted(spans, key=lambda span: span["timestamp"]):
+            parent_id = span.get("parentId")
+            if parent_id in self.spans:
+                self.children.setdefault(parent_id, []).append(span)
+            else:
+                self.roots.append(span)
+
+    @property
+    def root(self) -> dict:
+        return self.roots[0]
+
+    def duration(self) -> int:
+        return max(end(span) for span in self.spans.values()) - min(span["timestamp"] for span in self.spans.values())
+
+    def critical_path(self, span: dict = None) -> list:
+        """
+            Spans that determine the end of `span`: from its end, the child that finished last
+            (and started before the cursor), then the child that finished last before that child started, ...
+        """
+        span = span or self.root
+        path = [span]
+        cursor = end(span)
+        for child in sorted(self.children.get(span["id"], []), key=end, reverse=True):
+            # a child may finish a little after its parent: its reply is received before it records its end
+            if child["timestamp"] < cursor:
+                path.extend(self.critical_path(child))
+                cursor = child["timestamp"]
+        return path
+
+    def hops(self) -> list:
+        """
+            (hop, phase, microseconds) of every client span answered by a server span of the trace
+        """
+        breakdown = []
+        for client in self.spans.values():
+            if client.get("kind") != "CLIENT":
+                continue
+            for server in self.children.get(client["id"], []):
+                if server.get("kind") != "SERVER":
+                    continue
+                hop = f"{service(client)} → {service(server)} ({server['name']})"
+                client_times, server_times = annotations(client), annotations(server)
+                published = client_times.get("publish", client["timestamp"])
+                replied = client_times.get("reply", end(client))
+
+                breakdown.append((hop, "round trip", replied - published))
+                breakdown.append((hop, "request transit", server_times.get("receive", server["timestamp"]) - published))
+                # the steps of the server in the order they happened, e.g. handler end → persist
+                steps = sorted((timestamp, value) for value, timestamp in server_times.items())
+                for (start, first), (stop, last) in zip(steps, steps[1:]):
+                    breakdown.append((hop, f"{first} → {last}", stop - start))
+                breakdown.append((hop, "reply transit", replied - server_times.get("reply", end(server))))
+        return breakdown
+
+    def print_tree(self, span: dict = None, depth: int = 0, critical: set = None) -> None:
+        if span is None:
+            critical = {span["id"] for span in self.critical_path()}
+            print(f" [T] trace {self.trace_id}: {self.duration() / 1000:.2f} ms, {len(self.spans)} spans (* critical path)")
+            for root in self.roots:
+                self.print_tree(root, 0, critical)
+            return
+
+        offset = (span["timestamp"] - self.root["timestamp"]) / 1000
+        marker = "*" if span["id"] in critical else " "
+        label = f"{'  ' * depth}{service(span)}: {span['name']}"
+        steps = ", ".join(
+            f"{annotation['value']} +{(annotation['timestamp'] - span['timestamp']) / 1000:.2f}"
+            for annotation in span.get("annotations", [])
+        )
+        print(f"\t{marker} {label:70} | {offset:9.2f} | {span['duration'] / 1000:9.2f} | {steps}")
+        for child in self.children.get(span["id"], []):
+            self.print_tree(child, depth + 1, critical)
+
+def end(span: dict) -> int:
+    return span["timestamp"] + span["duration"]
+
+def service(span: dict) -> str:
+    return span.get("localEndpoint", {}).get("serviceName", "?")
+
+def annotations(span: dict) -> dict:
+    # k = annotation, v = time of its first occurrence
+    times = {}
+    for annotation in span.get("annotations", []):
+        times.setdefault(annotation["value"], annotation["timestamp"])
+    return times
+
+def read_traces(paths: list) -> list:
+    """
+        Traces of the spans written to the files (one JSON span per line)
+    """
+    spans = {}
+    for path in paths:
+        if not os.path.exists(path):
+            print(f" [T] {path} not found")
+            continue
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    span = json.loads(line)
+                    spans.setdefault(span["traceId"], []).append(span)
+    return [Trace(trace_id, trace_spans) for trace_id, trace_spans in spans.items()]
+
+def percentile(samples: list, q: float) -> float:
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+def print_breakdown(traces: list) -> None:
+    """
+        Percentiles of every phase of every hop over all the traces, in milliseconds
+    """
+    # k = (hop, phase), v = samples in microseconds
+    phases = {}
+    for trace in traces:
+        for hop, phase, duration in trace.hops():
+            phases.setdefault((hop, phase), []).append(duration)
+
+    print(f"\t{'HOP':60} | {'PHASE':30} | {'COUNT':7} | {'MEAN(ms)':8} | {'P50(ms)':8} | {'P95(ms)':8} | {'P99(ms)':8}")
+    for (hop, phase), samples in sorted(phases.items()):
+        samples.sort()
+        print(
+            f"\t{hop:60} | {phase:30} | {len(samples):7} | {sum(samples) / len(samples) / 1000:8.2f} | "
+            f"{percentile(samples, 0.50) / 1000:8.2f} | {percentile(samples, 0.95) / 1000:8.2f} | {percentile(samples, 0.99) / 1000:8.2f}"
+        )
+
+def print_critical_paths(traces: list) -> None:
+    """
+        How often each sequence of spans is the critical path of a trace, and its mean duration
+    """
+    # k = critical path, v = durations of the traces
+    paths = {}
+    for trace in traces:
+        path = " → ".join(f"{service(span)}: {span['name']}" for span in trace.critical_path())
+        paths.setdefault(path, []).append(trace.duration())
+
+    for path, durations in sorted(paths.items(), key=lambda item: -len(item[1])):
+        print(f"\t{len(durations):7} traces | mean {sum(durations) / len(durations) / 1000:8.2f} ms | {path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="critical paths and hop latency breakdown of the traces written with --trace")
+    parser.add_argument("files", nargs="+", help="span files (one JSON span per line)")
+    parser.add_argument("--trace", default=None, help="print the spans of this trace id")
+    parser.add_argument("--slowest", type=int, default=3, help="print the spans of the N slowest traces")
+    parser.add_argument("--name", default=None, help="only the traces whose root span has this name, e.g. 'reserch proposal'")
+    args = parser.parse_args()
+
+    traces = [trace for trace in read_traces(args.files) if trace.roots]
+    if args.name is not None:
+        traces = [trace for trace in traces if trace.root["name"] == args.name]
+    if args.trace is not None:
+        traces = [trace for trace in traces if trace.trace_id == args.trace]
+
+    print(f" [T] {len(traces)} traces, {sum(len(trace.spans) for trace in traces)} spans\n")
+    if not traces:
+        raise SystemExit(0)
+
+    print(" [T] Critical paths:")
+    print_critical_paths(traces)
+    print("\n [T] Hop latency breakdown:")
+    print_breakdown(traces)
+    print()
+
+    for trace in sorted(traces, key=Trace.duration, reverse=True)[:args.slowest]:
+        trace.print_tree()
+        print()
@@ -0,0 +1,166 @@
+import json
+import random
+import time
+from threading import Lock
+
+class Span(object):
+    """
+        One operation of a component, written as a Zipkin v2 span (JSON, times in microseconds).
+
+        The context of a span travels in the B3 headers of the messages: the receiver starts
+        its span as a child of the span found in the headers. Annotations record the steps of
+        the operation (publish, receive, handler start/end, persist, reply).
+
+        A span of a disabled tracer, or of a trace that is not sampled, records nothing and
+        adds no headers.
+    """
+
+    TRACE_ID: str = "X-B3-TraceId"
+    SPAN_ID: str = "X-B3-SpanId"
+    PARENT_ID: str = "X-B3-ParentSpanId"
+    SAMPLED: str = "X-B3-Sampled"
+
+    tracer: "Tracer"
+    trace_id: str
+    span_id: str
+    parent_id: str
+    name: str
+    # CLIENT, SERVER or None for a local operation
+    kind: str
+    sampled: bool
+    # microseconds since the epoch
+    start: int
+    # (microseconds since the epoch, value)
+    annotations: list
+    tags: dict
+    finished: bool
+
+    def __init__(self, tracer: "Tracer", name: str, kind: str = None, trace_id: str = None, parent_id: str = None, sampled: bool = False) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.span_id = None
+        self.annotations = []
+        self.tags = {}
+        self.finished = False
+        if sampled:
+            self.span_id = f"{random.getrandbits(64):016x}"
+            self.start = now()
+
+    def annotate(self, value: str) -> "Span":
+        if self.sampled:
+            self.annotations.append((now(), value))
+        return self
+
+    def tag(self, key: str, value) -> "Span":
+        if self.sampled:
+            self.tags[key] = str(value)
+        return self
+
+    def child(self, name: str, kind: str = None) -> "Span":
+        return self.tracer.start_span(name, kind, self)
+
+    def headers(self, headers: dict = None) -> dict:
+        """
+            headers with the context of this span added, the receiver of the message becomes its child
+        """
+        headers = dict(headers or {})
+        if self.trace_id is not None:
+            headers[self.TRACE_ID] = self.trace_id
+            headers[self.SAMPLED] = "1" if self.sampled else "0"
+            if self.sampled:
+                headers[self.SPAN_ID] = self.span_id
+                if self.parent_id is not None:
+                    headers[self.PARENT_ID] = self.parent_id
+        return headers
+
+    def finish(self) -> None:
+        if not self.sampled or self.finished:
+            return
+        self.finished = True
+        self.tracer.record(self, now())
+
+    def to_dict(self, end: int) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.start,
+            "duration": max(end - self.start, 1),
+            "localEndpoint": {"serviceName": self.tracer.service},
+            "annotations": [{"timestamp": timestamp, "value": value} for timestamp, value in self.annotations]
+        }
+        if self.parent_id is not None:
+            span["parentId"] = self.parent_id
+        if self.kind is not None:
+            span["kind"] = self.kind
+        if self.tags:
+            span["tags"] = self.tags
+        return span
+
+class Tracer(object):
+    """
+        Starts the spans of a component and appends the finished ones to `path`, one JSON
+        span per line. Components of different processes can share the file: every span is
+        written with a single append.
+
+        Without a path nothing is recorded. New traces are sampled with `sample_rate`, the
+        decision is propagated to the other components with the trace.
+    """
+
+    service: str
+    path: str
+    sample_rate: float
+    file: object
+    lock: Lock
+
+    def __init__(self, service: str, path: str = None, sample_rate: float = 1.0) -> None:
+        self.service = service
+        self.path = path
+        self.sample_rate = sample_rate
+        self.lock = Lock()
+        # unbuffered: a span is one write call, appended at the end of the file
+        self.file = None if path is None else open(path, "ab", buffering=0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.file is not None
+
+    def start_span(self, name: str, kind: str = None, parent=None) -> Span:
+        """
+            parent is a Span or the headers of the message that started the operation,
+            without a parent (or its context) the span starts a new trace
+        """
+        if not self.enabled:
+            return Span(self, name, kind)
+
+        if isinstance(parent, Span):
+            if parent.trace_id is None:
+                return Span(self, name, kind)
+            return Span(self, name, kind, parent.trace_id, parent.span_id, parent.sampled)
+
+        headers = parent or {}
+        trace_id = headers.get(Span.TRACE_ID)
+        if trace_id is not None:
+            return Span(self, name, kind, trace_id, headers.get(Span.SPAN_ID), headers.get(Span.SAMPLED) == "1")
+
+        sampled = random.random() < self.sample_rate
+        return Span(self, name, kind, f"{random.getrandbits(128):032x}", None, sampled)
+
+    def record(self, span: Span, end: int) -> None:
+        line = (json.dumps(span.to_dict(end), separators=(",", ":")) + "\n").encode()
+        with self.lock:
+            self.file.write(line)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def now() -> int:
+    # microseconds since the epoch, comparable across the processes of the host
+    return time.time_ns() // 1000
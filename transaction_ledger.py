@@ -0,0 +1,187 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from request_status import RequestStatus
+from spend_aggregates import SpendAggregates
+
+class TransactionLedger(object):
+    """
+        Append-only ledger of the withdrawals of an account, stored column by column.
+
+        Every column is a typed array: researchers are interned to integer ids, dates are
+        stored as day ordinals and amounts/budgets as int64, so a transaction costs a few
+        bytes instead of a dict with five keys. Rows are only materialized when read.
+
+        Transaction ids start from 1, the transaction with id n is at index n - 1.
+
+        Queries are served by indexes: the days of the withdrawals only grow, so a date range
+        is found with bisect on the day column, and the transactions of a researcher are
+        kept in a posting list. A query costs O(log n + k), k the rows of the researcher
+        in the date range.
+    """
+
+    STATUSES: list = [status.value for status in RequestStatus]
+
+    # interned researchers, k = researcher id (index), v = researcher
+    researchers: list
+    # k = researcher, v = researcher id
+    researcher_ids: dict
+    researcher_column: array
+    day_column: array
+    amount_column: array
+    budget_column: array
+    status_column: array
+    # k = researcher id, v = indexes of the transactions of the researcher, not saved: rebuilt when loaded
+    postings: list
+    # false if a transaction is older than the previous one (account moved from a shard with
+    # a different clock), the date range is then checked row by row
+    days_sorted: bool
+    # running totals of the succeeded withdrawals, not saved: rebuilt when loaded
+    aggregates: SpendAggregates
+
+    def __init__(self) -> None:
+        self.researchers = []
+        self.researcher_ids = {}
+        self.postings = []
+        self.days_sorted = True
+        self.aggregates = SpendAggregates()
+        self.researcher_column = array('i')
+        self.day_column = array('i')
+        self.amount_column = array('q')
+        self.budget_column = array('q')
+        self.status_column = array('b')
+
+    def intern(self, researcher: str) -> int:
+        researcher_id = self.researcher_ids.get(researcher)
+        if researcher_id is None:
+            researcher_id = len(self.researchers)
+            self.researchers.append(researcher)
+            self.researcher_ids[researcher] = researcher_id
+            self.postings.append(array('i'))
+        return researcher_id
+
+    def append(self, researcher: str, day: int, amount: int, budget: int, status: str = RequestStatus.SUCCEEDED.value) -> int:
+        """
+            Register a transaction, day is a date ordinal. Returns the transaction id.
+        """
+        researcher_id = self.intern(researcher)
+        if self.day_column and day < self.day_column[-1]:
+            self.days_sorted = False
+        self.postings[researcher_id].append(len(self.day_column))
+        self.researcher_column.append(researcher_id)
+        self.day_column.append(day)
+        self.amount_column.append(amount)
+        self.budget_column.append(budget)
+        self.status_column.append(self.STATUSES.index(status))
+        if status == RequestStatus.SUCCEEDED.value:
+            self.aggregates.add(researcher, day, amount)
+        return len(self.day_column)
+
+    def __len__(self) -> int:
+        return len(self.day_column)
+
+    def row(self, index: int) -> dict:
+        return {
+            "id": index + 1,
+            "researcher": self.researchers[self.researcher_column[index]],
+            "date": date.fromordinal(self.day_column[index]).strftime("%d-%m-%Y"),
+            "amount": self.amount_column[index],
+            "status": self.STATUSES[self.status_column[index]],
+            "budget": self.budget_column[index]
+        }
+
+    def find(self, researcher: str = None, first_day: int = None, last_day: int = None, min_amount: int = None,
+             max_amount: int = None, after: int = 0, count: int = None):
+        """
+            Yields in order the indexes of the transactions matching every filter: made by
+            `researcher`, between the day ordinals `first_day` and `last_day`, with an amount
+            between `min_amount` and `max_amount`. Only the transactions from index `after`
+            and before index `count` (the whole ledger by default) are searched.
+        """
+        count = len(self) if count is None else count
+        if researcher is not None:
+            researcher_id = self.researcher_ids.get(researcher)
+            if researcher_id is None:
+                return
+            candidates = self.postings[researcher_id]
+        else:
+            candidates = range(count)
+
+        start = bisect_left(candidates, after)
+        end = bisect_left(candidates, count, start)
+        days = self.day_column
+        if self.days_sorted:
+            if first_day is not None:
+                start = bisect_left(candidates, first_day, start, end, key=days.__getitem__)
+            if last_day is not None:
+                end = bisect_right(candidates, last_day, start, end, key=days.__getitem__)
+            first_day = last_day = None
+
+        amounts = self.amount_column
+        for position in range(start, end):
+            index = candidates[position]
+            if first_day is not None and days[index] < first_day:
+                continue
+            if last_day is not None and days[index] > last_day:
+                continue
+            if min_amount is not None and amounts[index] < min_amount:
+                continue
+            if max_amount is not None and amounts[index] > max_amount:
+                continue
+            yield index
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.row(index) for index in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("transaction index out of range")
+        return self.row(key)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def items(self):
+        """
+            (transaction id, transaction) pairs, like the dict the ledger replaces
+        """
+        for index in range(len(self)):
+            yield index + 1, self.row(index)
+
+    def __getstate__(self) -> dict:
+        return {
+            "researchers": self.researchers,
+            "researcher": self.researcher_column.tobytes(),
+            "day": self.day_column.tobytes(),
+            "amount": self.amount_column.tobytes(),
+            "budget": self.budget_column.tobytes(),
+            "status": self.status_column.tobytes()
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        for researcher in state["researchers"]:
+            self.intern(researcher)
+        self.researcher_column.frombytes(state["researcher"])
+        self.day_column.frombytes(state["day"])
+        self.amount_column.frombytes(state["amount"])
+        self.budget_column.frombytes(state["budget"])
+        self.status_column.frombytes(state["status"])
+        for index, researcher_id in enumerate(self.researcher_column):
+            self.postings[researcher_id].append(index)
+        days = self.day_column
+        self.days_sorted = all(days[index] <= days[index + 1] for index in range(len(days) - 1))
+        self.aggregates = SpendAggregates.from_ledger(self)
+
+    @classmethod
+    def from_dict(cls, transactions: dict) -> "TransactionLedger":
+        """
+            Convert the transactions stored as {id: {researcher, date, amount, status, budget}}
+        """
+        ledger = cls()
+        for _, transaction in sorted(transactions.items()):
+            day = date(*reversed([int(part) for part in transaction["date"].split("-")])).toordinal()
+            ledger.append(transaction["researcher"], day, int(transaction["amount"]), int(transaction["budget"]), transaction["status"])
+        return ledger
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+from pika import BlockingConnection, ConnectionParameters
+from pika.spec import BasicProperties
+from collections import deque
+from itertools import count
+from queue import Queue, Empty
+from threading import Lock
+import heapq
+import os
+import time
+import uuid
+
+# "amqp" connects to RabbitMQ, "memory" to the in-process broker
+TRANSPORT: str = os.environ.get("UNIVERSITY_TRANSPORT", "amqp")
+
+def configure(transport: str) -> None:
+    """
+        Select the transport of the connections opened from now on
+    """
+    global TRANSPORT
+    if transport not in ("amqp", "memory"):
+        raise ValueError(f"unknown transport '{transport}'")
+    TRANSPORT = transport
+
+def is_memory() -> bool:
+    return TRANSPORT == "memory"
+
+def connect(host: str = 'localhost'):
+    """
+        Open a blocking connection with the selected transport
+    """
+    if is_memory():
+        return MemoryConnection(broker)
+    return BlockingConnection(ConnectionParameters(host=host))
+
+class Deliver(object):
+    """
+        Delivery metadata passed to the consumers, like Basic.Deliver
+    """
+
+    consumer_tag: str
+    delivery_tag: int
+    redelivered: bool
+    exchange: str
+    routing_key: str
+
+    def __init__(self, consumer_tag: str, delivery_tag: int, redelivered: bool, exchange: str, routing_key: str) -> None:
+        self.consumer_tag = consumer_tag
+        self.delivery_tag = delivery_tag
+        self.redelivered = redelivered
+        self.exchange = exchange
+        self.routing_key = routing_key
+
+class Return(object):
+    """
+        Metadata of a mandatory message that could not be routed, like Basic.Return
+    """
+
+    reply_code: int
+    reply_text: str
+    exchange: str
+    routing_key: str
+
+    def __init__(self, reply_code: int, reply_text: str, exchange: str, routing_key: str) -> None:
+        self.reply_code = reply_code
+        self.reply_text = reply_text
+        self.exchange = exchange
+        self.routing_key = routing_key
+
+class Message(object):
+
+    exchange: str
+    routing_key: str
+    properties: BasicProperties
+    body: bytes
+    redelivered: bool
+
+    def __init__(self, exchange: str, routing_key: str, properties: BasicProperties, body: bytes) -> None:
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.properties = properties
+        self.body = body
+        self.redelivered = False
+
+class Consumer(object):
+
+    tag: str
+    channel: "MemoryChannel"
+    queue: "MemoryQueue"
+    callback: object
+    auto_ack: bool
+
+    def __init__(self, tag: str, channel: "MemoryChannel", queue: "MemoryQueue", callback, auto_ack: bool) -> None:
+        self.tag = tag
+        self.channel = channel
+        self.queue = queue
+        self.callback = callback
+        self.auto_ack = auto_ack
+
+    def has_capacity(self) -> bool:
+        return self.auto_ack or self.channel.prefetch_count == 0 or len(self.channel.unacked) < self.channel.prefetch_count
+
+class MemoryQueue(object):
+
+    name: str
+    messages: deque
+    consumers: list
+    # connection that owns an exclusive queue
+    owner: "MemoryConnection"
+    # position of the next consumer served (round robin)
+    next_consumer: int
+
+    def __init__(self, name: str, owner: "MemoryConnection" = None) -> None:
+        self.name = name
+        self.messages = deque()
+        self.consumers = []
+        self.owner = owner
+        self.next_consumer = 0
+
+class QueueDeclareOk(object):
+    """
+        Result of queue_declare, the name of the queue is in result.method.queue
+    """
+
+    def __init__(self, queue: str, message_count: int, consumer_count: int) -> None:
+        self.method = self
+        self.queue = queue
+        self.message_count = message_count
+        self.consumer_count = consumer_count
+
+class MemoryBroker(object):
+    """
+        In-process stand-in for RabbitMQ, with the subset of AMQP used by the components:
+        direct and fanout exchanges, the default exchange, named and exclusive queues,
+        round-robin consumers, prefetch, acks, rejects and requeue of unacked messages.
+
+        Messages are delivered by queueing the consumer callback on the event loop of its
+        connection, so callbacks run on the thread that consumes, as with BlockingConnection.
+    """
+
+    # k = exchange, v = (type, {routing key: set of queues})
+    exchanges: dict
+    # k = queue name, v = MemoryQueue
+    queues: dict
+    lock: Lock
+
+    def __init__(self) -> None:
+        self.exchanges = {}
+        self.queues = {}
+        self.lock = Lock()
+
+    def exchange_declare(self, exchange: str, exchange_type: str) -> None:
+        with self.lock:
+            self.exchanges.setdefault(exchange, (exchange_type, {}))
+
+    def queue_declare(self, queue: str, exclusive: bool, owner: "MemoryConnection") -> QueueDeclareOk:
+        with self.lock:
+            if not queue:
+                queue = f"amq.gen-{uuid.uuid4().hex}"
+            memory_queue = self.queues.get(queue)
+            if memory_queue is None:
+                memory_queue = self.queues[queue] = MemoryQueue(queue, owner if exclusive else None)
+            return QueueDeclareOk(queue, len(memory_queue.messages), len(memory_queue.consumers))
+
+    def queue_bind(self, exchange: str, queue: str, routing_key: str) -> None:
+        with self.lock:
+            if exchange not in self.exchanges:
+                raise ValueError(f"no exchange '{exchange}'")
+            _, bindings = self.exchanges[exchange]
+            bindings.setdefault(routing_key, set()).add(queue)
+
+    def publish(self, exchange: str, routing_key: str, properties: BasicProperties, body) -> bool:
+        """
+            Enqueue the message in every queue bound to the routing key, returns whether it has been routed
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        message = Message(exchange, routing_key, properties or BasicProperties(), body)
+
+        with self.lock:
+            if exchange == '':
+                targets = [routing_key]
+            else:
+                exchange_type, bindings = self.exchanges.get(exchange, (None, {}))
+                if exchange_type == "fanout":
+                    targets = set().union(*bindings.values()) if bindings else set()
+                else:
+                    targets = bindings.get(routing_key, ())
+
+            # unroutable messages are dropped, like a broker without alternate exchange
+            routed = False
+            for name in targets:
+                queue = self.queues.get(name)
+                if queue is not None:
+                    queue.messages.append(message)
+                    self._dispatch(queue)
+                    routed = True
+            return routed
+
+    def is_consumed(self, exchange: str, routing_key: str) -> bool:
+        """
+            Whether a message published with this routing key reaches at least one consumer
+        """
+        with self.lock:
+            if exchange == '':
+                targets = [routing_key]
+            else:
+                _, bindings = self.exchanges.get(exchange, (None, {}))
+                targets = bindings.get(routing_key, ())
+            return any(name in self.queues and self.queues[name].consumers for name in targets)
+
+    def consume(self, consumer: Consumer) -> None:
+        with self.lock:
+            consumer.queue.consumers.append(consumer)
+            self._dispatch(consumer.queue)
+
+    def _dispatch(self, queue: MemoryQueue) -> None:
+        """
+            Hand the messages of the queue to the consumers that have room for them, holding the lock
+        """
+        while queue.messages and queue.consumers:
+            for _ in range(len(queue.consumers)):
+                consumer = queue.consumers[queue.next_consumer % len(queue.consumers)]
+                queue.next_consumer += 1
+                if consumer.has_capacity():
+                    break
+            else:
+                return
+
+            message = queue.messages.popleft()
+            channel = consumer.channel
+            delivery_tag = next(channel.delivery_tags)
+            if not consumer.auto_ack:
+                channel.unacked[delivery_tag] = (queue, message)
+
+            method = Deliver(consumer.tag, delivery_tag, message.redelivered, message.exchange, message.routing_key)
+            channel.connection.events.put(
+                lambda consumer=consumer, method=method, message=message:
+                    consumer.callback(consumer.channel, method, message.properties, message.body)
+            )
+
+    def settle(self, channel: "MemoryChannel", delivery_tag: int, multiple: bool, requeue: bool = None) -> None:
+        """
+            Ack (requeue None), reject or nack the deliveries of a channel
+        """
+        with self.lock:
+            if multiple:
+                tags = [tag for tag in channel.unacked if tag <= delivery_tag]
+            else:
+                tags = [delivery_tag] if delivery_tag in channel.unacked else []
+
+            queues = set()
+            for tag in tags:
+                queue, message = channel.unacked.pop(tag)
+                if requeue:
+                    message.redelivered = True
+                    queue.messages.appendleft(message)
+                queues.add(queue)
+            for queue in queues:
+                self._dispatch(queue)
+            for queue in self._consumed_queues(channel):
+                self._dispatch(queue)
+
+    def _consumed_queues(self, channel: "MemoryChannel") -> list:
+        return [consumer.queue for consumer in channel.consumers]
+
+    def close_channel(self, channel: "MemoryChannel") -> None:
+        """
+            Cancel the consumers of the channel and requeue its unacked messages
+        """
+        with self.lock:
+            for consumer in channel.consumers:
+                if consumer in consumer.queue.consumers:
+                    consumer.queue.consumers.remove(consumer)
+            for queue, message in reversed(list(channel.unacked.values())):
+                message.redelivered = True
+                queue.messages.appendleft(message)
+            requeued = {queue for queue, _ in channel.unacked.values()}
+            channel.unacked.clear()
+            for queue in requeued:
+                self._dispatch(queue)
+
+    def close_connection(self, connection: "MemoryConnection") -> None:
+        for channel in connection.channels:
+            self.close_channel(channel)
+        with self.lock:
+            # exclusive queues are deleted with their connection
+            for name in [name for name, queue in self.queues.items() if queue.owner is connection]:
+                del self.queues[name]
+                for _, bindings in self.exchanges.values():
+                    for queues in bindings.values():
+                        queues.discard(name)
+
+class MemoryChannel(object):
+    """
+        Channel of the in-process broker, same methods as BlockingChannel
+    """
+
+    connection: "MemoryConnection"
+    broker: MemoryBroker
+    prefetch_count: int
+    # k = delivery tag, v = (queue, message) delivered and not acked yet
+    unacked: dict
+    consumers: list
+    delivery_tags: count
+    # callback(channel, Return, properties, body) of the mandatory messages that could not be routed
+    return_callbacks: list
+    is_open: bool
+
+    def __init__(self, connection: "MemoryConnection") -> None:
+        self.connection = connection
+        self.broker = connection.broker
+        self.prefetch_count = 0
+        self.unacked = {}
+        self.consumers = []
+        self.delivery_tags = count(1)
+        self.return_callbacks = []
+        self.is_open = True
+
+    def exchange_declare(self, exchange: str, exchange_type: str = 'direct', **kwargs) -> None:
+        self.broker.exchange_declare(exchange, exchange_type)
+
+    def queue_declare(self, queue: str = '', exclusive: bool = False, **kwargs) -> QueueDeclareOk:
+        return self.broker.queue_declare(queue, exclusive, self.connection)
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str = None, **kwargs) -> None:
+        self.broker.queue_bind(exchange, queue, queue if routing_key is None else routing_key)
+
+    def basic_qos(self, prefetch_count: int = 0, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False, **kwargs) -> str:
+        with self.broker.lock:
+            memory_queue = self.broker.queues.get(queue)
+        if memory_queue is None:
+            raise ValueError(f"no queue '{queue}'")
+        consumer = Consumer(f"ctag-{uuid.uuid4().hex}", self, memory_queue, on_message_callback, auto_ack)
+        self.consumers.append(consumer)
+        self.broker.consume(consumer)
+        return consumer.tag
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties: BasicProperties = None, mandatory: bool = False) -> None:
+        if not self.broker.publish(exchange, routing_key, properties, body) and mandatory:
+            # returned before basic_publish returns, i.e. before the message is confirmed
+            for callback in self.return_callbacks:
+                callback(self, Return(312, "NO_ROUTE", exchange, routing_key), properties, body)
+
+    def add_on_return_callback(self, callback) -> None:
+        self.return_callbacks.append(callback)
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self.broker.settle(self, delivery_tag, multiple)
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        self.broker.settle(self, delivery_tag, multiple, requeue)
+
+    def basic_reject(self, delivery_tag: int = 0, requeue: bool = True) -> None:
+        self.broker.settle(self, delivery_tag, False, requeue)
+
+    def confirm_delivery(self) -> None:
+        # publishes are enqueued synchronously, they are confirmed when basic_publish returns
+        pass
+
+    def start_consuming(self) -> None:
+        self.connection.run()
+
+    def stop_consuming(self) -> None:
+        self.connection.consuming = False
+
+    def close(self) -> None:
+        if self.is_open:
+            self.is_open = False
+            self.broker.close_channel(self)
+
+class MemoryConnection(object):
+    """
+        Connection of the in-process broker, same methods as BlockingConnection.
+        Deliveries, thread-safe callbacks and timers run on the thread that consumes.
+    """
+
+    broker: MemoryBroker
+    channels: list
+    # callables to run on the consuming thread
+    events: Queue
+    # (deadline, id, callback) of call_later
+    timers: list
+    cancelled: set
+    timer_ids: count
+    consuming: bool
+    is_open: bool
+
+    def __init__(self, broker: MemoryBroker) -> None:
+        self.broker = broker
+        self.channels = []
+        self.events = Queue()
+        self.timers = []
+        self.cancelled = set()
+        self.timer_ids = count(1)
+        self.consuming = False
+        self.is_open = True
+
+    def channel(self) -> MemoryChannel:
+        channel = MemoryChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback) -> None:
+        self.events.put(callback)
+
+    def call_later(self, delay: float, callback) -> int:
+        timer_id = next(self.timer_ids)
+        heapq.heappush(self.timers, (time.monotonic() + delay, timer_id, callback))
+        return timer_id
+
+    def remove_timeout(self, timer_id: int) -> None:
+        # a timer that already ran is not in the heap anymore, nothing to cancel
+        if any(pending_id == timer_id for _, pending_id, _ in self.timers):
+            self.cancelled.add(timer_id)
+
+    def _run_timers(self) -> float:
+        """
+            Run the expired timers, returns the seconds until the next one (None if there is none)
+        """
+        while self.timers:
+            deadline, timer_id, callback = self.timers[0]
+            if timer_id in self.cancelled:
+                heapq.heappop(self.timers)
+                self.cancelled.discard(timer_id)
+                continue
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                return wait
+            heapq.heappop(self.timers)
+            callback()
+        return None
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        deadline = time.monotonic() + (time_limit or 0)
+        while True:
+            wait = self._run_timers()
+            remaining = deadline - time.monotonic()
+            timeout = remaining if wait is None else min(wait, remaining)
+            try:
+                event = self.events.get(timeout=max(timeout, 0)) if timeout > 0 else self.events.get_nowait()
+            except Empty:
+                if time.monotonic() >= deadline:
+                    return
+                continue
+            event()
+
+    def run(self) -> None:
+        self.consuming = True
+        while self.consuming and self.is_open:
+            wait = self._run_timers()
+            try:
+                event = self.events.get(timeout=wait)
+            except Empty:
+                continue
+            event()
+
+    def close(self) -> None:
+        if self.is_open:
+            self.is_open = False
+            self.consuming = False
+            self.broker.close_connection(self)
+            # wake up the consuming thread
+            self.events.put(lambda: None)
+
+# broker shared by every in-memory connection of the process
+broker = MemoryBroker()
@@ -1,105 +1,593 @@
 #!/usr/bin/env python
-from pika import BlockingConnection, ConnectionParameters
+from pika import BlockingConnection
 from pika.spec import Basic, BasicProperties, PERSISTENT_DELIVERY_MODE
 from pika.adapters.blocking_connection import BlockingChannel
 import json
-import pickle
+import argparse
+import time
 from university_database import UniversityDatabase
-from university_request_handler import ResearcherProposalHandler, UniversityRequestHandler, CreateAccountHandler, WithdrawHandler, AddResearcherHandler, RemoveResearcherHandler, GetDetailsHandler, ListTransactionsHandler
+from university_request_handler import ResearcherProposalHandler, CreateAccountHandler, WithdrawHandler, AddResearcherHandler, RemoveResearcherHandler, GetDetailsHandler, ListTransactionsHandler, ListAccountsHandler, QueryTransactionsHandler, SpendingReportHandler
+from handler_registry import HandlerRegistry, ActionStats
 from timer import Timer
 from request_status import RequestStatus
-from request_response import RequestResponse
+from request_response import RequestResponse, StreamedResponse
+from codec import codec_for, decode
+from storage import PickleStorage, WriteAheadLogStorage
+from sharding import SHARDS_EXCHANGE, DIRECTORY_EXCHANGE, declare_directory, shard_name, shard_queue
+from actions import Actions, READ_ONLY_ACTIONS, READ_QUEUE
+from account_executor import AccountExecutor
+from read_snapshot import ReadReplica
 from concurrent.futures import ThreadPoolExecutor
+from transport import connect
+from tracing import Tracer, Span
+from metrics import Metrics, Counter, Histogram
 
 class University(object):
 
     DATA_FILE: str = "university.pickle"
+    WAL_NAME: str = "university"
     database: UniversityDatabase
-    request_handler: UniversityRequestHandler
+    storage: PickleStorage
+    request_handler: HandlerRegistry
     timer: Timer = Timer("university")
+    connection: BlockingConnection
+    batch_size: int
+    batch_wait: float
+    # requests applied but not yet committed: (delivery_tag, props, result, span)
+    batch: list
+    batch_timer: object
+    queue_name: str = "university_requests_queue"
+    shard: int
+    # changes of the researcher->account mapping to publish after the commit: (researcher, project_id)
+    directory_updates: list
+    account_executor: AccountExecutor
+    prefetch: int
+    # snapshot of the database refreshed after each commit, read by the read lane
+    replica: ReadReplica
+    read_executor: ThreadPoolExecutor
+    read_prefetch: int
+    # seconds between two sweeps of the expired accounts
+    expiry_interval: float
+    # spans of the requests, children of the span of the sender
+    tracer: Tracer
+    # counters and histograms of the university, served on metrics_port
+    metrics: Metrics
+    consumed: Counter
+    acked: Counter
+    persist_duration: Histogram
+    expired_accounts: Counter
+    # k = queue, v = prefetch count of its consumer
+    prefetch_counts: dict
 
-    def __init__(self) -> None:
-        try:
-            #read data from file
-            with open(self.DATA_FILE, 'rb') as f:
-                self.database = pickle.load(f)
-        except FileNotFoundError:
-            # initialize database
-            self.database = UniversityDatabase()
+    def __init__(self, storage: str = "pickle", snapshot_interval: int = 10000, batch_size: int = 1, batch_wait: float = 0.01,
+                 dedup_capacity: int = 100000, dedup_ttl: float = None, shard: int = None, workers: int = 0, prefetch: int = 64,
+                 stats_interval: float = 0, read_workers: int = 2, read_prefetch: int = 64, render_cache_mb: float = 64,
+                 expiry_interval: float = 5.0, trace_file: str = None, trace_sample: float = 1.0, metrics_port: int = None) -> None:
+        """
+            storage:
+                - pickle: the whole database is pickled to DATA_FILE after every request
+                - wal: mutations are appended to a write-ahead log, snapshots are taken in background
+
+            batch_size/batch_wait:
+                group commit, up to batch_size requests (or the requests received within
+                batch_wait seconds) are applied in order and persisted with a single commit
+                before their responses are sent and acknowledged
+
+            dedup_capacity/dedup_ttl:
+                number of processed requests remembered to detect redeliveries, and for how many seconds
+
+            shard:
+                index of the shard owned by this worker, requests are received from the
+                university router (see sharding.py and university_router.py)
+
+            workers/prefetch:
+                when workers > 0 up to prefetch requests are dispatched to per-account serial
+                queues running on a pool of workers: requests on different accounts run in
+                parallel, requests on the same account keep their order
+
+            stats_interval:
+                print latency, errors and throughput of each action every stats_interval seconds
+
+            read_workers/read_prefetch:
+                read-only requests (get details, list transactions) are served by read_workers
+                threads from a snapshot of the last commit: they are not recorded, not persisted
+                and never wait for the writes. Up to read_prefetch of them are received at a time
+                from the read queue.
+
+            render_cache_mb:
+                memory of the rendered details and transaction pages kept for the accounts that have not changed
+
+            expiry_interval:
+                seconds between two sweeps marking expired the accounts whose end date has passed
+                (a simulated day by default), 0 disables the sweeper
+
+            trace_file/trace_sample:
+                append a span per request to trace_file, with the receive, handler start/end,
+                persist and reply times (see tracing.py and trace_report.py)
+
+            metrics_port:
+                serve the metrics (messages, handler latency, persist, dedup, render cache, prefetch
+                utilisation) in the OpenMetrics text format on this local port, None to disable
+        """
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.batch = []
+        self.batch_timer = None
+        self.shard = shard
+        self.directory_updates = []
+        self.prefetch = prefetch
+        self.account_executor = AccountExecutor(workers) if workers > 0 else None
+        self.read_executor = ThreadPoolExecutor(max_workers=max(read_workers, 1), thread_name_prefix="university-reads")
+        self.read_prefetch = read_prefetch
+        self.expiry_interval = expiry_interval
+        self.tracer = Tracer("university", trace_file, trace_sample)
+        self.prefetch_counts = {}
+
+        if shard is not None:
+            self.queue_name = shard_queue(shard)
+            self.DATA_FILE = f"university-{shard_name(shard)}.pickle"
+            self.WAL_NAME = f"university-{shard_name(shard)}"
+
+        database_factory = lambda: UniversityDatabase(dedup_capacity, dedup_ttl)
+        if storage == "wal":
+            self.storage = WriteAheadLogStorage(self.WAL_NAME, database_factory, snapshot_interval)
+        else:
+            self.storage = PickleStorage(self.DATA_FILE, database_factory)
+
+        self.database = self.storage.load()
+        self.database.request_cache.configure(dedup_capacity, dedup_ttl)
+        self.database.render_cache.max_bytes = int(render_cache_mb * 1024 * 1024)
+        self.replica = ReadReplica(self.database)
 
-        # initialize responisbility chain
-        self.request_handler = CreateAccountHandler()
+        # initialize handlers, requests are dispatched by action
+        self.request_handler = HandlerRegistry()
 
         (self.request_handler
-            .set_next_handler(WithdrawHandler())
-            .set_next_handler(AddResearcherHandler())
-            .set_next_handler(RemoveResearcherHandler())
-            .set_next_handler(GetDetailsHandler())
-            .set_next_handler(ListTransactionsHandler())
-            .set_next_handler(ResearcherProposalHandler())
+            .register(CreateAccountHandler())
+            .register(WithdrawHandler())
+            .register(AddResearcherHandler())
+            .register(RemoveResearcherHandler())
+            .register(GetDetailsHandler())
+            .register(ListTransactionsHandler())
+            .register(ListAccountsHandler())
+            .register(QueryTransactionsHandler())
+            .register(SpendingReportHandler())
+            .register(ResearcherProposalHandler())
         )
 
-        # two threads
-        with ThreadPoolExecutor(max_workers=3) as executor:
+        self.setup_metrics()
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
             executor.submit(self.start)
-            executor.submit(self.timer.start)
+            if stats_interval > 0:
+                executor.submit(self.print_stats, stats_interval)
+
+    def print_stats(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            print(f" [U] Requests statistics:\n{self.request_handler.report()}\n{self.database.render_cache.report()}")
+
+    def setup_metrics(self) -> None:
+        """
+            Counters updated by the requests, and metrics copied from the handler registry,
+            storage and caches when they are scraped
+        """
+        metrics = self.metrics = Metrics("university")
+        self.consumed = metrics.counter("messages_consumed", "Messages received from the queues.", ("queue",))
+        self.acked = metrics.counter("messages_acked", "Messages acknowledged.", ("queue",))
+        metrics.gauge("messages_unacked", "Messages received and not acknowledged yet.", ("queue",),
+            lambda: {(queue,): self.unacked(queue) for queue in self.prefetch_counts})
+        metrics.gauge("prefetch_utilisation", "Unacknowledged messages over the prefetch count of the consumer.", ("queue",),
+            lambda: {(queue,): self.unacked(queue) / prefetch for queue, prefetch in self.prefetch_counts.items()})
+        self.persist_duration = metrics.histogram("persist_duration_seconds", "Time spent persisting a commit.")
+        self.expired_accounts = metrics.counter("accounts_expired", "Accounts marked expired by the sweeper.")
+        metrics.gauge("accounts", "Research accounts of the database.", function=lambda: len(self.database.accounts))
+        if self.account_executor is not None:
+            metrics.gauge("account_queue_pending", "Requests waiting in the queues of the accounts.", function=self.account_executor.pending)
+
+        handler_duration = metrics.histogram("handler_duration_seconds", "Time spent in the handler of each action.", ("action",), ActionStats.BUCKETS)
+        handler_errors = metrics.counter("handler_errors", "Requests whose handler raised an exception.", ("action",))
+        handler_failures = metrics.counter("handler_failures", "Requests answered with a failed response.", ("action",))
+        persist_bytes = metrics.counter("persist_bytes", "Bytes written by the commits.")
+        # k = key of the stats of the cache, v = metric
+        dedup = {
+            "hits": metrics.counter("dedup_hits", "Redelivered requests answered from the request history."),
+            "misses": metrics.counter("dedup_misses", "New requests checked against the request history."),
+            "hit_rate": metrics.gauge("dedup_hit_ratio", "Share of the requests found in the request history."),
+            "size": metrics.gauge("dedup_entries", "Requests remembered in the request history.")
+        }
+        render_cache = {
+            "hits": metrics.counter("render_cache_hits", "Renders served from the render cache."),
+            "misses": metrics.counter("render_cache_misses", "Renders computed and added to the render cache."),
+            "evictions": metrics.counter("render_cache_evictions", "Renders evicted from the render cache."),
+            "hit_rate": metrics.gauge("render_cache_hit_ratio", "Share of the renders served from the render cache."),
+            "bytes": metrics.gauge("render_cache_bytes", "Memory of the renders in the render cache."),
+            "size": metrics.gauge("render_cache_entries", "Renders in the render cache.")
+        }
+
+        def collect() -> None:
+            with self.request_handler.lock:
+                actions = [(action, list(stats.buckets), stats.total_time, stats.errors, stats.failures) for action, stats in self.request_handler.stats.items()]
+            for action, buckets, total_time, errors, failures in actions:
+                handler_duration.set(buckets, total_time, action=action)
+                handler_errors.set(errors, action=action)
+                handler_failures.set(failures, action=action)
+
+            persist_bytes.set(self.storage.bytes_written)
+            for stats, mirrors in ((self.database.request_cache.stats(), dedup), (self.database.render_cache.stats(), render_cache)):
+                for key, metric in mirrors.items():
+                    metric.set(stats[key])
+
+        metrics.collector(collect)
+
+    def unacked(self, queue: str) -> int:
+        return self.consumed.get(queue=queue) - self.acked.get(queue=queue)
+
+    def commit(self) -> None:
+        """
+            Persist the changes applied so far, then publish them to the read lane
+        """
+        start = time.perf_counter()
+        self.storage.commit()
+        self.persist_duration.observe(time.perf_counter() - start)
+        self.replica.refresh()
 
     def start(self) -> None:        
         #Connect to RabbitMQ
-        connection = BlockingConnection(ConnectionParameters(host='localhost'))
-        channel = connection.channel()
+        self.connection = connect()
+        channel = self.connection.channel()
 
         """
             RPC Researcher actions setup
         """
 
         #Create queue for research proposal RPC
-        channel.queue_declare(queue='university_requests_queue')
+        channel.queue_declare(queue=self.queue_name)
 
-        #Fair dispatch, no more than one message to a worker at a time
-        #To avoid race condition
-        channel.basic_qos(prefetch_count=1)
+        if self.shard is not None:
+            # requests are forwarded by the router, mapping changes are sent back to it
+            channel.exchange_declare(exchange=SHARDS_EXCHANGE, exchange_type='direct')
+            channel.queue_bind(exchange=SHARDS_EXCHANGE, queue=self.queue_name, routing_key=shard_name(self.shard))
+            declare_directory(channel)
 
-        #Defining queue where callback function should receive messages from
-        channel.basic_consume(queue='university_requests_queue', on_message_callback=self.process_requests)
+        if self.account_executor is not None:
+            # requests on different accounts are processed in parallel
+            channel.basic_qos(prefetch_count=self.prefetch)
+            self.prefetch_counts[self.queue_name] = self.prefetch
+            channel.basic_consume(queue=self.queue_name, on_message_callback=self.process_requests_concurrently)
+        elif self.batch_size > 1:
+            # group commit, prefetch a whole batch
+            channel.basic_qos(prefetch_count=self.batch_size)
+            self.prefetch_counts[self.queue_name] = self.batch_size
+            channel.basic_consume(queue=self.queue_name, on_message_callback=self.process_requests_batch)
+        else:
+            #Fair dispatch, no more than one message to a worker at a time
+            #To avoid race condition
+            channel.basic_qos(prefetch_count=1)
+            self.prefetch_counts[self.queue_name] = 1
+
+            #Defining queue where callback function should receive messages from
+            channel.basic_consume(queue=self.queue_name, on_message_callback=self.process_requests)
+
+        if self.shard is None:
+            # reads have their own channel, they do not take the prefetch of the writes
+            # (the router forwards the reads of a sharded university with the writes)
+            read_channel = self.connection.channel()
+            read_channel.queue_declare(queue=READ_QUEUE)
+            read_channel.basic_qos(prefetch_count=self.read_prefetch)
+            self.prefetch_counts[READ_QUEUE] = self.read_prefetch
+            read_channel.basic_consume(queue=READ_QUEUE, on_message_callback=self.process_read_request)
 
-        print(' [U] Waiting for requests.')
+        if self.expiry_interval > 0:
+            self.sweep_expired()
+
+        print(f' [U] Waiting for requests on {self.queue_name}.')
 
         #await research proposals
         channel.start_consuming()
 
-    def process_requests(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
-        request = json.loads(body)
+    def sweep_expired(self) -> None:
+        """
+            Mark expired the accounts whose end date has passed, then schedule the next sweep.
+            Runs on the connection thread, only the accounts due are visited.
+        """
+        expired = self.database.expire_accounts(self.timer.get_ordinal())
+        if expired:
+            self.commit()
+            self.expired_accounts.inc(len(expired))
+            print(f" [U] {len(expired)} accounts expired: {', '.join(expired)}")
+        self.connection.call_later(self.expiry_interval, self.sweep_expired)
+
+    def start_span(self, props: BasicProperties, request: dict) -> Span:
+        return self.tracer.start_span(request.get("request_type", "request"), "SERVER", props.headers).annotate("receive")
+
+    def execute(self, request: dict, headers: dict = None, span: Span = None) -> tuple:
+        """
+            Apply a request to the database without persisting it.
+            Returns the response and whether the database has been changed.
+        """
         print(f" [U] Received '{request['request_type']}' request")
 
         #adjust timer if needed
-        self.timer.adjust_timer(request["timestamp"])
+        self.timer.sync(headers, request["timestamp"])
+        if span is not None:
+            span.annotate("handler start")
 
         # check if request has been already processed
         # correlation_id is the same as researcher->dunding_agency
-        if self.database.is_request_new(request["correlation_id"], request["request_type"]):
-            result: RequestResponse = self.request_handler.execute_request(request, self.database, self.timer)
+        previous = self.database.previous_result(request["correlation_id"], request["request_type"])
+        if previous is None:
+            result, changed = self.request_handler.execute_request(request, self.database, self.timer), True
+        else:
+            result, changed = previous, False
 
-            # save database to file
-            with open(self.DATA_FILE, 'wb') as f:
-                pickle.dump(self.database, f)
+        if span is not None:
+            span.annotate("handler end")
+        return result, changed
 
-            print(" [U] Changes Saved")
-        else:
-            result = self.database.get_request_metadata(request["correlation_id"], request["request_type"])
+    def record_directory_update(self, request: dict, result: RequestResponse, updates: list) -> None:
+        """
+            Add to updates the change of the researcher->account mapping made by the request, if any
+        """
+        if self.shard is None or result.status != RequestStatus.SUCCEEDED.value:
+            return
+        if request["request_type"] == Actions.CREATE_ACCOUNT.value:
+            updates.append((request["researcher"], request["project_id"]))
+        elif request["request_type"] == Actions.ADD_RESEARCHER.value:
+            updates.append((request["target_researcher"], result.account))
+        elif request["request_type"] == Actions.REMOVE_RESEARCHER.value:
+            updates.append((request["target_researcher"], None))
+
+    def publish_directory_updates(self, ch: BlockingChannel, updates: list) -> None:
+        """
+            Notify the router of the committed changes of the researcher->account mapping
+        """
+        for researcher, project_id in updates:
+            ch.basic_publish(
+                exchange=DIRECTORY_EXCHANGE,
+                routing_key='',
+                properties=BasicProperties(delivery_mode=PERSISTENT_DELIVERY_MODE),
+                body=json.dumps({"researcher": researcher, "project_id": project_id})
+            )
+
+    def send_response(self, ch: BlockingChannel, props: BasicProperties, result: RequestResponse, span: Span = None) -> None:
+        if span is not None:
+            span.tag("status", result.status).annotate("reply")
+        if isinstance(result, StreamedResponse):
+            self.send_stream(ch, props, result)
+            if span is not None:
+                span.finish()
+            return
 
-        # notify response
+        # notify response, encoded like the request
         ch.basic_publish(exchange='',
             routing_key=props.reply_to,
             properties=BasicProperties(
                 correlation_id = props.correlation_id,
-                content_type="application/json",
-                delivery_mode = PERSISTENT_DELIVERY_MODE
+                content_type=codec_for(props.content_type).content_type,
+                delivery_mode = PERSISTENT_DELIVERY_MODE,
+                headers=self.timer.headers()
                 ),
-            body=result.to_json()
+            body=result.encode(props.content_type)
         )
+        if span is not None:
+            span.finish()
+
+    def send_stream(self, ch: BlockingChannel, props: BasicProperties, result: StreamedResponse) -> None:
+        """
+            Send the response as a sequence of messages with the same correlation id,
+            the "chunk" header numbers them and "last" marks the end of the stream
+        """
+        for chunk, (body, last) in enumerate(result.encode_chunks(props.content_type)):
+            ch.basic_publish(exchange='',
+                routing_key=props.reply_to,
+                properties=BasicProperties(
+                    correlation_id = props.correlation_id,
+                    content_type=codec_for(props.content_type).content_type,
+                    headers={"chunk": chunk, "last": last, **self.timer.headers()}
+                    ),
+                body=body
+            )
+
+    def process_requests(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        self.consumed.inc(queue=self.queue_name)
+        request = decode(body, props.content_type)
+        if self.forward_read(ch, method, props, request):
+            return
+        span = self.start_span(props, request)
+        result, changed = self.execute(request, props.headers, span)
+
+        if changed:
+            # save changes
+            self.commit()
+            span.annotate("persist")
+
+            print(" [U] Changes Saved")
+            updates = []
+            self.record_directory_update(request, result, updates)
+            self.publish_directory_updates(ch, updates)
+
+        self.send_response(ch, props, result, span)
 
         ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.acked.inc(queue=self.queue_name)
+
+    def process_requests_batch(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        self.consumed.inc(queue=self.queue_name)
+        request = decode(body, props.content_type)
+        if self.forward_read(ch, method, props, request):
+            return
+        span = self.start_span(props, request)
+        result, changed = self.execute(request, props.headers, span)
+        if changed:
+            self.record_directory_update(request, result, self.directory_updates)
+        self.batch.append((method.delivery_tag, props, result, span))
+
+        if len(self.batch) >= self.batch_size:
+            self.commit_batch(ch)
+        elif self.batch_timer is None:
+            # commit whatever has been received when the window closes
+            self.batch_timer = self.connection.call_later(self.batch_wait, lambda: self.commit_batch(ch))
+
+    def commit_batch(self, ch: BlockingChannel) -> None:
+        """
+            Persist every request of the batch with a single commit, then send the responses and ack them
+        """
+        if self.batch_timer is not None:
+            self.connection.remove_timeout(self.batch_timer)
+            self.batch_timer = None
+        if not self.batch:
+            return
+
+        # save changes
+        self.commit()
+        print(f" [U] Changes Saved ({len(self.batch)} requests)")
+        self.publish_directory_updates(ch, self.directory_updates)
+        self.directory_updates = []
+
+        for delivery_tag, props, result, span in self.batch:
+            span.annotate("persist").tag("batch", len(self.batch))
+            self.send_response(ch, props, result, span)
+
+        # deliveries are acknowledged in order, ack the whole batch at once
+        ch.basic_ack(delivery_tag=self.batch[-1][0], multiple=True)
+        self.acked.inc(len(self.batch), queue=self.queue_name)
+        self.batch = []
+
+    def account_key(self, request: dict) -> str:
+        """
+            Returns the account targeted by the request, requests with the same key are processed in order
+        """
+        if request["request_type"] in [Actions.CREATE_ACCOUNT.value, Actions.NOTIFY_RESEARCHER_PROPOSAL.value]:
+            return request["project_id"]
+
+        account = self.database.get_account(request["researcher"])
+        return request["researcher"] if account is None else account.project_id
+
+    def process_requests_concurrently(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        self.consumed.inc(queue=self.queue_name)
+        request = decode(body, props.content_type)
+        if self.forward_read(ch, method, props, request):
+            return
+        span = self.start_span(props, request)
+        self.account_executor.submit(self.account_key(request), self.process_request_task, ch, method.delivery_tag, props, request, span)
+
+    def process_request_task(self, ch: BlockingChannel, delivery_tag: int, props: BasicProperties, request: dict, span: Span) -> None:
+        """
+            Runs on the worker pool, the channel can only be used from the connection thread
+        """
+        updates = []
+        try:
+            result, changed = self.execute(request, props.headers, span)
+            if changed:
+                # save changes
+                self.commit()
+                span.annotate("persist")
+                self.record_directory_update(request, result, updates)
+        except Exception as e:
+            # the sender waits for a reply, it is answered with the failure
+            span.tag("error", e)
+            result = self.failed_response(request, e)
+
+        def reply() -> None:
+            self.publish_directory_updates(ch, updates)
+            self.send_response(ch, props, result, span)
+            ch.basic_ack(delivery_tag=delivery_tag)
+            self.acked.inc(queue=self.queue_name)
+
+        self.connection.add_callback_threadsafe(reply)
+
+    def failed_response(self, request: dict, error: Exception) -> RequestResponse:
+        print(f" [U] Request failed: {error}")
+        return RequestResponse(
+            RequestStatus.FAILED.value,
+            f"Request '{request.get('request_type')}' failed: {error}",
+            self.timer.get_time()
+        )
+
+    def process_read_request(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        self.consumed.inc(queue=READ_QUEUE)
+        request = decode(body, props.content_type)
+        self.read_executor.submit(self.serve_read, ch, method.delivery_tag, props, request, self.start_span(props, request))
+
+    def forward_read(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, request: dict) -> bool:
+        """
+            Hand a read received with the writes over to the read lane, returns false if the request is a write.
+            The read is acked at once: writes may be acked in bulk with a later delivery tag.
+        """
+        if request.get("request_type") not in READ_ONLY_ACTIONS:
+            return False
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.acked.inc(queue=self.queue_name)
+        self.read_executor.submit(self.serve_read, ch, None, props, request, self.start_span(props, request))
+        return True
+
+    def serve_read(self, ch: BlockingChannel, delivery_tag: int, props: BasicProperties, request: dict, span: Span) -> None:
+        """
+            Runs on the read workers: the request is served from the last snapshot, without
+            recording or persisting anything. The channel can only be used from the connection thread.
+        """
+        print(f" [U] Received '{request['request_type']}' request")
+        self.timer.sync(props.headers, request["timestamp"])
+        span.annotate("handler start").tag("lane", "read")
+        try:
+            result = self.request_handler.execute_request(request, self.replica.current, self.timer)
+            span.annotate("handler end")
+        except Exception as e:
+            # reads handed over by forward_read are already acked, the reply is the only trace of the failure
+            span.tag("error", e)
+            result = self.failed_response(request, e)
+
+        def reply() -> None:
+            self.send_response(ch, props, result, span)
+            if delivery_tag is not None:
+                ch.basic_ack(delivery_tag=delivery_tag)
+                self.acked.inc(queue=READ_QUEUE)
+
+        self.connection.add_callback_threadsafe(reply)
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--storage", choices=["pickle", "wal"], default="pickle", help="persistence mode of the database")
+    parser.add_argument("--snapshot-interval", type=int, default=10000, help="log records between two snapshots (wal storage)")
+    parser.add_argument("--batch-size", type=int, default=1, help="requests persisted with a single commit (group commit)")
+    parser.add_argument("--batch-wait", type=float, default=0.01, help="maximum seconds a request waits for its batch to be committed")
+    parser.add_argument("--dedup-capacity", type=int, default=100000, help="processed requests remembered to detect redeliveries")
+    parser.add_argument("--dedup-ttl", type=float, default=None, help="seconds a processed request is remembered")
+    parser.add_argument("--shard", type=int, default=None, help="run as the worker of this shard (requires university_router.py)")
+    parser.add_argument("--workers", type=int, default=0, help="process requests on different accounts in parallel with this many workers")
+    parser.add_argument("--prefetch", type=int, default=64, help="requests dispatched to the workers at the same time")
+    parser.add_argument("--read-workers", type=int, default=2, help="threads serving the read-only requests from a snapshot")
+    parser.add_argument("--read-prefetch", type=int, default=64, help="read-only requests received at the same time")
+    parser.add_argument("--render-cache-mb", type=float, default=64, help="memory of the cached renders of details and transaction pages")
+    parser.add_argument("--expiry-interval", type=float, default=5.0, help="seconds between two sweeps of the expired accounts, 0 to disable")
+    parser.add_argument("--trace", dest="trace_file", default=None, help="append the spans of the requests to this file (see trace_report.py)")
+    parser.add_argument("--trace-sample", type=float, default=1.0, help="fraction of the requests traced when they start a trace")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve the metrics on this local port (OpenMetrics text format)")
+    parser.add_argument("--stats-interval", type=float, default=0, help="print the statistics of each action every N seconds")
+    return parser
 
 if __name__ == '__main__':
-    university = University()
+    args = argument_parser().parse_args()
+
+    university = University(
+        storage=args.storage,
+        snapshot_interval=args.snapshot_interval,
+        batch_size=args.batch_size,
+        batch_wait=args.batch_wait,
+        dedup_capacity=args.dedup_capacity,
+        dedup_ttl=args.dedup_ttl,
+        shard=args.shard,
+        workers=args.workers,
+        prefetch=args.prefetch,
+        stats_interval=args.stats_interval,
+        read_workers=args.read_workers,
+        read_prefetch=args.read_prefetch,
+        render_cache_mb=args.render_cache_mb,
+        expiry_interval=args.expiry_interval,
+        trace_file=args.trace_file,
+        trace_sample=args.trace_sample,
+        metrics_port=args.metrics_port
+    )
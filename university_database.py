@@ -1,199 +1,353 @@
 from datetime import date
 from request_status import RequestStatus
-from request_response import RequestResponse
+from request_response import RequestResponse, StreamedResponse
 from timer import Timer
+from idempotency_cache import IdempotencyCache
+from transaction_ledger import TransactionLedger
+from render_cache import RenderCache
+from account_index import AccountIndex
+from spend_aggregates import SpendAggregates
+from codec import ordinal_date
+from threading import Lock, RLock
+from contextlib import contextmanager, ExitStack
+from abc import ABC, abstractmethod
+import time
 
 class ResearchAccount(object):
     budget: int
     leading_researcher: str
     users: list
     # withdraw transactions details
-    transactions: dict
-    # number of withdraw transactions
-    number_of_transactions: int
+    transactions: TransactionLedger
     title: str
     description: str
     project_id: str
     end_date: date
+    # bumped by every change of the account, identifies its renders in the render cache
+    version: int
+    # set by the expiry sweeper once the end date has passed
+    expired: bool
+    # serializes the operations on the account
+    lock: RLock
 
     def __init__(self, title: str, description: str, project_id: str, budget: int, leading_researcher: str, end_date: date) -> None:
         self.budget = budget
         self.leading_researcher = leading_researcher
         self.users = []
-        self.transactions = {}
-        self.number_of_transactions = 1
+        self.transactions = TransactionLedger()
         self.end_date = end_date
         self.title = title
         self.description = description
         self.project_id = project_id
-    
-class UniversityDatabase(object):
+        self.version = 0
+        self.expired = False
+        self.lock = RLock()
 
-    accounts: dict              #account informations (key: research account name)
-    researchers: dict           #mapping researcher-research_account (name)
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop("lock", None)
+        return state
 
-    # record last 10 requests made to the university
-    # k= int (1 to 10), v = touple (correlation_id, metadata)
-    request_history = dict
-    number_of_requests: int
+    def __setstate__(self, state: dict) -> None:
+        # accounts saved before the ledger stored the transactions in a dict
+        if isinstance(state["transactions"], dict):
+            state["transactions"] = TransactionLedger.from_dict(state["transactions"])
+            state.pop("number_of_transactions", None)
+        state.setdefault("version", 0)
+        state.setdefault("expired", False)
+        self.__dict__.update(state)
+        self.lock = RLock()
+    
+class AccountReader(ABC):
+    """
+        Read-only operations on the accounts, shared by the database and its read snapshots.
+        Subclasses provide get_account(researcher), the accounts and their index.
 
-    def __init__(self) -> None:
-        self.accounts = {}
-        self.researchers = {}
-        self.requests_history = {}
-        self.number_of_requests = 1
+        Rendered details, pages of transactions and query results are memoized in the render cache by
+        account version: polling an account that has not changed costs a lookup.
+    """
 
-    def create_research_account(self, request: dict, end_date: date, timer: Timer) -> RequestResponse:
-        # checking if researcher is member of another account or if another project with the same id exists is done in self.check_researcher_proposal()
-
-        account = ResearchAccount(
-            request["title"],
-            request["description"],
-            request["project_id"],
-            request["budget"], 
-            request["researcher"], 
-            end_date
-        )
-        self.accounts[request["project_id"]] = account
-        self.researchers[request["researcher"]] = request["project_id"]
+    render_cache: RenderCache
+    # end date and lead researcher indexes of the accounts
+    index: AccountIndex
 
-        print(f" [U] Account '{request['project_id']}' created!")
-        return RequestResponse(
-            RequestStatus.SUCCEEDED.value, 
-            f"Account '{request['project_id']}' has been created",
-            timer.get_time(),
-            action=request["request_type"]
-        )
+    @abstractmethod
+    def get_account(self, researcher: str) -> ResearchAccount:
+        pass
 
-    def add_researcher(self, lead_researcher: str, researcher: str, timer: Timer) -> RequestResponse:
-        #check if the requesting user is a lead resercher of member of an account
-        if lead_researcher not in self.researchers.keys() or self.researchers[lead_researcher] == None:
+    def access_details(self, lead_researcher: str, timer: Timer) -> RequestResponse:
+        """
+            Returns remaining budget, end date, users
+        """
+        #check if the requesting user is a lead resercher of an account
+        account: ResearchAccount = self.get_account(lead_researcher)
+        if account is None:
             return RequestResponse(
                 RequestStatus.FAILED.value, 
                 f"{lead_researcher} is not a Lead Researcher",
                 timer.get_time()
             )
-        
-        # check if researcher is already registered with another account
-        if researcher in self.researchers.keys() and self.researchers[researcher] != None :
-            return RequestResponse(
-                RequestStatus.FAILED.value, 
-                f"{researcher} has already access to account '{self.researchers[researcher]}'",
-                timer.get_time()
+        account_name: str = account.project_id
+
+        # operations on the same account are serialized
+        with account.lock:
+            message = self.render_cache.render(
+                ("details", account_name, account.version),
+                lambda: self._render_details(account)
             )
-        
-        #retrieve account name given lead researcher
-        account_name: str = self.researchers[lead_researcher]
-        #retrieve account given project name
-        account: ResearchAccount = self.accounts[account_name]
 
-        if researcher in account.users:
             return RequestResponse(
-                RequestStatus.FAILED.value, 
-                f"{researcher} has already access to account '{account_name}'",
+                RequestStatus.SUCCEEDED.value,
+                message,
                 timer.get_time()
             )
-        else:
-            #update list users
-            account.users.append(researcher)
-            #update researcher project
-            self.researchers[researcher] = account.project_id
 
-            return RequestResponse(
-                RequestStatus.SUCCEEDED.value, 
-                f"{researcher} has been added to account '{account_name}'",
-                timer.get_time(),
-                account_name
-            )
+    def _render_details(self, account: ResearchAccount) -> str:
+        return (f"""\t\t------------------------------------------------------\n\
+        \t  PROJECT ID:         {account.project_id}\n\
+        \t  TITLE:              {account.title}\n\
+        \t  DESCRIPTION:        {account.description}\n\
+        \t  LEAD RESEARCHER:    {account.leading_researcher}\n\
+        \t  BUDGET(REMAINING):  {account.budget} £\n\
+        \t  USERS:              {account.users}\n\
+        \t  END DATE:           {account.end_date.strftime('%d-%m-%Y')}\n\
+        \t------------------------------------------------------""")
 
-    def remove_researcher(self, lead_researcher: str, researcher: str, timer: Timer) -> RequestResponse:        
+    def spending_report(self, lead_researcher: str, timer: Timer) -> RequestResponse:
+        """
+            Returns spend per researcher, spend of the last days, remaining budget versus time left
+            and projected exhaustion date, read from the running aggregates of the ledger in O(1)
+        """
         #check if the requesting user is a lead resercher of member of an account
-        if lead_researcher not in self.researchers.keys() or self.researchers[lead_researcher] == None:
+        account: ResearchAccount = self.get_account(lead_researcher)
+        if account is None:
             return RequestResponse(
-                RequestStatus.FAILED.value, 
+                RequestStatus.FAILED.value,
                 f"{lead_researcher} is not a Lead Researcher",
                 timer.get_time()
             )
-        
-        #retrieve account name given lead researcher
-        account_name: str = self.researchers[lead_researcher]
-        #retrieve account given project name
-        account: ResearchAccount = self.accounts[account_name]
+        today = timer.get_ordinal()
 
-        if researcher in account.users:
-            account.users.remove(researcher)
-            self.researchers[researcher] = None
-            
-            return RequestResponse(
-                RequestStatus.SUCCEEDED.value, 
-                f"{researcher} has been removed from account '{account_name}'",
-                timer.get_time(),
-                account_name
+        # operations on the same account are serialized
+        with account.lock:
+            message = self.render_cache.render(
+                ("report", account.project_id, account.version, today),
+                lambda: self._render_report(account, account.transactions.aggregates, today)
             )
-        else:
+
             return RequestResponse(
-                RequestStatus.FAILED.value, 
-                f"{researcher} does not have access to account '{account_name}'",
+                RequestStatus.SUCCEEDED.value,
+                message,
                 timer.get_time()
             )
 
-    def access_details(self, lead_researcher: str, timer: Timer) -> RequestResponse:
+    def _render_report(self, account: ResearchAccount, aggregates: SpendAggregates, today: int) -> str:
+        days_left = max(account.end_date.toordinal() - today, 0)
+        last_week = sum(aggregates.by_day.get(day, 0) for day in range(today - 6, today + 1))
+        exhaustion = aggregates.exhaustion_day(account.budget, today)
+        if exhaustion is None:
+            projection = "nothing spent yet"
+        else:
+            projection = f"{ordinal_date(exhaustion)} ({'before' if exhaustion < account.end_date.toordinal() else 'after'} the end date)"
+        researchers = "".join(
+            f"\t\t    {researcher:15} {amount:10} £\n"
+            for researcher, amount in sorted(aggregates.by_researcher.items(), key=lambda item: -item[1])
+        )
+        return (f"""\t\t------------------------------------------------------\n\
+        \t  PROJECT ID:           {account.project_id}\n\
+        \t  BUDGET(REMAINING):    {account.budget} £\n\
+        \t  SPENT:                {aggregates.total} £ in {aggregates.count} withdrawals\n\
+        \t  END DATE:             {account.end_date.strftime('%d-%m-%Y')} ({days_left} days left, {account.budget / max(days_left, 1):.2f} £ per day)\n\
+        \t  SPENT TODAY:          {aggregates.by_day.get(today, 0)} £\n\
+        \t  SPENT LAST 7 DAYS:    {last_week} £\n\
+        \t  DAILY RATE:           {aggregates.daily_rate(today):.2f} £\n\
+        \t  PROJECTED EXHAUSTION: {projection}\n\
+        \t  SPENT PER RESEARCHER:\n{researchers}\
+        \t------------------------------------------------------""")
+
+    def list_transactions(self, lead_researcher: str, timer: Timer, offset: int = 0, limit: int = None, stream: bool = False, chunk_size: int = 100) -> RequestResponse:
         """
-            Returns remaining budget, end date, users
+            List the transactions of the account from `offset` (the id of the last transaction
+            already seen), at most `limit` of them. The cursor of the response is the offset of
+            the next page, None once the listing is complete (a limit of 0 is an empty, final page).
+
+            With `stream` the page is returned as a StreamedResponse, rendered `chunk_size`
+            transactions at a time while it is sent. Streams are not cached.
         """
-        #check if the requesting user is a lead resercher of an account
-        if lead_researcher not in self.researchers.keys() or self.researchers[lead_researcher] == None:
+        #check if the requesting user is a lead resercher of member of an account
+        account: ResearchAccount = self.get_account(lead_researcher)
+        if account is None:
             return RequestResponse(
                 RequestStatus.FAILED.value, 
                 f"{lead_researcher} is not a Lead Researcher",
                 timer.get_time()
             )
-        
-        #retrieve account name given lead researcher
-        account_name: str = self.researchers[lead_researcher]
-        #retrieve account given project name
-        account: ResearchAccount = self.accounts[account_name]
+        account_name: str = account.project_id
 
+        # operations on the same account are serialized
+        with account.lock:
+            # the ledger is append-only: the rows up to its current length never change
+            total = len(account.transactions)
+            version = account.version
+        offset = min(max(offset, 0), total)
+        end = total if limit is None else min(offset + max(limit, 0), total)
+        cursor = end if offset < end < total else None
 
-        message = (f"""\t\t------------------------------------------------------\n\
-        \t  PROJECT ID:         {account.project_id}\n\
-        \t  TITLE:              {account.title}\n\
-        \t  DESCRIPTION:        {account.description}\n\
-        \t  LEAD RESEARCHER:    {account.leading_researcher}\n\
-        \t  BUDGET(REMAINING):  {account.budget} £\n\
-        \t  USERS:              {account.users}\n\
-        \t  END DATE:           {account.end_date.strftime('%d-%m-%Y')}\n\
-        \t------------------------------------------------------""")
+        if stream:
+            return StreamedResponse(
+                RequestStatus.SUCCEEDED.value,
+                self._render_transactions(account, account_name, offset, end, total, cursor, chunk_size),
+                timer.get_time()
+            )
 
+        message = self.render_cache.render(
+            ("transactions", account_name, version, offset, end),
+            lambda: "".join(self._render_transactions(account, account_name, offset, end, total, cursor, end - offset))
+        )
         return RequestResponse(
             RequestStatus.SUCCEEDED.value,
             message,
-            timer.get_time()
+            timer.get_time(),
+            cursor=cursor
         )
 
-    def list_transactions(self, lead_researcher: str, timer: Timer) -> RequestResponse:       
+    def _render_transactions(self, account: ResearchAccount, account_name: str, start: int, end: int, total: int, cursor: int, chunk_size: int):
+        """
+            Yields the listing of the transactions [start, end) of `total` in chunks of `chunk_size` rows,
+            the first chunk carries the header and the last one the footer
+        """
+        chunk_size = max(chunk_size, 1)
+        message_list = [f"""\t\t------------------------------------------------------\n\
+        \t{account_name} TRANSACTIONS\n\n\
+        \t{'ID':4} | {'RESEARCHER':15} | {'AMOUNT':6} | {'DATE':15} | {'STATUS':10} | {'BUDGET':10}\n"""]
+
+        transactions: TransactionLedger = account.transactions
+        for index in range(start, end):
+            message_list.append(self._render_row(transactions.row(index)))
+            if (index - start + 1) % chunk_size == 0 and index + 1 < end:
+                yield "".join(message_list)
+                message_list = []
+
+        if cursor is not None:
+            message_list.append(f"\t\t{end - start} of {total} transactions, more after {cursor}\n")
+        message_list.append("\t\t------------------------------------------------------")
+        yield "".join(message_list)
+
+    def _render_row(self, transaction: dict) -> str:
+        date_transaction = transaction['date']
+        return f"""\t\t{transaction['id']: 4} | {transaction['researcher']:15} | {transaction['amount']:6} | {date_transaction:15} | {transaction['status']:10} | {transaction['budget']:10}\n"""
+
+    def query_transactions(self, lead_researcher: str, timer: Timer, researcher: str = None, first_day: date = None, last_day: date = None,
+                           min_amount: int = None, max_amount: int = None, offset: int = 0, limit: int = None) -> RequestResponse:
+        """
+            List the transactions of the account made by `researcher`, between `first_day` and
+            `last_day`, with an amount between `min_amount` and `max_amount` (every filter is optional).
+            Matches are found with the indexes of the ledger in O(log n + k).
+
+            Like list_transactions, at most `limit` matches after the transaction id `offset` are
+            returned and the cursor is the id of the last one, None once the query is complete.
+            A limit of 0 returns an empty, final page.
+        """
         #check if the requesting user is a lead resercher of member of an account
-        if lead_researcher not in self.researchers.keys() or self.researchers[lead_researcher] == None:
+        account: ResearchAccount = self.get_account(lead_researcher)
+        if account is None:
             return RequestResponse(
-                RequestStatus.FAILED.value, 
+                RequestStatus.FAILED.value,
                 f"{lead_researcher} is not a Lead Researcher",
                 timer.get_time()
             )
-        
-        #retrieve account name given lead researcher
-        account_name: str = self.researchers[lead_researcher]
-        #retrieve account given project name
-        account: ResearchAccount = self.accounts[account_name]
-        
-        message_list = []
-        message_list.append(f"""\t\t------------------------------------------------------\n\
+        account_name: str = account.project_id
+
+        with account.lock:
+            version = account.version
+            filters = {
+                "researcher": researcher,
+                "first_day": None if first_day is None else first_day.toordinal(),
+                "last_day": None if last_day is None else last_day.toordinal(),
+                "min_amount": min_amount,
+                "max_amount": max_amount,
+                "after": max(offset, 0),
+                # rows appended after the lock is released are not searched
+                "count": len(account.transactions)
+            }
+        limit = None if limit is None else max(limit, 0)
+
+        def render() -> tuple:
+            transactions: TransactionLedger = account.transactions
+            matches = transactions.find(**filters)
+            message_list = [f"""\t\t------------------------------------------------------\n\
         \t{account_name} TRANSACTIONS\n\n\
-        \t{'ID':4} | {'RESEARCHER':15} | {'AMOUNT':6} | {'DATE':15} | {'STATUS':10} | {'BUDGET':10}\n""")
+        \t{'ID':4} | {'RESEARCHER':15} | {'AMOUNT':6} | {'DATE':15} | {'STATUS':10} | {'BUDGET':10}\n"""]
+            found, cursor = 0, None
+            for index in matches:
+                if limit is not None and found == limit:
+                    # one more match: the next page starts after the last transaction listed
+                    if found:
+                        cursor = last_index + 1
+                    break
+                message_list.append(self._render_row(transactions.row(index)))
+                found += 1
+                last_index = index
+            if cursor is not None:
+                message_list.append(f"\t\t{found} matching transactions, more after {cursor}\n")
+            else:
+                message_list.append(f"\t\t{found} matching transactions\n")
+            message_list.append("\t\t------------------------------------------------------")
+            return "".join(message_list), cursor
+
+        message, cursor = self.render_cache.render(
+            ("query", account_name, version, *filters.values(), limit),
+            render
+        )
+        return RequestResponse(
+            RequestStatus.SUCCEEDED.value,
+            message,
+            timer.get_time(),
+            cursor=cursor
+        )
+
+    def list_accounts(self, researcher: str, timer: Timer, expiring_from: date = None, expiring_to: date = None, lead: str = None) -> RequestResponse:
+        """
+            List the accounts ending between `expiring_from` and `expiring_to`, the accounts led by
+            `lead` (all of them, or the ones in the range) or by default the accounts still active
+            today, ordered by end date.
+            The accounts are found with the index in O(log n + k).
+        """
+        today = timer.get_ordinal()
+        if expiring_from is not None or expiring_to is not None:
+            first_day = expiring_from.toordinal() if expiring_from is not None else 1
+            last_day = expiring_to.toordinal() if expiring_to is not None else date.max.toordinal()
+            if first_day > last_day:
+                return RequestResponse(
+                    RequestStatus.FAILED.value,
+                    f"{ordinal_date(first_day)} is after {ordinal_date(last_day)}",
+                    timer.get_time()
+                )
+        else:
+            first_day, last_day = 1, date.max.toordinal()
 
-        for id, transaction in account.transactions.items():
-            date_transaction = transaction['date']
-            message_list.append(f"""\t\t{id: 4} | {transaction['researcher']:15} | {transaction['amount']:6} | {date_transaction:15} | {transaction['status']:10} | {transaction['budget']:10}\n""")
+        if lead is not None:
+            # few accounts per researcher, filtered by end date under the lock of the index
+            project_ids = self.index.led_by(lead, first_day, last_day)
+        elif expiring_from is not None or expiring_to is not None:
+            project_ids = self.index.ending_between(first_day, last_day)
+        else:
+            project_ids = self.index.active_on(today)
 
+        message_list = [f"""\t\t------------------------------------------------------\n\
+        \tACCOUNTS\n\n\
+        \t{'PROJECT ID':15} | {'LEAD':15} | {'BUDGET':10} | {'END DATE':10} | {'STATUS':8}\n"""]
+        count = 0
+        for project_id in project_ids:
+            account: ResearchAccount = self.accounts.get(project_id)
+            # created after this snapshot or moved to another shard
+            if account is None:
+                continue
+            with account.lock:
+                status = "EXPIRED" if account.expired or account.end_date.toordinal() < today else "ACTIVE"
+                message_list.append(f"""\t\t{account.project_id:15} | {account.leading_researcher:15} | {account.budget:10} | {account.end_date.strftime('%d-%m-%Y'):10} | {status:8}\n""")
+            count += 1
+        message_list.append(f"\t\t{count} accounts\n")
         message_list.append("\t\t------------------------------------------------------")
 
         return RequestResponse(
@@ -202,112 +356,382 @@ class UniversityDatabase(object):
             timer.get_time()
         )
 
-    def withdraw_funds(self, researcher: str, amount: int, timer: Timer) -> RequestResponse:
-        #check if researcher is registered with an account
-        if researcher not in self.researchers.keys() or self.researchers[researcher] == None:
-            return RequestResponse(
-                RequestStatus.FAILED.value, 
-                f"{researcher} has not access to any accounts",
-                timer.get_time()
+class UniversityDatabase(AccountReader):
+
+    accounts: dict              #account informations (key: research account name)
+    researchers: dict           #mapping researcher-research_account (name)
+
+    # record the requests already processed by the university
+    # k = (correlation_id, request_type), v = response
+    request_cache: IdempotencyCache
+
+    # receives every mutation as a tuple (operation, *args), set by the write-ahead log storage
+    journal = None
+
+    # guards accounts, researchers and request_cache
+    # lock order: database lock first, then account lock
+    lock: RLock
+
+    # end date and lead researcher indexes, not saved: rebuilt from the accounts when loaded
+    index: AccountIndex
+
+    # accounts changed since the last read snapshot, and whether the researchers mapping changed
+    changed_accounts: set
+    researchers_changed: bool
+    changes_lock: Lock
+
+    def __init__(self, dedup_capacity: int = 100000, dedup_ttl: float = None) -> None:
+        self.accounts = {}
+        self.researchers = {}
+        self.request_cache = IdempotencyCache(dedup_capacity, dedup_ttl)
+        self.render_cache = RenderCache()
+        self.index = AccountIndex()
+        self.lock = RLock()
+        self._reset_changes()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop("journal", None)
+        state.pop("lock", None)
+        state.pop("changed_accounts", None)
+        state.pop("researchers_changed", None)
+        state.pop("changes_lock", None)
+        state.pop("render_cache", None)
+        state.pop("index", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # databases saved before the idempotency cache kept the last 10 requests in a ring
+        if "request_cache" not in state:
+            state["request_cache"] = IdempotencyCache()
+            for correlation_id, result, request_type in state.pop("requests_history", {}).values():
+                state["request_cache"].put((correlation_id, request_type), result)
+            state.pop("number_of_requests", None)
+        self.__dict__.update(state)
+        self.lock = RLock()
+        self.render_cache = RenderCache()
+        self.index = AccountIndex.from_accounts(self.accounts)
+        self._reset_changes()
+
+    def _reset_changes(self) -> None:
+        self.changed_accounts = set()
+        self.researchers_changed = False
+        self.changes_lock = Lock()
+
+    def _changed(self, project_id: str, researchers: bool = False) -> None:
+        with self.changes_lock:
+            self.changed_accounts.add(project_id)
+            self.researchers_changed = self.researchers_changed or researchers
+
+    def take_changes(self) -> tuple:
+        """
+            Returns the accounts changed and whether the researchers mapping changed since the last call
+        """
+        with self.changes_lock:
+            changes = (self.changed_accounts, self.researchers_changed)
+            self.changed_accounts = set()
+            self.researchers_changed = False
+            return changes
+
+    @contextmanager
+    def exclusive(self):
+        """
+            Block every operation on the database, e.g. while it is pickled
+        """
+        with self.lock, ExitStack() as stack:
+            for account in list(self.accounts.values()):
+                stack.enter_context(account.lock)
+            yield self
+
+    def get_account(self, researcher: str) -> ResearchAccount:
+        """
+            Returns the account the researcher has access to, None if there is not
+        """
+        with self.lock:
+            account_name = self.researchers.get(researcher)
+            return None if account_name is None else self.accounts[account_name]
+
+    def _log(self, *record) -> None:
+        if self.journal is not None:
+            self.journal(record)
+
+    def apply(self, record: tuple) -> None:
+        """
+            Re-apply a mutation read from the write-ahead log
+        """
+        operation, *args = record
+        getattr(self, f"_apply_{operation}")(*args)
+
+    def _apply_create_account(self, title: str, description: str, project_id: str, budget: int, researcher: str, end_date: date) -> None:
+        self.accounts[project_id] = ResearchAccount(title, description, project_id, budget, researcher, end_date)
+        self.researchers[researcher] = project_id
+        self.index.add(self.accounts[project_id])
+        self._changed(project_id, researchers=True)
+
+    def _apply_add_researcher(self, project_id: str, researcher: str) -> None:
+        account: ResearchAccount = self.accounts[project_id]
+        with account.lock:
+            account.users.append(researcher)
+            account.version += 1
+        self.researchers[researcher] = project_id
+        self._changed(project_id, researchers=True)
+
+    def _apply_remove_researcher(self, project_id: str, researcher: str) -> None:
+        account: ResearchAccount = self.accounts[project_id]
+        with account.lock:
+            account.users.remove(researcher)
+            account.version += 1
+        # the researcher may already have joined another account when the log is replayed
+        if self.researchers.get(researcher) == project_id:
+            self.researchers[researcher] = None
+        self._changed(project_id, researchers=True)
+
+    def _apply_withdraw(self, project_id: str, researcher: str, day: int, amount: int, budget: int) -> None:
+        account: ResearchAccount = self.accounts[project_id]
+        account.budget = budget
+        account.transactions.append(researcher, day, amount, budget)
+        account.version += 1
+        self._changed(project_id)
+
+    def _apply_import_account(self, account: ResearchAccount) -> None:
+        self.accounts[account.project_id] = account
+        for researcher in [account.leading_researcher] + account.users:
+            self.researchers[researcher] = account.project_id
+        self.index.add(account)
+        self._changed(account.project_id, researchers=True)
+
+    def _apply_drop_account(self, project_id: str) -> None:
+        account: ResearchAccount = self.accounts.pop(project_id)
+        self.index.remove(account)
+        for researcher in [account.leading_researcher] + account.users:
+            if self.researchers.get(researcher) == project_id:
+                del self.researchers[researcher]
+        self._changed(project_id, researchers=True)
+
+    def _apply_expire_account(self, project_id: str) -> None:
+        account: ResearchAccount = self.accounts[project_id]
+        with account.lock:
+            account.expired = True
+            account.version += 1
+        self._changed(project_id)
+
+    def expire_accounts(self, day: int) -> list:
+        """
+            Mark expired the accounts whose end date is before the day (ordinal), returns their project ids
+        """
+        expired = []
+        with self.lock:
+            for project_id in self.index.due(day):
+                account: ResearchAccount = self.accounts.get(project_id)
+                if account is None or account.expired:
+                    continue
+                self._apply_expire_account(project_id)
+                self._log("expire_account", project_id)
+                expired.append(project_id)
+        return expired
+
+    def export_account(self, project_id: str) -> ResearchAccount:
+        """
+            Remove an account and its researchers, used to move the account to another shard
+        """
+        with self.lock:
+            account: ResearchAccount = self.accounts[project_id]
+            self._apply_drop_account(project_id)
+            self._log("drop_account", project_id)
+            return account
+
+    def import_account(self, account: ResearchAccount) -> None:
+        with self.lock:
+            self._apply_import_account(account)
+            self._log("import_account", account)
+
+    def _apply_request_result(self, correlation_id: str, result: RequestResponse, request_type: str, recorded_at: float = None) -> None:
+        self.request_cache.put((correlation_id, request_type), result, recorded_at)
+
+    def create_research_account(self, request: dict, end_date: date, timer: Timer) -> RequestResponse:
+        with self.lock:
+            # checking if researcher is member of another account or if another project with the same id exists is done in self.check_researcher_proposal()
+
+            record = (
+                request["title"],
+                request["description"],
+                request["project_id"],
+                request["budget"], 
+                request["researcher"], 
+                end_date
             )
-        
-        #retrieve account name given lead researcher
-        account_name: str = self.researchers[researcher]
-        #retrieve account given project name
-        account: ResearchAccount = self.accounts[account_name]
+            self._apply_create_account(*record)
+            self._log("create_account", *record)
 
-        # check that the user is either lead or member of the account
-        if researcher not in account.users and researcher != account.leading_researcher:
+            print(f" [U] Account '{request['project_id']}' created!")
             return RequestResponse(
-                RequestStatus.FAILED.value, 
-                f"{researcher} has not access to account '{account_name}'",
-                timer.get_time()
+                RequestStatus.SUCCEEDED.value, 
+                f"Account '{request['project_id']}' has been created",
+                timer.get_time(),
+                action=request["request_type"]
             )
+
+    def add_researcher(self, lead_researcher: str, researcher: str, timer: Timer) -> RequestResponse:
+        with self.lock:
+            #check if the requesting user is a lead resercher of member of an account
+            if lead_researcher not in self.researchers.keys() or self.researchers[lead_researcher] == None:
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"{lead_researcher} is not a Lead Researcher",
+                    timer.get_time()
+                )
         
-        #check that the end date did not expire
-        if account.end_date < timer.get_time():
-            return RequestResponse(
-                RequestStatus.FAILED.value, 
-                f"The end date for account '{account_name}' has passed!",
-                timer.get_time()
-            )
+            # check if researcher is already registered with another account
+            if researcher in self.researchers.keys() and self.researchers[researcher] != None :
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"{researcher} has already access to account '{self.researchers[researcher]}'",
+                    timer.get_time()
+                )
+        
+            #retrieve account name given lead researcher
+            account_name: str = self.researchers[lead_researcher]
+            #retrieve account given project name
+            account: ResearchAccount = self.accounts[account_name]
+
+            if researcher in account.users:
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"{researcher} has already access to account '{account_name}'",
+                    timer.get_time()
+                )
+            else:
+                #update list users and researcher project
+                self._apply_add_researcher(account.project_id, researcher)
+                self._log("add_researcher", account.project_id, researcher)
 
-        #get transaction id 
-        transaction_id: int = account.number_of_transactions     
+                return RequestResponse(
+                    RequestStatus.SUCCEEDED.value, 
+                    f"{researcher} has been added to account '{account_name}'",
+                    timer.get_time(),
+                    account_name
+                )
+
+    def remove_researcher(self, lead_researcher: str, researcher: str, timer: Timer) -> RequestResponse:        
+        with self.lock:
+            #check if the requesting user is a lead resercher of member of an account
+            if lead_researcher not in self.researchers.keys() or self.researchers[lead_researcher] == None:
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"{lead_researcher} is not a Lead Researcher",
+                    timer.get_time()
+                )
         
-        #register transaction
-        if account.budget >= int(amount):
-            account.budget -= int(amount)
-        else:
+            #retrieve account name given lead researcher
+            account_name: str = self.researchers[lead_researcher]
+            #retrieve account given project name
+            account: ResearchAccount = self.accounts[account_name]
+
+            if researcher in account.users:
+                self._apply_remove_researcher(account_name, researcher)
+                self._log("remove_researcher", account_name, researcher)
+            
+                return RequestResponse(
+                    RequestStatus.SUCCEEDED.value, 
+                    f"{researcher} has been removed from account '{account_name}'",
+                    timer.get_time(),
+                    account_name
+                )
+            else:
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"{researcher} does not have access to account '{account_name}'",
+                    timer.get_time()
+                )
+
+    def withdraw_funds(self, researcher: str, amount: int, timer: Timer) -> RequestResponse:
+        #check if researcher is registered with an account
+        account: ResearchAccount = self.get_account(researcher)
+        if account is None:
             return RequestResponse(
-                RequestStatus.FAILED.value,
-                f"Not enough budegt left in account '{account_name}'",
+                RequestStatus.FAILED.value, 
+                f"{researcher} has not access to any accounts",
                 timer.get_time()
             )
+        account_name: str = account.project_id
+
+        # operations on the same account are serialized
+        with account.lock:
+            # check that the user is either lead or member of the account
+            if researcher not in account.users and researcher != account.leading_researcher:
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"{researcher} has not access to account '{account_name}'",
+                    timer.get_time()
+                )
         
-        transaction = {
-            "researcher": researcher,
-            "date": timer.get_time_str(),
-            "amount": amount,
-            "status": RequestStatus.SUCCEEDED.value,
-            "budget": account.budget    #after the transaction
-        }
+            #check that the end date did not expire (the sweeper may not have run yet)
+            if account.expired or account.end_date < timer.get_time():
+                return RequestResponse(
+                    RequestStatus.FAILED.value, 
+                    f"The end date for account '{account_name}' has passed!",
+                    timer.get_time()
+                )
 
-        #register transaction
-        account.transactions[transaction_id] = transaction
+            if account.budget < int(amount):
+                return RequestResponse(
+                    RequestStatus.FAILED.value,
+                    f"Not enough budegt left in account '{account_name}'",
+                    timer.get_time()
+                )
+        
+            transaction = (
+                researcher,
+                timer.get_time().toordinal(),
+                int(amount),
+                account.budget - int(amount)    #after the transaction
+            )
 
-        #increase number of transactions
-        account.number_of_transactions += 1 
+            #register transaction and update the budget
+            self._apply_withdraw(account_name, *transaction)
+            self._log("withdraw", account_name, *transaction)
 
-        return RequestResponse(
-            RequestStatus.SUCCEEDED.value,
-            f"{amount} £ has been withdrawn from account '{account_name}'",
-            timer.get_time()
-        )
-    
-    def check_researcher_proposal(self, request: dict, timer: Timer) -> RequestResponse:
-        researcher = request['researcher']
-        if request["project_id"] in self.accounts.keys():
             return RequestResponse(
-                RequestStatus.REJECTED.value, 
-                f"An account with id '{request['project_id']}' already exists",
+                RequestStatus.SUCCEEDED.value,
+                f"{amount} £ has been withdrawn from account '{account_name}'",
                 timer.get_time()
             )
-        #check if the requesting user is a lead resercher of member of an account
-        if researcher not in self.researchers.keys() or self.researchers[researcher] == None:
-            return RequestResponse(
-                RequestStatus.APPROVED.value, 
-                f"{researcher} is not member of any accounts",
-                timer.get_time(),
-                action=request["request_type"]
-            )
-        else:
-            return RequestResponse(
-                RequestStatus.REJECTED.value, 
-                f"{researcher} has already access to account '{self.researchers[researcher]}'",
-                timer.get_time(),
-                action=request["request_type"]
-            )
+    
+    def check_researcher_proposal(self, request: dict, timer: Timer) -> RequestResponse:
+        with self.lock:
+            researcher = request['researcher']
+            if request["project_id"] in self.accounts.keys():
+                return RequestResponse(
+                    RequestStatus.REJECTED.value, 
+                    f"An account with id '{request['project_id']}' already exists",
+                    timer.get_time()
+                )
+            #check if the requesting user is a lead resercher of member of an account
+            if researcher not in self.researchers.keys() or self.researchers[researcher] == None:
+                return RequestResponse(
+                    RequestStatus.APPROVED.value, 
+                    f"{researcher} is not member of any accounts",
+                    timer.get_time(),
+                    action=request["request_type"]
+                )
+            else:
+                return RequestResponse(
+                    RequestStatus.REJECTED.value, 
+                    f"{researcher} has already access to account '{self.researchers[researcher]}'",
+                    timer.get_time(),
+                    action=request["request_type"]
+                )
         
     def record_request_result(self, correlation_id: str, result: dict, request_type: str) -> None:
-        #keep track of the last 10 requests
-        self.requests_history[self.number_of_requests % 10] = (correlation_id, result, request_type)
-        self.number_of_requests += 1
+        with self.lock:
+            recorded_at = time.time()
+            self._apply_request_result(correlation_id, result, request_type, recorded_at)
+            self._log("request_result", correlation_id, result, request_type, recorded_at)
 
-    def is_request_new(self, correlation_id: str, request_type: str) -> bool:
+    def previous_result(self, correlation_id: str, request_type: str) -> RequestResponse:
         """
-            Return false if the transaction has been already processed.
-            Return false if this is a new request.
+            Return the result of the request if it has been already processed.
+            Return None if this is a new request.
         """
-        for k, v in self.requests_history.items():
-            if v[0] == correlation_id and v[2] == request_type:
-                return False
-            
-        return True
-    
-    def get_request_metadata(self, correlation_id: str, request_type: str) -> dict:
-        for k, v in self.requests_history.items():
-            if v[0] == correlation_id and v[2] == request_type:
-                return v[1]
-            
-        return None
+        with self.lock:
+            return self.request_cache.lookup((correlation_id, request_type))
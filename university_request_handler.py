@@ -1,15 +1,13 @@
 #!/usr/bin/env python
 from __future__ import annotations
-from pika import BlockingConnection, ConnectionParameters
-from pika.spec import Basic, BasicProperties
-from pika.adapters.blocking_connection import BlockingChannel
 from actions import Actions
-from datetime import datetime
 from university_database import UniversityDatabase
 from abc import ABC, abstractmethod
-from request_response import RequestResponse
+from request_response import RequestResponse, StreamedResponse
 from request_status import RequestStatus
 from timer import Timer
+from connection_pool import pool
+from codec import parse_date
 import json
 
 class IHandler(ABC):
@@ -18,26 +16,21 @@ class IHandler(ABC):
         pass
 
     @abstractmethod
-    def set_next_handler(self, handler: IHandler) -> IHandler:
-        pass
-    
-    @abstractmethod
-    def execute_request(self, message: str, database: UniversityDatabase, timer: Timer) -> None:
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
         pass
 
 class UniversityRequestHandler(IHandler):
-    _next_handler: IHandler = None
+    # action served by the handler and fields the request must contain
+    action: Actions = None
+    required_fields: tuple = ()
 
     def send_notification(self, routing_key: str, request: dict) -> None:
         """
             Notify researcher that has been added or removed from the research account
         """
-        connection = BlockingConnection(ConnectionParameters(host='localhost'))
-        channel = connection.channel()
-        
-        channel.exchange_declare(exchange='send_researchers_command', exchange_type='direct')
+        pool.declare_exchange('send_researchers_command', 'direct')
 
-        channel.basic_publish(
+        pool.publish(
             exchange='send_researchers_command', 
             routing_key=routing_key,
             body=json.dumps(request)
@@ -45,80 +38,125 @@ class UniversityRequestHandler(IHandler):
                         
         print(" [U] Sent %r:%r" % (routing_key, request))
 
-        connection.close()
-    
-    def set_next_handler(self, handler: IHandler) -> IHandler:
-        self._next_handler = handler
-        return handler
-    
-    def execute_request(self, message: str, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if self._next_handler is not None:
-            return self._next_handler.execute_request(message, database, timer)
-        return None
-
 class CreateAccountHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.CREATE_ACCOUNT.value:
-            result = database.create_research_account(request,  datetime.strptime(request['end_date'], '%d-%m-%Y').date(), timer)
-            database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+    action = Actions.CREATE_ACCOUNT
+    required_fields = ("correlation_id", "project_id", "title", "description", "budget", "researcher", "end_date")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.create_research_account(request,  parse_date(request['end_date']), timer)
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
 
 class WithdrawHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.WITHDRAW.value:
-            result = database.withdraw_funds(request['researcher'], request['amount'], timer)
-            database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+    action = Actions.WITHDRAW
+    required_fields = ("correlation_id", "researcher", "amount")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.withdraw_funds(request['researcher'], request['amount'], timer)
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
 
 class AddResearcherHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.ADD_RESEARCHER.value:
-            result = database.add_researcher(request['researcher'], request['target_researcher'], timer)
-            if result.status == RequestStatus.SUCCEEDED.value:
-                self.send_notification(request['target_researcher'], {"command": Actions.ADD_RESEARCH_ACCOUNT.value, "account": result.account})
-            database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+    action = Actions.ADD_RESEARCHER
+    required_fields = ("correlation_id", "researcher", "target_researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.add_researcher(request['researcher'], request['target_researcher'], timer)
+        if result.status == RequestStatus.SUCCEEDED.value:
+            self.send_notification(request['target_researcher'], {"command": Actions.ADD_RESEARCH_ACCOUNT.value, "account": result.account})
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
     
 class RemoveResearcherHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.REMOVE_RESEARCHER.value:
-            result = database.remove_researcher(request['researcher'], request['target_researcher'], timer)
-            if result.status == RequestStatus.SUCCEEDED.value:
-                self.send_notification(request['target_researcher'], {"command": Actions.REMOVE_RESEARCH_ACCOUNT.value, "account": result.account})
-            database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+    action = Actions.REMOVE_RESEARCHER
+    required_fields = ("correlation_id", "researcher", "target_researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.remove_researcher(request['researcher'], request['target_researcher'], timer)
+        if result.status == RequestStatus.SUCCEEDED.value:
+            self.send_notification(request['target_researcher'], {"command": Actions.REMOVE_RESEARCH_ACCOUNT.value, "account": result.account})
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
     
 class GetDetailsHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.GET_DETAILS.value:
-            result = database.access_details(request['researcher'], timer)
-            database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+    action = Actions.GET_DETAILS
+    required_fields = ("correlation_id", "researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.access_details(request['researcher'], timer)
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
     
 class ListTransactionsHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.LIST_TRANSACTIONS.value:
-            result = database.list_transactions(request['researcher'], timer)
+    action = Actions.LIST_TRANSACTIONS
+    required_fields = ("correlation_id", "researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        # pages start after the last transaction id already seen
+        offset = request.get("offset") or 0
+        result = database.list_transactions(
+            request['researcher'],
+            timer,
+            offset=int(offset),
+            limit=None if request.get("limit") is None else int(request["limit"]),
+            stream=bool(request.get("stream", False)),
+            chunk_size=int(request.get("chunk_size") or 100)
+        )
+        # a stream is rendered while it is sent, it is not kept: a redelivery lists again
+        if not isinstance(result, StreamedResponse):
             database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+        return result
         
+class ListAccountsHandler(UniversityRequestHandler):
+    action = Actions.LIST_ACCOUNTS
+    required_fields = ("correlation_id", "researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.list_accounts(
+            request['researcher'],
+            timer,
+            expiring_from=None if request.get("expiring_from") is None else parse_date(request["expiring_from"]),
+            expiring_to=None if request.get("expiring_to") is None else parse_date(request["expiring_to"]),
+            lead=request.get("lead")
+        )
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
+
+class QueryTransactionsHandler(UniversityRequestHandler):
+    action = Actions.QUERY_TRANSACTIONS
+    required_fields = ("correlation_id", "researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        # the transactions are filtered by target_researcher, the researcher is the requester
+        offset = request.get("offset") or 0
+        result = database.query_transactions(
+            request['researcher'],
+            timer,
+            researcher=request.get("target_researcher"),
+            first_day=None if request.get("from_date") is None else parse_date(request["from_date"]),
+            last_day=None if request.get("to_date") is None else parse_date(request["to_date"]),
+            min_amount=None if request.get("min_amount") is None else int(request["min_amount"]),
+            max_amount=None if request.get("max_amount") is None else int(request["max_amount"]),
+            offset=int(offset),
+            limit=None if request.get("limit") is None else int(request["limit"])
+        )
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
+
+class SpendingReportHandler(UniversityRequestHandler):
+    action = Actions.SPENDING_REPORT
+    required_fields = ("correlation_id", "researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.spending_report(request['researcher'], timer)
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
+
 class ResearcherProposalHandler(UniversityRequestHandler):
-    def execute_request(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
-        if request['request_type'] == Actions.NOTIFY_RESEARCHER_PROPOSAL.value:
-            result = database.check_researcher_proposal(request, timer)
-            database.record_request_result(request["correlation_id"], result, request['request_type'])
-            return result
-        else:
-            return super().execute_request(request, database, timer)
+    action = Actions.NOTIFY_RESEARCHER_PROPOSAL
+    required_fields = ("correlation_id", "project_id", "researcher")
+
+    def handle(self, request: dict, database: UniversityDatabase, timer: Timer) -> RequestResponse:
+        result = database.check_researcher_proposal(request, timer)
+        database.record_request_result(request["correlation_id"], result, request['request_type'])
+        return result
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+from pika.spec import Basic, BasicProperties, PERSISTENT_DELIVERY_MODE
+from pika.adapters.blocking_connection import BlockingChannel
+from consistent_hash import HashRing
+from sharding import SHARDS_EXCHANGE, DIRECTORY_QUEUE, DIRECTORY_FILE, declare_directory, shard_ring, shard_name, shard_queue
+from actions import Actions, WRITE_QUEUE, READ_QUEUE
+from request_status import RequestStatus
+from request_response import RequestResponse
+from codec import codec_for, decode, parse_date
+from transport import connect
+import argparse
+import json
+import os
+import pickle
+
+class UniversityRouter(object):
+    """
+        Routes the requests of university_requests_queue to the shard that owns the account.
+        Read-only requests of university_read_requests_queue are routed the same way, the shard
+        hands them over to its read lane.
+
+        Accounts are partitioned by consistent hashing of the project_id. Requests that only
+        carry the researcher are routed through the researcher->account directory, which is
+        kept up to date by the shards after each commit. The changes wait in a durable queue
+        while the router is down; they are saved in batches and acked once saved.
+
+        A researcher can be member of only one account, the router checks it across shards:
+            - a proposal of a researcher that already has an account goes to the shard of that account (rejected there)
+            - a researcher that has access to an account of another shard cannot be added to an account
+    """
+
+    # changes of the directory saved together, or after save_interval seconds
+    SAVE_BATCH: int = 100
+
+    ring: HashRing
+    # k = researcher, v = project_id
+    directory: dict
+    connection: object
+    save_interval: float
+    # changes applied to the directory and not saved yet, delivery tag of the last one
+    unsaved: int
+    last_update_tag: int
+    save_timer: object
+
+    def __init__(self, shards: int, save_interval: float = 0.1) -> None:
+        self.ring = shard_ring(shards)
+        self.save_interval = save_interval
+        self.unsaved = 0
+        self.last_update_tag = None
+        self.save_timer = None
+        try:
+            with open(DIRECTORY_FILE, 'rb') as f:
+                self.directory = pickle.load(f)
+        except FileNotFoundError:
+            self.directory = {}
+
+    def start(self) -> None:
+        #Connect to RabbitMQ
+        connection = self.connection = connect()
+        channel = connection.channel()
+
+        channel.queue_declare(queue=WRITE_QUEUE)
+        channel.queue_declare(queue=READ_QUEUE)
+        channel.exchange_declare(exchange=SHARDS_EXCHANGE, exchange_type='direct')
+
+        # declare the shard queues, requests are not lost if the router starts before the shards
+        for index in range(len(self.ring.nodes)):
+            channel.queue_declare(queue=shard_queue(index))
+            channel.queue_bind(exchange=SHARDS_EXCHANGE, queue=shard_queue(index), routing_key=shard_name(index))
+
+        # changes of the directory published by the shards, on their own channel: they are acked in bulk
+        directory_channel = connection.channel()
+        declare_directory(directory_channel)
+        directory_channel.basic_qos(prefetch_count=self.SAVE_BATCH)
+        directory_channel.basic_consume(queue=DIRECTORY_QUEUE, on_message_callback=self.update_directory)
+
+        channel.basic_qos(prefetch_count=100)
+        channel.basic_consume(queue=WRITE_QUEUE, on_message_callback=self.route_request)
+        channel.basic_consume(queue=READ_QUEUE, on_message_callback=self.route_request)
+
+        print(f" [R] Routing requests to {len(self.ring.nodes)} shards")
+        channel.start_consuming()
+
+    def update_directory(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        update = json.loads(body)
+        self.directory[update["researcher"]] = update["project_id"]
+        self.unsaved += 1
+        self.last_update_tag = method.delivery_tag
+
+        if self.unsaved >= self.SAVE_BATCH:
+            self.save_directory(ch)
+        elif self.save_timer is None:
+            self.save_timer = self.connection.call_later(self.save_interval, lambda: self.on_save_timer(ch))
+
+    def on_save_timer(self, ch: BlockingChannel) -> None:
+        self.save_timer = None
+        self.save_directory(ch)
+
+    def save_directory(self, ch: BlockingChannel) -> None:
+        """
+            Save the directory, then ack every change it contains
+        """
+        if self.save_timer is not None:
+            self.connection.remove_timeout(self.save_timer)
+            self.save_timer = None
+        if not self.unsaved:
+            return
+
+        tmp_file = f"{DIRECTORY_FILE}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(self.directory, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, DIRECTORY_FILE)
+
+        ch.basic_ack(delivery_tag=self.last_update_tag, multiple=True)
+        self.unsaved = 0
+
+    def owner(self, request: dict) -> str:
+        """
+            Returns the shard that owns the account targeted by the request
+        """
+        researcher_account = self.directory.get(request["researcher"])
+
+        if request["request_type"] == Actions.CREATE_ACCOUNT.value:
+            return self.ring.get_node(request["project_id"])
+
+        if request["request_type"] == Actions.NOTIFY_RESEARCHER_PROPOSAL.value:
+            # the shard of the current account of the researcher rejects the proposal
+            return self.ring.get_node(researcher_account or request["project_id"])
+
+        if request["request_type"] == Actions.LIST_ACCOUNTS.value and request.get("lead") is not None:
+            # the accounts of a lead researcher are on the shard of its account
+            researcher_account = self.directory.get(request["lead"], researcher_account)
+
+        if researcher_account is None:
+            # researcher without account, any shard answers that it has no access
+            return self.ring.get_node(request["researcher"])
+
+        return self.ring.get_node(researcher_account)
+
+    def route_request(self, ch: BlockingChannel, method: Basic.Deliver, props: BasicProperties, body: bytes) -> None:
+        request = decode(body, props.content_type)
+        shard = self.owner(request)
+
+        if request["request_type"] == Actions.ADD_RESEARCHER.value:
+            target_account = self.directory.get(request["target_researcher"])
+            if target_account is not None and self.ring.get_node(target_account) != shard:
+                self.reject(ch, props, request, f"{request['target_researcher']} has already access to account '{target_account}'")
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+
+        ch.basic_publish(
+            exchange=SHARDS_EXCHANGE,
+            routing_key=shard,
+            properties=props,
+            body=body
+        )
+
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def reject(self, ch: BlockingChannel, props: BasicProperties, request: dict, message: str) -> None:
+        response = RequestResponse(
+            RequestStatus.FAILED.value,
+            message,
+            parse_date(request["timestamp"])
+        )
+
+        ch.basic_publish(exchange='',
+            routing_key=props.reply_to,
+            properties=BasicProperties(
+                correlation_id = props.correlation_id,
+                content_type=codec_for(props.content_type).content_type,
+                delivery_mode = PERSISTENT_DELIVERY_MODE
+                ),
+            body=response.encode(props.content_type)
+        )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, required=True, help="number of university shards")
+    parser.add_argument("--save-interval", type=float, default=0.1, help="maximum seconds a change of the directory waits to be saved")
+    args = parser.parse_args()
+
+    router = UniversityRouter(args.shards, args.save_interval)
+    router.start()